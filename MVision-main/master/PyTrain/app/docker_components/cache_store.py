@@ -0,0 +1,90 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+try:
+  from load_data import ClipOffsets, FramesFromFile
+except ImportError:
+  # Imported by PyTrain as docker_components.cache_store to fill shards at ingest
+  from .load_data import ClipOffsets, FramesFromFile
+
+CACHE_VERSION = "uint8-letterbox-1"
+
+class ClipCache:
+  """Class to store decoded clips shared by every training task, one uint8 .npy of offsetCount clips per video and sampling
+    Entries are named by a fingerprint of the video (name, size and modification time) and how it is sampled (frame count, resolution, frame step, offsets),
+    so tasks selecting the same videos reuse each others decoded clips, whichever task folder or split the videos were copied to.
+    Each time an entry is used its modification time is updated and once the store exceeds its budget the least recently used entries are removed.
+    Args:
+        root string: directory of the store (mounted into each training container at /cache)
+        budgetBytes int: size the store is kept within
+  """
+  def __init__(self, root = "/cache", budgetBytes = 50 * 1024 ** 3):
+    self.root = root
+    self.budgetBytes = budgetBytes
+    os.makedirs(root, exist_ok = True)
+
+  def Fingerprint(self, videoPath, frameCount, outputSize, frameStep, offsetCount):
+    stat = os.stat(videoPath)
+    key = [os.path.basename(str(videoPath)), stat.st_size, int(stat.st_mtime), frameCount, list(outputSize), frameStep, offsetCount, CACHE_VERSION]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+  def GetClips(self, videoPath, frameCount, outputSize = (224,224), frameStep = 5, offsetCount = 1):
+    """Function to get the clips of a video, decoding and storing them if they are not in the store
+        1. Fingerprint the video and sampling
+        2. If stored, mark the entry as used and return it memory mapped
+        3. Otherwise decode offsetCount clips spread over the video
+        4. Write them to a temporary file and rename it into place, so other tasks never read a partial entry
+        5. Evict the least recently used entries if the store is over budget
+    Args:
+        videoPath pathlib.Path: path of the video
+        frameCount int: number of frames in each clip
+        outputSize tuple: height and width of the frames
+        frameStep int: number of video frames between each frame
+        offsetCount int: number of clips taken from the video
+    Returns:
+        array: (offsetCount, frameCount, height, width, 3) uint8 clips
+    """
+    entryPath = os.path.join(self.root, f"{self.Fingerprint(videoPath, frameCount, outputSize, frameStep, offsetCount)}.npy")
+    try:
+      clips = np.load(entryPath, mmap_mode = 'r')
+      os.utime(entryPath)
+      return clips
+    except (FileNotFoundError, ValueError):
+      pass
+
+    clips = np.zeros((offsetCount, frameCount, outputSize[0], outputSize[1], 3), dtype = np.uint8)
+    for index, start in enumerate(ClipOffsets(videoPath, frameCount, frameStep, offsetCount, unique = False)):
+      FramesFromFile(videoPath, frameCount, outputSize, frameStep, start = start, out = clips[index])
+    temporaryPath = f"{entryPath}.{os.getpid()}.tmp"
+    with open(temporaryPath, 'wb') as entryFile:
+      np.save(entryFile, clips)
+    os.replace(temporaryPath, entryPath)
+    self.Evict(keep = entryPath)
+    return clips
+
+  def Evict(self, keep = None):
+    """Function to remove the least recently used entries until the store is within its budget
+    Args:
+        keep string: path of an entry that must not be removed (the one just written)
+    """
+    entries = []
+    for entry in os.scandir(self.root):
+      if entry.name.endswith(".npy"):
+        try:
+          stat = entry.stat()
+        except FileNotFoundError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.budgetBytes:
+        break
+      if path == keep:
+        continue
+      try:
+        os.remove(path)
+        total -= size
+      except FileNotFoundError:
+        pass
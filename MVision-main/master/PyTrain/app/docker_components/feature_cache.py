@@ -0,0 +1,141 @@
+import json
+import os
+import hashlib
+import pathlib
+import random
+
+import numpy as np
+import tensorflow as tf
+
+from load_data import FrameGenerator, FramesFromFile, ClipOffsets
+
+def BackboneName(extractor):
+    """Function to get the name of the backbone nested in the extractor (i.e efficientnetb0), the extractor name if it has none"""
+    return next((layer.name for layer in extractor.layers if isinstance(layer, tf.keras.Model)), extractor.name)
+
+def FeatureCacheFolder(cacheRoot, extractor, frameCount, outputSize=(224,224), frameStep=5):
+    """Function to get the folder of the feature caches made by a backbone at an input size and frame sampling, shared by every model and task
+    Args:
+        cacheRoot string: directory of the clip cache (i.e /cache)
+        extractor keras.Model: frozen backbone taking single frames and returning their features
+        frameCount int: number of frames in each window
+        outputSize tuple: height and width frames are resized to
+        frameStep int: number of video frames between each gathered frame
+    Returns:
+        string: path of the folder
+    """
+    return os.path.join(cacheRoot, "features", f"{BackboneName(extractor)}_{outputSize[0]}x{outputSize[1]}_f{frameCount}_s{frameStep}")
+
+def VideoFingerprint(videoPath):
+    """Function to identify a video by its name, size and modification time (as the clip cache does)"""
+    stat = os.stat(videoPath)
+    return [os.path.basename(str(videoPath)), stat.st_size, int(stat.st_mtime)]
+
+def BuildFeatureCache(extractor, path, cacheFolder, split, frameCount, outputSize=(224,224), frameStep=5, offsetCount=1):
+    """Function to run the frozen backbone once over every clip of a dataset split and store the per frame features
+       Features are stored as float16 in {cacheFolder}/{split}_{digest}.npy, one (frameCount, featureSize) row per clip and offset,
+       and indexed by the .json of the same name. The digest is taken over the index, which holds the fingerprint of each video,
+       so any later run (of any model or task) over the same videos, offsets and labels reuses the cache, and changed videos are extracted again.
+    1. List the clips of the split, their fingerprints and the offsets each is sampled from
+    2. Reuse the cache named by the digest of the index if its index matches
+    3. Otherwise extract the frames of each window and write their backbone features into a memory mapped temporary array, renamed into place once written
+    4. Write the index last, so an interrupted cache is never reused
+    Args:
+        extractor keras.Model: frozen backbone taking single frames and returning their features
+        path pathlib.Path: path of the split (i.e /mnt/train)
+        cacheFolder string: folder of the feature caches (see FeatureCacheFolder)
+        split string: name of the split (train, validation or test)
+        frameCount int: number of frames in each window
+        outputSize tuple: height and width frames are resized to
+        frameStep int: number of video frames between each gathered frame
+        offsetCount int: number of windows cached from each clip
+    Returns:
+        string: cachePath
+    """
+    generator = FrameGenerator(path, frameCount, frameStep=frameStep)
+    videoPaths, classes = generator.GetFilesandClasses()
+    entries = []
+    clipPaths = {}
+    for videoPath, name in zip(videoPaths, classes):
+        clip = f"{name}/{videoPath.name}"
+        clipPaths[clip] = videoPath
+        for offset in ClipOffsets(videoPath, frameCount, frameStep, offsetCount):
+            entries.append({'clip': clip, 'video': VideoFingerprint(videoPath), 'offset': offset, 'label': generator.classNameIDs[name]})
+    index = {
+        'frame_count': frameCount,
+        'frame_step': frameStep,
+        'output_size': list(outputSize),
+        'feature_size': int(extractor.output_shape[-1]),
+        'entries': entries
+    }
+    digest = hashlib.sha256(json.dumps(index).encode()).hexdigest()[:16]
+    cachePath = os.path.join(cacheFolder, f"{split}_{digest}")
+    if os.path.exists(f"{cachePath}.json"):
+        with open(f"{cachePath}.json") as indexFile:
+            if json.load(indexFile) == index:
+                print(f"Reusing feature cache {cachePath}")
+                return cachePath
+        os.remove(f"{cachePath}.json")
+
+    os.makedirs(cacheFolder, exist_ok=True)
+    temporaryPath = f"{cachePath}.{os.getpid()}.tmp"
+    features = np.lib.format.open_memmap(temporaryPath, mode='w+', dtype=np.float16, shape=(len(entries), frameCount, index['feature_size']))
+    for row, entry in enumerate(entries):
+        frames = FramesFromFile(clipPaths[entry['clip']], frameCount, outputSize, frameStep, start=entry['offset'])
+        features[row] = extractor(tf.image.convert_image_dtype(frames, tf.float32), training=False).numpy()
+    features.flush()
+    del features
+    os.replace(temporaryPath, f"{cachePath}.npy")
+    with open(f"{cachePath}.json", 'w') as indexFile:
+        json.dump(index, indexFile)
+    print(f"Cached features for {len(entries)} windows of {path}")
+    return cachePath
+
+class FeatureGenerator:
+    """Class to read cached backbone features into tf.dataframe acceptable format, one window per clip
+    Args:
+        cachePath string: path of the cache files without extension
+        training bool: indicates if training collection or not, if it is, clip order is shuffled and a random cached offset is taken from each clip
+    """
+    def __init__(self, cachePath, training=False):
+        with open(f"{cachePath}.json") as indexFile:
+            self.index = json.load(indexFile)
+        self.features = np.load(f"{cachePath}.npy", mmap_mode='r')
+        self.training = training
+        self.clips = {}
+        for row, entry in enumerate(self.index['entries']):
+            self.clips.setdefault(entry['clip'], []).append(row)
+
+    def __call__(self):
+        clips = list(self.clips.values())
+        if self.training:
+            random.shuffle(clips)
+        for rows in clips:
+            row = random.choice(rows) if self.training else rows[0]
+            yield self.features[row].astype(np.float32), self.index['entries'][row]['label']
+
+def ExtractFeatures(folderPath, cacheRoot, extractor, frameCount, outputSize=(224,224), frameStep=5, offsetCount=1):
+    """Function to cache the backbone features of each split and retrieve them as datasets in a tfDataset format
+       1. Build (or reuse) the feature cache of the train, validation and test splits, offsetCount windows are cached for each training clip
+       2. Load in trainDS, takes additional "training=True" flag to enable shuffle and offset sampling
+       3. Load in valDS and testDS without shuffle
+       4. Return datasets
+    Args:
+        folderPath string: path of dataset location
+        cacheRoot string: directory of the clip cache (i.e /cache), the feature caches are kept in a folder of it named by the backbone, input size and sampling
+        extractor keras.Model: frozen backbone taking single frames and returning their features
+        frameCount int: number of frames to be extracted from each video
+        outputSize tuple: height and width frames are resized to
+        frameStep int: number of video frames between each extracted frame
+        offsetCount int: number of windows cached for each training clip
+    Return:
+        tfDataset: trainDS, valDS, testDS
+    """
+    outputSignature = (tf.TensorSpec(shape = (frameCount, extractor.output_shape[-1]), dtype = tf.float32),
+                        tf.TensorSpec(shape = (), dtype = tf.int16))
+    cacheFolder = FeatureCacheFolder(cacheRoot, extractor, frameCount, outputSize, frameStep)
+    datasets = []
+    for split, training, offsets in (("train", True, offsetCount), ("validation", False, 1), ("test", False, 1)):
+        cachePath = BuildFeatureCache(extractor, pathlib.Path(folderPath) / split, cacheFolder, split, frameCount, outputSize, frameStep, offsets)
+        datasets.append(tf.data.Dataset.from_generator(FeatureGenerator(cachePath, training), output_signature = outputSignature))
+    return tuple(datasets)
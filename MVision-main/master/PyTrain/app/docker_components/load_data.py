@@ -1,6 +1,13 @@
-import tensorflow as tf
 import cv2
+import os
+import json
+import time
+import queue
 import random
+import weakref
+import multiprocessing
+from multiprocessing import shared_memory
+import pathlib
 import numpy as np 
 
 class FrameGenerator:
@@ -9,65 +16,522 @@ class FrameGenerator:
         path string: path of videos to intake 
         frameCount int: how many frames should be gathered from each video
         training bool: indicates if training collection or not, if it is, order file collection is shuffled
+        frameStep int: number of video frames between each gathered frame, recorded with the model so PyDeploy samples at the same rate
+        cache ClipCache: store of decoded clips shared between tasks, None to decode a random clip of each video every time
+        offsetCount int: number of clips stored for each video, one is chosen at random each epoch when training (the first otherwise)
+        seed int: seed for the clip order, offset choices and start frames, each epoch is seeded with seed + epoch (random if None)
 
         Based off of the following TensorFlow Tutorial: https://github.com/tensorflow/docs/blob/master/site/en/tutorials/load_data/video.ipynb
   """
-  def __init__(self, path, frameCount, training = False):
+  def __init__(self, path, frameCount, training = False, frameStep = 5, cache = None, offsetCount = 1, seed = None):
     self.path = path
     self.frameCount = frameCount
     self.training = training
+    self.frameStep = frameStep
+    self.cache = cache
+    self.offsetCount = offsetCount
+    self.seed = seed
+    self.epoch = 0
     self.classNames = sorted(set(p.name for p in self.path.iterdir() if p.is_dir()))
     self.classNameIDs = dict((name, idx) for idx, name in enumerate(self.classNames))
 
   def GetFilesandClasses(self):
-    videoPaths = list(self.path.glob('*/*.mp4'))
-    classes = [p.parent.name for p in videoPaths] 
-    return videoPaths, classes
+    return ListVideos(self.path)
+
+  def EpochRandom(self):
+    """Function to get the random generator for the next epoch, seeded with seed + epoch so runs repeat whilst epochs differ"""
+    rng = random.Random(None if self.seed is None else self.seed + self.epoch)
+    self.epoch += 1
+    return rng
 
   def __call__(self):
     videoPaths, classes = self.GetFilesandClasses()
 
-    pairs = list(zip(videoPaths, classes))
+    pairs = sorted(zip(videoPaths, classes))
+    rng = self.EpochRandom()
 
     if self.training:
-      random.shuffle(pairs)
+      rng.shuffle(pairs)
 
     for path, name in pairs:
-      videoFrames = FramesFromFile(path, self.frameCount) 
+      choice = rng.randrange(self.offsetCount) if self.training else 0
+      videoFrames = LoadClip(path, self.frameCount, (224,224), self.frameStep, self.cache, self.offsetCount, choice, rng = rng) 
       label = self.classNameIDs[name] 
       yield videoFrames, label
 
 
-def FormatFrames(frame, outputSize):
-  frame = tf.image.convert_image_dtype(frame, tf.float32)
-  frame = tf.image.resize_with_pad(frame, *outputSize)
-  return frame
+class ParallelFrameGenerator(FrameGenerator):
+  """Class to handle frame extraction across a pool of worker processes, yielding clips in the same form and order as FrameGenerator
+    Clips are handed to the workers in order, each with one of a ring of shared memory slots to decode into,
+    so decoding scales with the CPU cores whilst only the finished clip is copied out of the slot by this process.
+    Workers are started with spawn rather than forked from the training process (which has TensorFlow and CUDA initialised),
+    and are kept for the life of the generator so they start once rather than every epoch.
+    With a seed the clip order and the start frame chosen for each clip are the same on every run (varying between epochs).
+    Args:
+        path string: path of videos to intake 
+        frameCount int: how many frames should be gathered from each video
+        training bool: indicates if training collection or not, if it is, order file collection is shuffled
+        frameStep int: number of video frames between each gathered frame
+        workers int: number of decoding processes, one per CPU core if None
+        seed int: seed for the clip order and start frames, random if None
+        outputSize tuple: height and width of the output frames
+        cache ClipCache: store of decoded clips shared between tasks
+        offsetCount int: number of clips stored for each video
+        timeout float: seconds to wait for a clip before the workers are presumed hung
+  """
+  def __init__(self, path, frameCount, training = False, frameStep = 5, workers = None, seed = None, outputSize = (224,224), cache = None, offsetCount = 1, timeout = 600):
+    super().__init__(path, frameCount, training, frameStep, cache, offsetCount, seed)
+    self.workers = workers or os.cpu_count() or 1
+    self.outputSize = outputSize
+    self.timeout = timeout
+    self.processes = None
+
+  def StartWorkers(self):
+    """Function to create the shared memory slots and start the decoding processes, stopped by StopWorkers or once the generator is collected"""
+    shape = (self.frameCount, self.outputSize[0], self.outputSize[1], 3)
+    self.slots = [shared_memory.SharedMemory(create = True, size = int(np.prod(shape))) for _ in range(2 * self.workers)]
+    context = multiprocessing.get_context('spawn')
+    self.tasks = context.Queue()
+    self.results = context.Queue()
+    self.processes = [context.Process(target = DecodeClips, args = (self.tasks, self.results, [slot.name for slot in self.slots], self.frameCount, self.outputSize, self.frameStep, self.cache, self.offsetCount), daemon = True)
+                      for _ in range(self.workers)]
+    for process in self.processes:
+      process.start()
+    self.finaliser = weakref.finalize(self, StopDecoders, self.tasks, self.processes, self.slots)
+
+  def StopWorkers(self):
+    if self.processes is not None:
+      self.finaliser()
+      self.processes = None
+
+  def NextResult(self):
+    """Function to wait for the next decoded clip, raising if a worker has exited or no clip arrives within timeout seconds"""
+    deadline = time.monotonic() + self.timeout
+    while True:
+      try:
+        return self.results.get(timeout = 1)
+      except queue.Empty:
+        exitCodes = [process.exitcode for process in self.processes if not process.is_alive()]
+        if exitCodes:
+          raise RuntimeError(f"Decoding worker exited with code {exitCodes[0]}")
+        if time.monotonic() > deadline:
+          raise RuntimeError(f"No clip decoded within {self.timeout} seconds")
+
+  def __call__(self):
+    videoPaths, classes = self.GetFilesandClasses()
+
+    pairs = sorted(zip(videoPaths, classes))
+    rng = self.EpochRandom()
+
+    if self.training:
+      rng.shuffle(pairs)
+
+    if self.processes is None:
+      self.StartWorkers()
+    shape = (self.frameCount, self.outputSize[0], self.outputSize[1], 3)
+    views = [np.ndarray(shape, dtype = np.uint8, buffer = slot.buf) for slot in self.slots]
+    free = list(range(len(self.slots)))
+    slotOfClip = {}
+    finished = {}
+    submitted = 0
+    try:
+      for index, (path, name) in enumerate(pairs):
+        while free and submitted < len(pairs):
+          slotOfClip[submitted] = free.pop()
+          clipSeed = None if self.seed is None else rng.randrange(2 ** 32)
+          choice = rng.randrange(self.offsetCount) if self.training else 0
+          self.tasks.put((submitted, str(pairs[submitted][0]), slotOfClip[submitted], clipSeed, choice))
+          submitted += 1
+        while index not in finished:
+          clipIndex, error = self.NextResult()
+          finished[clipIndex] = error
+        error = finished.pop(index)
+        slot = slotOfClip.pop(index)
+        if error is None:
+          yield views[slot].copy(), self.classNameIDs[name]
+        else:
+          print(f"Failed to decode {path}: {error}")
+        free.append(slot)
+    except BaseException:
+      # Failed, hung or abandoned part way, clips may still be decoding into the slots so the workers are restarted next epoch
+      del views
+      self.StopWorkers()
+      raise
+    del views
+
+def StopDecoders(tasks, processes, slots):
+  """Function to stop the ParallelFrameGenerator workers and release their shared memory slots
+  Args:
+      tasks Queue: queue the workers take clips from
+      processes array: decoding processes
+      slots array: shared memory slots
+  """
+  for _ in processes:
+    tasks.put(None)
+  for process in processes:
+    process.join(timeout = 5)
+    if process.is_alive():
+      process.terminate()
+  for slot in slots:
+    slot.close()
+    slot.unlink()
+
+def DecodeClips(tasks, results, slotNames, frameCount, outputSize, frameStep, cache = None, offsetCount = 1):
+  """Function run by each ParallelFrameGenerator worker process
+      1. Attach to the shared memory slots
+      2. Load each clip it is given straight into its slot, from the cache or decoded with its start frame seeded if a seed is given
+      3. Report the clip index (and error if it failed) until it is given None
+  Args:
+      tasks Queue: (index, path, slot, seed, offset choice) of clips to decode
+      results Queue: (index, error) of decoded clips
+      slotNames array: names of the shared memory slots
+      frameCount int: number of frames to sample
+      outputSize tuple: height and width of the output frames
+      frameStep int: number of video frames between each sampled frame
+      cache ClipCache: store of decoded clips shared between tasks
+      offsetCount int: number of clips stored for each video
+  """
+  cv2.setNumThreads(1)
+  shape = (frameCount, outputSize[0], outputSize[1], 3)
+  slots = [shared_memory.SharedMemory(name = name) for name in slotNames]
+  views = [np.ndarray(shape, dtype = np.uint8, buffer = slot.buf) for slot in slots]
+  try:
+    while True:
+      task = tasks.get()
+      if task is None:
+        return
+      index, path, slot, seed, choice = task
+      try:
+        LoadClip(path, frameCount, outputSize, frameStep, cache, offsetCount, choice, views[slot], random.Random(seed))
+        results.put((index, None))
+      except Exception as e:
+        results.put((index, str(e)))
+  finally:
+    del views
+    for slot in slots:
+      slot.close()
+
+class ShardGenerator(FrameGenerator):
+  """Class to read clips decoded at ingest (see WriteShards) in the same form as FrameGenerator, without running the video codec
+    The shards of a split are memory mapped and each clip is yielded as a view of its shard.
+    When training the clip order is shuffled and one of the offsets decoded for each video is chosen at random, otherwise the first offset is used.
+    Args:
+        path string: path of videos to intake (the shards are read from shards/{split} alongside it)
+        frameCount int: how many frames should be gathered from each video
+        training bool: indicates if training collection or not
+        frameStep int: number of video frames between each gathered frame
+        seed int: seed for the clip order and offset choices
+  """
+  def __init__(self, path, frameCount, training = False, frameStep = 5, seed = None):
+    super().__init__(path, frameCount, training, frameStep, seed = seed)
+    self.index = ReadShardIndex(path)
+    self.shardDirectory = ShardDirectory(path)
+    self.videos = {}
+    for entry in self.index['entries']:
+      self.videos.setdefault(entry['clip'], []).append(entry)
+
+  def __call__(self):
+    shards = [np.load(os.path.join(self.shardDirectory, shard), mmap_mode = 'r') for shard in self.index['shards']]
+    videos = list(self.videos.values())
+    rng = self.EpochRandom()
+
+    if self.training:
+      rng.shuffle(videos)
+
+    for entries in videos:
+      entry = rng.choice(entries) if self.training else entries[0]
+      yield shards[entry['shard']][entry['row']], self.classNameIDs[entry['label']]
+
+def ListVideos(path):
+  """Function to list the videos of a split and their classes
+      Read from the task manifest if one was written by PyTrain (see ReadManifest), otherwise the mp4 files in the class folders of the split
+  Args:
+      path pathlib.Path: path of the split
+  Returns:
+      array: video paths
+      array: class of each video
+  """
+  manifest = ReadManifest(path)
+  if manifest is not None:
+    return [videoPath for videoPath, _ in manifest], [className for _, className in manifest]
+  videoPaths = list(pathlib.Path(path).glob('*/*.mp4'))
+  classes = [p.parent.name for p in videoPaths] 
+  return videoPaths, classes
+
+def ReadManifest(path, sourcesMount = "/sources"):
+  """Function to read the videos of a split from the manifest.json of its task folder
+      Each video is read from its link in the task folder if it has one, otherwise straight from the sources folder,
+      at its path on the host running PyTrain or at sourcesMount within the training container
+  Args:
+      path pathlib.Path: path of the split
+      sourcesMount string: path the sources folder is mounted at within the training container
+  Returns:
+      array: (video path, class) of each video in the split, None if the task has no manifest
+  """
+  path = pathlib.Path(path)
+  manifestPath = path.parent / "manifest.json"
+  if not manifestPath.exists():
+    return None
+  with open(manifestPath) as manifestFile:
+    manifest = json.load(manifestFile)
+  videos = []
+  for entry in manifest['files']:
+    if entry['split'] != path.name:
+      continue
+    for candidate in (path.parent / entry['path'], pathlib.Path(manifest['sources']) / entry['source'], pathlib.Path(sourcesMount) / entry['source']):
+      if candidate.exists():
+        videos.append((candidate, entry['class']))
+        break
+    else:
+      print(f"Video missing: {entry['source']}")
+  return videos
+
+def ManifestFrameCounts(path):
+  """Function to get the frame counts PyTrain recorded in the manifest for the videos of a split, so they need not be probed again
+  Args:
+      path pathlib.Path: path of the split
+  Returns:
+      dict: frame count keyed by {class}/{video name}, empty if the task has no manifest or counts
+  """
+  manifestPath = pathlib.Path(path).parent / "manifest.json"
+  if not manifestPath.exists():
+    return {}
+  with open(manifestPath) as manifestFile:
+    manifest = json.load(manifestFile)
+  return {f"{entry['class']}/{os.path.basename(entry['path'])}": entry['frame_count']
+          for entry in manifest['files'] if entry['split'] == pathlib.Path(path).name and entry.get('frame_count')}
+
+def ShardDirectory(path):
+  """Function to get the directory the shards of a split are written to, i.e /mnt/shards/train for /mnt/train"""
+  path = pathlib.Path(path)
+  return os.path.join(path.parent, "shards", path.name)
+
+def ReadShardIndex(path):
+  """Function to read the shard index of a split
+  Args:
+      path string: path of the split
+  Returns:
+      dict: index written by WriteShards, None if the split has not been ingested
+  """
+  indexPath = os.path.join(ShardDirectory(path), "index.json")
+  if not os.path.exists(indexPath):
+    return None
+  with open(indexPath) as indexFile:
+    return json.load(indexFile)
+
+def WriteShards(path, frameCount, frameStep = 5, outputSize = (224,224), offsetCount = 4, clipsPerShard = 64, workers = None, cache = None):
+  """Function to pack every video of a split into fixed size, memory mappable shards
+      1. List the videos of the split and the distinct offsets each is sampled from, the same offsets the clip cache stores
+         (using the frame counts in the manifest where PyTrain catalogued them)
+      2. Group the clips into shards of clipsPerShard
+      3. Fill each shard (in parallel across spawned worker processes, as PyTrain calls this from a thread of its server) as a (clips, frameCount, height, width, 3) uint8 .npy file,
+         copying each video's clips from the clip cache (decoding and storing them there first if no earlier task has) so videos shared between tasks are only decoded once
+      4. Write the index last, mapping each video, offset and class to its shard and row, so an interrupted ingest is never read
+  Args:
+      path string: path of the split (i.e model_tasks/{task}/train)
+      frameCount int: how many frames should be gathered from each clip
+      frameStep int: number of video frames between each gathered frame
+      outputSize tuple: height and width of the output frames
+      offsetCount int: number of clips decoded from each video
+      clipsPerShard int: number of clips in each shard
+      workers int: number of decoding processes, one per CPU core if None
+      cache ClipCache: store of decoded clips shared between tasks, None to decode straight into the shards
+  Returns:
+      dict: shard index
+  """
+  path = pathlib.Path(path)
+  shardDirectory = ShardDirectory(path)
+  os.makedirs(shardDirectory, exist_ok = True)
+  entries = []
+  videoPaths = {}
+  frameCounts = ManifestFrameCounts(path)
+  for videoPath, name in sorted(zip(*ListVideos(path))):
+    clip = f"{name}/{videoPath.name}"
+    videoPaths[clip] = str(videoPath)
+    offsets = ClipOffsets(videoPath, frameCount, frameStep, offsetCount, unique = False, length = frameCounts.get(clip))
+    for choice, offset in enumerate(offsets):
+      if offsets.index(offset) == choice:
+        entries.append({'clip': clip, 'offset': offset, 'choice': choice, 'label': name})
+
+  shards = []
+  jobs = []
+  for start in range(0, len(entries), clipsPerShard):
+    shardEntries = entries[start:start + clipsPerShard]
+    shardName = f"shard_{len(shards):04d}.npy"
+    for row, entry in enumerate(shardEntries):
+      entry['shard'] = len(shards)
+      entry['row'] = row
+    shards.append(shardName)
+    jobs.append((os.path.join(shardDirectory, shardName), [(videoPaths[entry['clip']], entry['offset'], entry['choice']) for entry in shardEntries], frameCount, frameStep, outputSize, cache, offsetCount))
+
+  with multiprocessing.get_context('spawn').Pool(workers or os.cpu_count() or 1) as pool:
+    pool.starmap(DecodeShard, jobs)
+
+  index = {
+    'frame_count': frameCount,
+    'frame_step': frameStep,
+    'output_size': list(outputSize),
+    'shards': shards,
+    'entries': entries
+  }
+  with open(os.path.join(shardDirectory, "index.json"), 'w') as indexFile:
+    json.dump(index, indexFile)
+  return index
+
+def DecodeShard(shardPath, clips, frameCount, frameStep, outputSize, cache = None, offsetCount = 1):
+  """Function to fill the rows of a memory mapped shard, from the clip cache if one is given otherwise decoded straight into the row
+  Args:
+      shardPath string: path of the .npy shard
+      clips array: (video path, start frame, index of the clip in the cache entry) of each row
+      frameCount int: how many frames should be gathered from each clip
+      frameStep int: number of video frames between each gathered frame
+      outputSize tuple: height and width of the output frames
+      cache ClipCache: store of decoded clips shared between tasks
+      offsetCount int: number of clips stored for each video in the cache
+  """
+  cv2.setNumThreads(1)
+  shard = np.lib.format.open_memmap(shardPath, mode = 'w+', dtype = np.uint8, shape = (len(clips), frameCount, outputSize[0], outputSize[1], 3))
+  for row, (videoPath, offset, choice) in enumerate(clips):
+    if cache is None:
+      FramesFromFile(videoPath, frameCount, outputSize, frameStep, start = offset, out = shard[row])
+    else:
+      shard[row] = cache.GetClips(videoPath, frameCount, outputSize, frameStep, offsetCount)[choice]
+  shard.flush()
+  del shard
 
-def FramesFromFile(videoPath, frameCount, outputSize = (224,224), frameStep = 5):
-  result = []
+def GetFrameGenerator(path, frameCount, training = False, frameStep = 5, workers = 1, seed = None, cache = None, offsetCount = 1):
+  """Function to get the generator for a dataset split
+      Splits packed into shards at ingest with the same frame count and step are read from their shards (filled from the clip cache at ingest),
+      otherwise clips are loaded from the clip cache, or decoded in parallel across worker processes if more than one worker is given
+  Args:
+      path string: path of videos to intake 
+      frameCount int: how many frames should be gathered from each video
+      training bool: indicates if training collection or not
+      frameStep int: number of video frames between each gathered frame
+      workers int: number of decoding processes
+      seed int: seed for the clip order, offset choices and start frames
+      cache ClipCache: store of decoded clips shared between tasks, not needed for splits read from shards
+      offsetCount int: number of clips stored for each video in the cache
+  Returns:
+      FrameGenerator: ShardGenerator, ParallelFrameGenerator or FrameGenerator
+  """
+  index = ReadShardIndex(path)
+  if index and index['frame_count'] == frameCount and index['frame_step'] == frameStep:
+    return ShardGenerator(path, frameCount, training, frameStep, seed)
+  if workers and workers > 1:
+    return ParallelFrameGenerator(path, frameCount, training, frameStep, workers, seed, cache = cache, offsetCount = offsetCount)
+  return FrameGenerator(path, frameCount, training, frameStep, cache, offsetCount, seed)
+
+def LoadClip(videoPath, frameCount, outputSize = (224,224), frameStep = 5, cache = None, offsetCount = 1, choice = 0, out = None, rng = None):
+  """Function to load a clip of a video, from the clip cache if one is given otherwise decoded from a random start frame
+  Args:
+      videoPath pathlib.Path: path of the video
+      frameCount int: number of frames to sample
+      outputSize tuple: height and width of the output frames
+      frameStep int: number of video frames between each sampled frame
+      cache ClipCache: store of decoded clips shared between tasks
+      offsetCount int: number of clips stored for each video in the cache
+      choice int: which of the stored clips to load
+      out array: optional preallocated (frameCount, height, width, 3) uint8 array to load into
+      rng random.Random: generator for the start frame when decoding, the random module if None
+  Returns:
+      array: (frameCount, height, width, 3) uint8 RGB frames
+  """
+  if cache is None:
+    return FramesFromFile(videoPath, frameCount, outputSize, frameStep, out = out, rng = rng)
+  clips = cache.GetClips(videoPath, frameCount, outputSize, frameStep, offsetCount)
+  if out is None:
+    return np.array(clips[choice])
+  out[...] = clips[choice]
+  return out
+
+def ClipOffsets(videoPath, frameCount, frameStep = 5, offsetCount = 1, unique = True, length = None):
+  """Function to choose the start frames a video is sampled from, spread evenly over the video
+  Args:
+      videoPath pathlib.Path: path of the video
+      frameCount int: number of frames gathered from each clip
+      frameStep int: number of video frames between each gathered frame
+      offsetCount int: number of clips to take from the video
+      unique bool: drop repeated start frames (short videos), otherwise exactly offsetCount are returned
+      length int: frame count of the video if already known (i.e from the manifest), otherwise the video is probed
+  Returns:
+      array: start frames, [0] if unique and the video is shorter than a clip
+  """
+  if length is None:
+    src = cv2.VideoCapture(str(videoPath))
+    length = int(src.get(cv2.CAP_PROP_FRAME_COUNT))
+    src.release()
+  maxStart = max(length - (1 + (frameCount - 1) * frameStep), 0)
+  offsets = np.linspace(0, maxStart, max(offsetCount, 1)).astype(int).tolist()
+  if unique:
+    return sorted(set(offsets))
+  return offsets
+
+def LetterboxGeometry(inputHeight, inputWidth, outputSize):
+  """Function to get the size and position of a frame resized to fit outputSize whilst keeping its aspect ratio (as tf.image.resize_with_pad)
+  Args:
+      inputHeight int: height of the video frames
+      inputWidth int: width of the video frames
+      outputSize tuple: height and width of the output frames
+  Returns:
+      tuple: resized height, resized width, top padding, left padding
+  """
+  ratio = max(inputHeight / outputSize[0], inputWidth / outputSize[1])
+  resizedHeight = max(int(inputHeight / ratio), 1)
+  resizedWidth = max(int(inputWidth / ratio), 1)
+  return resizedHeight, resizedWidth, (outputSize[0] - resizedHeight) // 2, (outputSize[1] - resizedWidth) // 2
+
+def FramesFromFile(videoPath, frameCount, outputSize = (224,224), frameStep = 5, start = None, out = None, rng = None):
+  """Function to sample frameCount frames, frameStep apart, from a video
+      1. Choose a random start frame that fits the window in the video, unless start is given
+      2. Preallocate the zero (padding) filled uint8 output, or zero out if given
+      3. Skip the frames between samples with grab, so they are not decoded
+      4. Decode each sampled frame and letterbox it straight into its slot of the output, the geometry is computed once per clip
+      5. Reorder BGR to RGB in place across every frame at once
+      Frames past the end of the video are left as zeros.
+  Args:
+      videoPath pathlib.Path: path of the video
+      frameCount int: number of frames to sample
+      outputSize tuple: height and width of the output frames
+      frameStep int: number of video frames between each sampled frame
+      start int: frame to start from, random if None
+      out array: optional preallocated (frameCount, height, width, 3) uint8 array to decode into
+      rng random.Random: generator for the start frame, the random module if None
+  Returns:
+      array: (frameCount, height, width, 3) uint8 RGB frames, normalised to 0-1 later in the dataset (see NormaliseDataSet)
+  """
   src = cv2.VideoCapture(str(videoPath))  
   length = src.get(cv2.CAP_PROP_FRAME_COUNT)
   requiredLength = 1 + (frameCount - 1) * frameStep
-  if requiredLength > length:
-    start = 0
-  else:
-    maxstart = length - requiredLength
-    start = random.randint(0, maxstart + 1)
+  if start is None:
+    if requiredLength > length:
+      start = 0
+    else:
+      maxstart = length - requiredLength
+      start = (rng or random).randint(0, maxstart + 1)
 
+  if out is None:
+    result = np.zeros((frameCount, outputSize[0], outputSize[1], 3), dtype = np.uint8)
+  else:
+    result = out
+    result[...] = 0
   src.set(cv2.CAP_PROP_POS_FRAMES, start)
-  ret, frame = src.read()
-  result.append(FormatFrames(frame, outputSize))
-
-  for _ in range(frameCount - 1):
-    for _ in range(frameStep):
-      ret, frame = src.read()
+  geometry = None
+  for index in range(frameCount):
+    ret = True
+    if index:
+      for _ in range(frameStep - 1):
+        ret = src.grab()
+    ret = ret and src.grab()
     if ret:
-      frame = FormatFrames(frame, outputSize)
-      result.append(frame)
-    else:
-      result.append(np.zeros_like(result[0]))
+      ret, frame = src.retrieve()
+    if not ret:
+      break
+    if geometry is None:
+      resizedHeight, resizedWidth, top, left = geometry = LetterboxGeometry(frame.shape[0], frame.shape[1], outputSize)
+    cv2.resize(frame, (resizedWidth, resizedHeight), dst = result[index, top:top + resizedHeight, left:left + resizedWidth], interpolation = cv2.INTER_LINEAR)
   src.release()
-  result = np.array(result)[..., [2, 1, 0]]
+  frames = result.reshape((frameCount * outputSize[0], outputSize[1], 3))
+  cv2.cvtColor(frames, cv2.COLOR_BGR2RGB, dst = frames)
 
   return result
-
@@ -5,11 +5,12 @@ import pathlib
 import argparse
 import os
 
-from load_data import FrameGenerator
+from load_data import FrameGenerator, GetFrameGenerator
+from cache_store import ClipCache
 from visualise_results import PlotHistory, GetConfusionResults, PlotConfusionMatrix
-from triton_packaging import CreateTritonPackage
+from triton_packaging import CreateTritonPackage, SaveServingModel, WriteCompletionManifest
 
-def ExtractData(folderPath, frameCount):
+def ExtractData(folderPath, frameCount, frameStep=5, workers=1, seed=None, cache=None, offsetCount=1):
     """Function to set retrieve datasets in a tfDataset format
        1. Define expected Output Signature of the dataset for the particular model chosen
        2. Load in trainDS, takes additional "training=True" flag to enable data shuffle
@@ -18,23 +19,29 @@ def ExtractData(folderPath, frameCount):
     Args:
         folderPath string: path of dataset location
         frameCount tfDataset: number of frames to be extracted from each video
+        frameStep int: number of video frames between each extracted frame
+        workers int: number of processes decoding clips in parallel for each dataset, 1 to decode within the tf.data generator
+        seed int: seed for the clip order and start frames
+        cache ClipCache: store of decoded clips shared between tasks, None to decode every epoch
+        offsetCount int: number of clips cached for each video, training picks one at random each epoch
     Return:
         tfDataset: trainDS, valDS, testDS
     """  
-    outputSignature = (tf.TensorSpec(shape = (None, None, None, 3), dtype = tf.float32),
+    outputSignature = (tf.TensorSpec(shape = (None, None, None, 3), dtype = tf.uint8),
                         tf.TensorSpec(shape = (), dtype = tf.int16))
     
-    trainDS = tf.data.Dataset.from_generator(FrameGenerator(pathlib.Path(folderPath+"/train"), frameCount, training=True),
+    trainDS = tf.data.Dataset.from_generator(GetFrameGenerator(pathlib.Path(folderPath+"/train"), frameCount, training=True, frameStep=frameStep, workers=workers, seed=seed, cache=cache, offsetCount=offsetCount),
                                                 output_signature = outputSignature)                                       
-    valDS = tf.data.Dataset.from_generator(FrameGenerator(pathlib.Path(folderPath+"/validation"), frameCount),
+    valDS = tf.data.Dataset.from_generator(GetFrameGenerator(pathlib.Path(folderPath+"/validation"), frameCount, frameStep=frameStep, workers=workers, seed=seed, cache=cache, offsetCount=offsetCount),
                                                 output_signature = outputSignature)
-    testDS = tf.data.Dataset.from_generator(FrameGenerator(pathlib.Path(folderPath+"/test"), frameCount),
+    testDS = tf.data.Dataset.from_generator(GetFrameGenerator(pathlib.Path(folderPath+"/test"), frameCount, frameStep=frameStep, workers=workers, seed=seed, cache=cache, offsetCount=offsetCount),
                                                 output_signature = outputSignature)
     
     return trainDS, valDS, testDS
 
-def InitialiseCache(trainDS, valDS, testDS):
-    """Function to set cache location of each dataset
+def NormaliseDataSet(trainDS, valDS, testDS):
+    """Function to convert the uint8 frames of each dataset to float32 normalised to 0-1
+       Applied last so the clip cache and shards hold the smaller uint8 frames
     Args:
         trainDS tfDataset: training dataset
         valDS tfDataset: validation dataset
@@ -42,13 +49,14 @@ def InitialiseCache(trainDS, valDS, testDS):
     Return:
         tfDataset: trainDS, valDS, testDS
     """
-    trainDS = trainDS.cache(filename="./cache/train_cache")
-    valDS = valDS.cache(filename="./cache/val_cache")
-    testDS = testDS.cache(filename="./cache/test_cache")
-    
+    normalise = lambda frames, label: (tf.image.convert_image_dtype(frames, tf.float32), label)
+    trainDS = trainDS.map(normalise, num_parallel_calls = tf.data.AUTOTUNE)
+    valDS = valDS.map(normalise, num_parallel_calls = tf.data.AUTOTUNE)
+    testDS = testDS.map(normalise, num_parallel_calls = tf.data.AUTOTUNE)
+
     return trainDS, valDS, testDS
 
-def PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize=100):
+def PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize=100, seed=None):
     """Function to set shufflesize of each dataset
     Args:
         trainDS tfDataset: training dataset
@@ -56,12 +64,13 @@ def PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize=100):
         testDS tfDataset: testing dataset
         AUTOTUNE data.AUTOTUNE: flag for setting autotune for shuffle size
         shuffleSize int: shuffle size value  
+        seed int: seed for the shuffles so runs are repeatable, random if None
     Return:
         tfDataset: trainDS, valDS, testDS
     """
-    trainDS = trainDS.shuffle(shuffleSize).prefetch(buffer_size = AUTOTUNE)
-    valDS = valDS.shuffle(shuffleSize).prefetch(buffer_size = AUTOTUNE)
-    testDS = testDS.shuffle(shuffleSize).prefetch(buffer_size = AUTOTUNE)
+    trainDS = trainDS.shuffle(shuffleSize, seed = seed).prefetch(buffer_size = AUTOTUNE)
+    valDS = valDS.shuffle(shuffleSize, seed = seed).prefetch(buffer_size = AUTOTUNE)
+    testDS = testDS.shuffle(shuffleSize, seed = seed).prefetch(buffer_size = AUTOTUNE)
 
     return trainDS, valDS, testDS
 
@@ -147,11 +156,34 @@ def GetClassMaps(path, frameCount):
     labels = list(classes.keys())
     return labels
 
-def main():
-    """Function to execute model training functionality
-    1. Declared arguments from docker RUN command
+def ParseArguments(argv=None):
+    """Function to parse the training arguments, from the docker RUN command or a job sent to a training worker
+    Args:
+        argv array: arguments to parse, the command line if None
+    Returns:
+        argparse.Namespace: args
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_name', type=str, default="test1")
+    parser.add_argument('--epochs', type=int, default=15)
+    parser.add_argument('--num_frames', type=int, default=10)
+    parser.add_argument('--frame_step', type=int, default=5)
+    parser.add_argument('--input_dtype', type=str, default="float32", choices=["float32", "uint8"])
+    parser.add_argument('--precision', type=str, default="float32", choices=["float32", "float16"])
+    parser.add_argument('--shuffle_size', type=int, default=200)
+    parser.add_argument('--batch_size', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cache_dir', type=str, default="/cache")
+    parser.add_argument('--cache_budget_gb', type=float, default=50)
+    parser.add_argument('--clip_offsets', type=int, default=4)
+    return parser.parse_args(argv)
+
+def Train(args, folderPath="/mnt", repoPath="/model_repo"):
+    """Function to execute model training functionality, callable repeatedly by a long lived training worker
+    1. Read arguments (see ParseArguments)
     2. Extracts data into TF Dataset objects
-    3. Initialises the cache for data storage external to RAM
+    3. Normalises the uint8 frames, decoded clips are kept in the clip cache shared between tasks
     4. PrefetchDataset for faster loading
     5. Preinitialise batch sizes
     6. Create the model based on input arguments 
@@ -161,44 +193,55 @@ def main():
     10.Evaluate model on test dataset
     11.Get labels
     12.Get results and plot confusion matrix for both test and validation data
-    13.Save the model to given model_task directory
+    13.Save the model to given model_task directory with its serving signature (float32, float16 or uint8 input)
     14.Compile config files and copy relevant model_task data into the model_repo for use with Triton
-    15.Hold on input() until PyTrain detects all files and removes containers
+    15.Write the completion manifest to the model_task folder
+    16.Clear the Keras session so the next job starts from a clean graph
 
     Args:
-        modelName string: name of the model
-        epochs int: number of epochs to run for
-        frameCount int: how many frames should be gathered out of a video
-        shuffleSize int: how many videos are to be shuffled
-        batchSize int: how many sets of frames should be batched to train in parallel           
+        args argparse.Namespace: training arguments
+            model_name string: name of the model
+            epochs int: number of epochs to run for
+            num_frames int: how many frames should be gathered out of a video
+            frame_step int: how many video frames are stepped over between each gathered frame
+            input_dtype string: float32 for a model served with normalised float frames, uint8 to serve raw frames normalised within the graph
+            precision string: float32, or float16 to serve float16 weights and tensors if they match the float32 model on the test data
+            shuffle_size int: how many videos are to be shuffled
+            batch_size int: how many sets of frames should be batched to train in parallel           
+            workers int: how many processes decode clips in parallel (one per CPU core by default)
+            seed int: seed for the clip order, start frames and dataset shuffles so runs are repeatable
+            cache_dir string: directory of the clip cache shared between tasks
+            cache_budget_gb float: size the clip cache is kept within, 0 to disable it
+            clip_offsets int: number of clips cached for each video, one is chosen at random each epoch
+        folderPath string: path of the model_task folder
+        repoPath string: path to the model_repo folder
+    Returns:
+        dict: model name, test metrics and the completion manifest
     """
     with tf.device('/GPU:0'):
-        parser = argparse.ArgumentParser()
-        parser.add_argument('--model_name', type=str, default="test1")
-        parser.add_argument('--epochs', type=int, default=15)
-        parser.add_argument('--num_frames', type=int, default=10)
-        parser.add_argument('--shuffle_size', type=int, default=200)
-        parser.add_argument('--batch_size', type=int, default=3)
-        args = parser.parse_args()
         modelName = args.model_name
         epochs = args.epochs
         frameCount = args.num_frames
+        frameStep = args.frame_step
+        inputDtype = args.input_dtype
+        precision = args.precision
         shuffleSize = args.shuffle_size
         batchSize = args.batch_size 
+        workers = args.workers
+        seed = args.seed
+        cache = ClipCache(args.cache_dir, int(args.cache_budget_gb * 1024 ** 3)) if args.cache_budget_gb > 0 else None
+        offsetCount = args.clip_offsets
 
         height = 224
         width = 224
 
-        folderPath = "/mnt"
-        repoPath = "/model_repo"
-
-        trainDS, valDS, testDS = ExtractData(folderPath, frameCount)
+        trainDS, valDS, testDS = ExtractData(folderPath, frameCount, frameStep, workers, seed, cache, offsetCount)
 
         AUTOTUNE = tf.data.AUTOTUNE
 
-        trainDS, valDS, testDS = InitialiseCache(trainDS, valDS, testDS)
+        trainDS, valDS, testDS = NormaliseDataSet(trainDS, valDS, testDS)
 
-        trainDS, valDS, testDS = PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize)
+        trainDS, valDS, testDS = PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize, seed)
 
         trainDS, valDS, testDS = InitialiseBatch(trainDS, valDS, testDS, batchSize)
 
@@ -217,7 +260,7 @@ def main():
                             callbacks=[callback])
         PlotHistory(history, modelName, folderPath)
             
-        model.evaluate(testDS, return_dict=True)
+        testResults = model.evaluate(testDS, return_dict=True)
             
         labels = GetClassMaps(folderPath, frameCount)
 
@@ -227,10 +270,18 @@ def main():
         actual, predicted = GetConfusionResults(model, testDS)
         PlotConfusionMatrix(actual, predicted, labels, 'test', modelName, folderPath)
 
-        model.save(os.path.join(folderPath, modelName), save_format='tf')
+        inputDtype = SaveServingModel(model, modelName, folderPath, inputDtype, precision, 
+                                      lambda: CreateModel(frameCount, height, width, folderPath), testDS)
         
-        CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, frameCount, shuffleSize, batchSize, height, width)
-        input()
+        CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, frameCount, shuffleSize, batchSize, height, width, frameStep, inputDtype)
+        completion = WriteCompletionManifest(modelName, folderPath, repoPath)
+
+    tf.keras.backend.clear_session()
+    return {'model_name': modelName, 'test': {key: float(value) for key, value in testResults.items()}, 'completion': completion}
+
+def main():
+    """Function to train a single model from the command line arguments (see ParseArguments and Train)"""
+    Train(ParseArguments())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,52 @@
+import argparse
+import os
+import traceback
+from multiprocessing.connection import Listener
+
+def RunJob(job, train, parseArguments):
+    """Function to run a single training job
+    Args:
+        job dict: argv (training arguments as on the command line), folder_path (model_task folder) and repo_path (model_repo folder)
+        train function: training callable (train_model.Train)
+        parseArguments function: argument parser (train_model.ParseArguments)
+    Returns:
+        dict: status (trained or failed) with the result of Train or the error
+    """
+    try:
+        result = train(parseArguments(job['argv']), job['folder_path'], job['repo_path'])
+        return {'status': 'trained', 'result': result}
+    except SystemExit as e:
+        return {'status': 'failed', 'error': f"Invalid training arguments ({e})"}
+    except Exception as e:
+        traceback.print_exc()
+        return {'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+
+def Serve(host, port, authkey):
+    """Function to run a long lived training worker, TensorFlow is imported and the device initialised once rather than once per task
+    1. Import the training module (loading TensorFlow)
+    2. Listen on host:port for PyTrain, authenticated with authkey
+    3. For each connection receive a job, train it and send back its result, one job at a time
+    4. Stop when sent None
+    Args:
+        host string: address to listen on
+        port int: port to listen on
+        authkey bytes: key PyTrain authenticates with
+    """
+    from train_model import Train, ParseArguments
+    with Listener((host, port), authkey=authkey) as listener:
+        print(f"Training worker ready on {host}:{port}", flush=True)
+        while True:
+            with listener.accept() as connection:
+                job = connection.recv()
+                if job is None:
+                    connection.send({'status': 'stopped'})
+                    return
+                print(f"Training {job['argv']}", flush=True)
+                connection.send(RunJob(job, Train, ParseArguments))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=6100)
+    args = parser.parse_args()
+    Serve(args.host, args.port, bytes.fromhex(os.environ["PYTRAIN_WORKER_AUTHKEY"]))
@@ -2,6 +2,7 @@ import tensorflow as tf
 import os 
 import configparser
 import shutil
+import json
 
 def CompileNumber(currentNumber):
     """Function to compile an array of digits into a complete number
@@ -103,7 +104,7 @@ def WriteConfig(configLines, folderPath):
     print("Config file created")
     return
 
-def CreateTritonConfig(modelName, folderPath):
+def CreateTritonConfig(modelName, folderPath, maxBatchSize=8):
     """Function to compile given data into the Triton configuration file format
     1. Initialise model path
     2. Collect required parameters from the loaded path
@@ -113,6 +114,7 @@ def CreateTritonConfig(modelName, folderPath):
     Args:
         configLines array: lines to be written to the Triton configuration file
         folderPath string: location of where the config.pbtxt file must be placed
+        maxBatchSize int: largest batch Triton should form for the model
     Return:
         string: input name for the model
         string: output name for the model
@@ -140,7 +142,7 @@ def CreateTritonConfig(modelName, folderPath):
         f"name: \"{modelName}\"",
         f"dynamic_batching {{ }}",
         "platform: \"tensorflow_savedmodel\"",
-        "max_batch_size: 8",  
+        f"max_batch_size: {maxBatchSize}",  
         "input [",
         f"  {{",
         f"    name: \"{inputName}\"",
@@ -159,8 +161,110 @@ def CreateTritonConfig(modelName, folderPath):
     WriteConfig(configLines, folderPath)
     return inputName, outputName
 
+def BuildHalfModel(model, builder):
+    """Function to rebuild a trained model with float16 weights and computation
+    1. Build the models architecture again under the float16 policy
+    2. Restore the previous policy
+    3. Copy the trained weights across (cast to float16)
+    Args:
+        model keras.Model: trained model
+        builder function: builds the models architecture, i.e the CreateModel call used for training
+    Returns:
+        keras.Model: float16 model
+    """
+    previousPolicy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy('float16')
+    try:
+        halfModel = builder()
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previousPolicy)
+    halfModel.set_weights(model.get_weights())
+    return halfModel
+
+def CheckParity(model, halfModel, dataSet, batches=10, tolerance=0.02, agreement=0.98):
+    """Function to check a float16 model against the float32 model it was built from on held out clips
+    1. Run both models over up to "batches" batches of the data set
+    2. Track the largest absolute difference in output and the fraction of clips where both predict the same class
+    3. Pass if the difference is within tolerance and the agreement is high enough
+    Args:
+        model keras.Model: float32 model
+        halfModel keras.Model: float16 model
+        dataSet tfDataset: batched held out clips, i.e testDS
+        batches int: number of batches to check
+        tolerance float: largest absolute difference allowed between outputs
+        agreement float: smallest fraction of clips that must have the same predicted class
+    Returns:
+        bool: True if the float16 model matches
+    """
+    largestDifference = 0.0
+    matching = 0
+    total = 0
+    for frames, _ in dataSet.take(batches):
+        reference = model(frames, training=False)
+        half = tf.cast(halfModel(tf.cast(frames, tf.float16), training=False), tf.float32)
+        largestDifference = max(largestDifference, float(tf.reduce_max(tf.abs(reference - half))))
+        matching += int(tf.reduce_sum(tf.cast(tf.argmax(reference, -1) == tf.argmax(half, -1), tf.int32)))
+        total += int(frames.shape[0])
+    if total == 0:
+        print("No clips available to check float16 parity")
+        return False
+    print(f"Float16 parity: largest difference {largestDifference:.5f}, class agreement {matching / total:.4f} over {total} clips")
+    return largestDifference <= tolerance and matching / total >= agreement
+
+def SaveServingModel(model, modelName, folderPath, inputDtype="float32", precision="float32", builder=None, parityDataSet=None):
+    """Function to save the trained model with the serving signature used by Triton
+       inputDtype float32: the serving signature takes frames already normalised to 0-1 by the node
+       inputDtype uint8: the serving signature takes raw uint8 frames and casts and normalises them within the graph,
+              so the node skips float conversion and sends a quarter of the bytes
+       precision float16: weights, computation and output are float16 and float inputs are float16, halving model memory and tensor bandwidth.
+              The float16 model is only kept if it passes CheckParity on parityDataSet, otherwise float32 is saved
+    1. If float16 rebuild the model with float16 weights and check it against the float32 model, falling back to float32 if it fails
+    2. If float32 throughout save the model as it is
+    3. Else build a serving function with an input of the models input shape and name in the served data type
+    4. Cast (and normalise uint8 frames to 0-1) before calling the model, casting the output to the served precision
+    5. Save the model with the serving function as its default signature
+    6. Return the input data type the node should send
+    Args:
+        model keras.Model: trained model
+        modelName string: model name
+        folderPath string: folder path for the model folder
+        inputDtype string: float32 or uint8
+        precision string: float32 or float16
+        builder function: builds the models architecture, required for float16
+        parityDataSet tfDataset: batched held out clips to check the float16 model on, required for float16
+    Returns:
+        string: input data type of the saved model (float32, float16 or uint8)
+    """
+    modelPath = os.path.join(folderPath, modelName)
+    servedModel = model
+    if precision == "float16":
+        try:
+            servedModel = BuildHalfModel(model, builder)
+            if parityDataSet is None or not CheckParity(model, servedModel, parityDataSet):
+                raise ValueError("float16 model does not match the float32 model")
+        except Exception as e:
+            print(f"Saving float32 model, float16 export failed: {str(e)}")
+            servedModel = model
+            precision = "float32"
+    if inputDtype == "float32" and precision == "float32":
+        model.save(modelPath, save_format='tf')
+        return inputDtype
+    servedInputDtype = inputDtype if inputDtype == "uint8" else precision
+    inputName = model.inputs[0].name.split(':')[0]
+    outputName = model.output_names[0]
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=model.inputs[0].shape, dtype=tf.as_dtype(servedInputDtype), name=inputName)])
+    def Serve(frames):
+        normalised = tf.cast(frames, tf.as_dtype(precision))
+        if servedInputDtype == "uint8":
+            normalised = normalised / 255.0
+        return {outputName: tf.cast(servedModel(normalised, training=False), tf.as_dtype(precision))}
+
+    tf.saved_model.save(servedModel, modelPath, signatures={'serving_default': Serve})
+    return servedInputDtype
+
 def GenerateTrainingConfig(labels, modelName, folderPath, epochs, frameCount, shuffleSize, batchSize, height, 
-width, inputName, outputName):
+width, inputName, outputName, frameStep=5, inputDtype="float32", splitModels=None):
     """Function to compile config with training data for use with PyDeploy
     1. Initialise config
     2. Add 'PREDICTION' configuration elements
@@ -178,10 +282,15 @@ width, inputName, outputName):
         width int: width for the video to be reformatted to 
         inputName string: input name for model shape input
         outputName string: out name for model results output
+        frameStep int: number of video frames between each frame the model was trained on
+        inputDtype string: float32 or float16 if the model takes frames normalised to 0-1, uint8 if it takes raw frames
+        splitModels dict: names from ExportSplitModels, written to the 'SPLIT' section if the model was also exported as an encoder and head
     """
     config = configparser.ConfigParser()
     config['PREDICTION'] = {
         'num_frames': frameCount,
+        'frame_step': frameStep,
+        'input_dtype': inputDtype,
         'class_list': labels,
         'height': height,
         'width': width,
@@ -193,21 +302,39 @@ width, inputName, outputName):
         'shuffle_size': shuffleSize,
         'batch_size': batchSize
     }
+    if splitModels:
+        config['SPLIT'] = splitModels
     with open(f'{folderPath}/{modelName}.config', 'w') as configfile:
         config.write(configfile)
 
 def ReorganiseFolder(modelName, folderPath, repoPath):
     """Function to reorganise files contained in the model_task/{modelName} folder to be within the model_repo folder and fit the Triton file structure
+    1. Arrange the saved model and its config.pbtxt into the Triton file structure
+    2. Copy the model into the model_repo
+    3. Move PyTrain config and model training results files to assets (extras folder in Triton)
+    Args:
+        modelName string: model name
+        folderPath string: path for the task folder
+        repoPath string: path to the model_repo folder
+    """
+    ArrangeSavedModel(modelName, folderPath)
+    shutil.copytree(f"{folderPath}/{modelName}", f"{repoPath}/{modelName}")
+    shutil.move(f"{folderPath}/{modelName}.config", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
+    shutil.move(f"{folderPath}/{modelName}_history.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
+    shutil.move(f"{folderPath}/{modelName}_test_confusion.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
+    shutil.move(f"{folderPath}/{modelName}_training_confusion.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
+
+def ArrangeSavedModel(modelName, folderPath):
+    """Function to arrange a saved model in the task folder into the Triton file structure ({modelName}/1/model.savedmodel)
     1. Define directories
     2. Create required directories
     3. Move variable files
     4. Move model files
     5. Remove excess directories
-    6. Move PyTrain config and model training results files to assets (extras folder in Triton)
+    6. Move the models config.pbtxt alongside it
     Args:
         modelName string: model name
         folderPath string: path for the task folder
-        repoPath string: path to the model_repo folder
     """
     variableFiles = os.listdir(f"{folderPath}/{modelName}/variables")
     baseFiles = os.listdir(f"{folderPath}/{modelName}")
@@ -223,17 +350,54 @@ def ReorganiseFolder(modelName, folderPath, repoPath):
         if file != "variables" and file != "assets":
             os.replace(f"{folderPath}/{modelName}/{file}", f"{folderPath}/{modelName}/1/model.savedmodel/{file}") 
     os.replace(f"{folderPath}/config.pbtxt", f"{folderPath}/{modelName}/config.pbtxt")
-    os.removedirs(f"{folderPath}/{modelName}/assets")
+    if os.path.isdir(f"{folderPath}/{modelName}/assets"):
+        os.removedirs(f"{folderPath}/{modelName}/assets")
     os.removedirs(f"{folderPath}/{modelName}/variables")
-    shutil.copytree(f"{folderPath}/{modelName}", f"{repoPath}/{modelName}")
-    shutil.move(f"{folderPath}/{modelName}.config", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
-    shutil.move(f"{folderPath}/{modelName}_history.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
-    shutil.move(f"{folderPath}/{modelName}_test_confusion.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
-    shutil.move(f"{folderPath}/{modelName}_training_confusion.png", f"{repoPath}/{modelName}/1/model.savedmodel/assets")
 
-def CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, frameCount, shuffleSize, batchSize, height, width):
+def ExportSplitModels(model, modelName, folderPath, repoPath, inputDtype="float32", encoderBatchSize=32):
+    """Function to export a model built from a per-frame encoder and a temporal head as two further Triton models
+       {modelName}_encoder takes single frames and returns their embedding, {modelName}_head takes a window of embeddings and returns the classes.
+       A node can then encode each frame once and reuse its embedding in every window it falls in, rather than encoding it once per window.
+    1. Find the 'frame_encoder' (within TimeDistributed) and 'temporal_head' submodels, returning None if the model is not split
+    2. For each part save it with its serving signature (the encoder takes the same input data type as the model)
+    3. Create its Triton config, the encoder batches frames so it allows larger batches
+    4. Arrange it into the Triton file structure and copy it into the model_repo
+    5. Return the names for the SPLIT section of the PyTrain config
+    Args:
+        model keras.Model: trained model
+        modelName string: model name
+        folderPath string: folder path for the model folder
+        repoPath string: path to the model_repo folder
+        inputDtype string: input data type of the model, float32 or uint8 (float16 models are not split)
+        encoderBatchSize int: largest batch of frames the encoder accepts
+    Returns:
+        dict: encoder and head model, input and output names and the embedding size, None if not exported
+    """
+    try:
+        encoder = next(layer.layer for layer in model.layers if isinstance(layer, tf.keras.layers.TimeDistributed) and layer.layer.name == 'frame_encoder')
+        head = model.get_layer('temporal_head')
+    except (StopIteration, ValueError):
+        print("Model has no frame encoder and temporal head to export separately")
+        return None
+    if inputDtype not in ("float32", "uint8"):
+        print(f"Split models are not exported for {inputDtype} models")
+        return None
+    splitModels = {}
+    for part, subModel, partDtype, partBatchSize in (("encoder", encoder, inputDtype, encoderBatchSize), ("head", head, "float32", 8)):
+        subModelName = f"{modelName}_{part}"
+        SaveServingModel(subModel, subModelName, folderPath, partDtype)
+        inputName, outputName = CreateTritonConfig(subModelName, folderPath, partBatchSize)
+        ArrangeSavedModel(subModelName, folderPath)
+        shutil.copytree(f"{folderPath}/{subModelName}", f"{repoPath}/{subModelName}")
+        splitModels[f"{part}_model"] = subModelName
+        splitModels[f"{part}_input_name"] = inputName
+        splitModels[f"{part}_output_name"] = outputName
+    splitModels["embedding_size"] = head.inputs[0].shape[-1]
+    return splitModels
+
+def CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, frameCount, shuffleSize, batchSize, height, width, frameStep=5, inputDtype="float32", splitModels=None):
     """Function to create required configuration files and compile the Triton compatible directory in model_repo
-    1. Create the triton config.pbtxt
+    1. Create the triton config.pbtxt (input and output data types taken from the saved serving signature, i.e TYPE_UINT8 or TYPE_FP16)
     2. Create the PyTrain modelname.conf
     3. Reorganise folder structure for placement in model_repo and compatible Triton folder structure
     Args:
@@ -247,7 +411,32 @@ def CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, frameCo
         batchSize int: number of frame sets to batch process together
         height int: height for the video to be reformatted to
         width int: width for the video to be reformatted to 
+        frameStep int: number of video frames between each frame the model was trained on
+        inputDtype string: input contract the model was saved with by SaveServingModel (float32, float16 or uint8)
+        splitModels dict: names from ExportSplitModels if the encoder and head were also exported
     """
     inputName, outputName = CreateTritonConfig(modelName, folderPath)
-    GenerateTrainingConfig(labels, modelName, folderPath, epochs, frameCount, shuffleSize, batchSize, height, width, inputName, outputName)
-    ReorganiseFolder(modelName, folderPath, repoPath)
\ No newline at end of file
+    GenerateTrainingConfig(labels, modelName, folderPath, epochs, frameCount, shuffleSize, batchSize, height, width, inputName, outputName, frameStep, inputDtype, splitModels)
+    ReorganiseFolder(modelName, folderPath, repoPath)
+
+def WriteCompletionManifest(modelName, folderPath, repoPath, splitModels=None):
+    """Function to record that training finished and where its outputs are, so PyTrain can release the container as soon as it exits
+       Written to {folderPath}/completion.json (the model_task folder) through a temporary file, so PyTrain never reads a partial manifest
+    Args:
+        modelName string: model name
+        folderPath string: path for the task folder
+        repoPath string: path to the model_repo folder
+        splitModels dict: names from ExportSplitModels if the encoder and head were also exported
+    Returns:
+        dict: completion manifest
+    """
+    manifest = {
+        'status': 'trained',
+        'model_name': modelName,
+        'models': [modelName] + ([splitModels['encoder_model'], splitModels['head_model']] if splitModels else []),
+        'assets': sorted(os.listdir(f"{repoPath}/{modelName}/1/model.savedmodel/assets"))
+    }
+    with open(f"{folderPath}/completion.json.tmp", 'w') as manifestFile:
+        json.dump(manifest, manifestFile, indent=1)
+    os.replace(f"{folderPath}/completion.json.tmp", f"{folderPath}/completion.json")
+    return manifest
@@ -1,76 +1,83 @@
 from aiohttp import web
 import asyncio
+import os
 
-from modules.pull_files import PullFiles
-from modules.dockerise_model import LaunchContainer
-from modules.task_orders import UpdateTaskStatus, CreateModelEntry
+from modules.job_queue import JobScheduler
+from modules.worker_pool import TrainingWorkerPool
+from modules.master_client import MASTER_CLIENT
 
 async def CreateModel(request):
-    """Function to initialise the creation of a model. 
+    """Function to queue the creation of a model. 
        Called via endpoint of the server at /model/create
-    1. Pulls out the task ID supplied in the JSON request body
-    2. Updates the task status with "gathering" & creates task to pull files for the dataset
-    3. Changes file path to only indicate the folder name (not ./models_task/model_name)
-    4. Update the task status and initiate container creation task
-    5. Handles the result of the container task. 
-       If the result returns an error it sets the task to failed
-       If the result returns True in Tuple sets the task to trained
-    6. Given a successfully trained task a model entry is created for said new model
+    1. Pulls out the task ID (and optional priority) supplied in the JSON request body
+    2. Submits the task to the job scheduler, which gathers the files, trains the model and creates its model entry
+       as slots for the disk, decode cpu and gpu become free, updating the task status at each stage
+    3. Returns the job id immediately, its progress is available at /model/jobs/{jobID}
 
     Args:
         request: http object recieved from endpoint
     
     Returns:
-        Web.response: Task failure or success
+        Web.response: job id and task id
     """
     body = await request.json()
     taskID = body[0]['insert_model_task']
-    UpdateTaskStatus(taskID,"gathering")
-    imageTag = "cudatf"  
-    filesTask = asyncio.create_task(PullFiles(taskID))
-    await filesTask
-    folderPath = filesTask.result()
-    parts = folderPath.split("/")
-    folderName = "/".join(parts[2:])
-    UpdateTaskStatus(taskID,"training")
-    containerTask = asyncio.create_task(LaunchContainer(imageTag, taskID, folderName))
-    await containerTask
-    if(containerTask.result()[0]):
-        UpdateTaskStatus(taskID,"trained")
-        print("Success")
-    else:
-        UpdateTaskStatus(taskID,"failed")
-        return web.Response(text=f"Task {taskID} has failed")
-    creationTask = asyncio.create_task(CreateModelEntry(taskID, containerTask.result()[1]))
-    await creationTask
-    if(creationTask.result()):
-        UpdateTaskStatus(taskID,"trained")
-        print("Success")
-    else:
-        UpdateTaskStatus(taskID,"failed")
-        return web.Response(text=f"Task {taskID} has failed")
-    return web.Response(text=f"Task {taskID} has succeeded") 
+    priority = int(body[0].get('priority', 0))
+    jobID = request.app['scheduler'].Submit(taskID, priority)
+    return web.json_response({'job_id': jobID, 'task_id': taskID})
+
+async def GetJob(request):
+    """Function to get the stage and status of a queued model creation job. 
+       Called via endpoint of the server at /model/jobs/{jobID}
+
+    Args:
+        request: http object recieved from endpoint
+    
+    Returns:
+        Web.response: job state, 404 if there is no such job
+    """
+    job = request.app['scheduler'].GetJob(int(request.match_info['jobID']))
+    if job is None:
+        raise web.HTTPNotFound(text=f"Job {request.match_info['jobID']} not found")
+    return web.json_response(job)
+
+async def CloseServer(app):
+    """Function to stop the warm training workers and close the master API session when the server shuts down"""
+    if app['scheduler'].pool:
+        await app['scheduler'].pool.Close()
+    await MASTER_CLIENT.Close()
 
 async def ServerUp():
     """Function to initialise the Server. 
     
-        1. Initialises web application
+        1. Initialises web application and its job scheduler, starting PYTRAIN_TRAINING_WORKERS warm training workers
+           (PYTRAIN_WORKER_MODE container or local) if set, otherwise a container is launched for each task
         2. Adds all endpoint routes
-        3. Starts server
+        3. Starts server and the scheduler
     """
     server = '0.0.0.0'
     port = 8080
     app = web.Application()
-    app.add_routes([web.post('/model/create', CreateModel)])
+    pool = None
+    workerCount = int(os.environ.get("PYTRAIN_TRAINING_WORKERS", 0))
+    if workerCount > 0:
+        pool = TrainingWorkerPool(workerCount, os.environ.get("PYTRAIN_WORKER_MODE", "container"))
+        await pool.Start()
+    app['scheduler'] = JobScheduler(pool=pool)
+    app.add_routes([web.post('/model/create', CreateModel),
+                    web.get('/model/jobs/{jobID}', GetJob)])
+    app.on_cleanup.append(CloseServer)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, server, port)
     await site.start()
+    app['schedulerTask'] = asyncio.create_task(app['scheduler'].Run())
     print(f"Server ready to recieve model requests http://{server}:{port}")
 
 async def main():
     await ServerUp()
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(main())
-loop.run_forever()
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
+    loop.run_forever()
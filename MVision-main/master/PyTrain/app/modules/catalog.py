@@ -0,0 +1,182 @@
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    name TEXT NOT NULL,
+    name_lower TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_source_name ON directories (source, name_lower);
+CREATE TABLE IF NOT EXISTS videos (
+    directory_id INTEGER NOT NULL REFERENCES directories (id) ON DELETE CASCADE,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    duration REAL,
+    frame_count INTEGER,
+    width INTEGER,
+    height INTEGER,
+    PRIMARY KEY (directory_id, filename)
+);
+"""
+
+def OpenCatalog(catalogPath="./catalog.sqlite"):
+    """Function to open the source video catalog, creating it if it does not exist
+       The catalog holds sources -> class directories -> videos (size, modification time, duration, frame count and resolution)
+    Args:
+        catalogPath string: path of the sqlite catalog
+    Returns:
+        sqlite3.Connection: catalog connection (usable from the thread RefreshCatalog runs on)
+    """
+    connection = sqlite3.connect(catalogPath, check_same_thread=False)
+    connection.execute("PRAGMA foreign_keys = ON")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+def RefreshCatalog(connection, directoryPath, sources):
+    """Function to bring the catalog up to date with the given sources, only probing what has changed
+    1. For each source list its class directories
+    2. Stat the videos of every directory, as a video rewritten in place changes its size and modification time but not its directories
+    3. Probe only new or modified videos
+    4. Remove directories (and their videos) that no longer exist
+
+    Args:
+        connection sqlite3.Connection: catalog connection
+        directoryPath string: directory path to the source location
+        sources array: names of the source folders to refresh
+    """
+    for source in sources:
+        sourcePath = os.path.join(directoryPath, source)
+        seen = []
+        if os.path.isdir(sourcePath):
+            for entry in os.scandir(sourcePath):
+                if not entry.is_dir():
+                    continue
+                seen.append(entry.path)
+                mtime = entry.stat().st_mtime
+                row = connection.execute("SELECT id, mtime FROM directories WHERE path = ?", (entry.path,)).fetchone()
+                if row:
+                    directoryID = row[0]
+                else:
+                    directoryID = connection.execute("INSERT INTO directories (source, name, name_lower, path, mtime) VALUES (?, ?, ?, ?, ?)",
+                                                     (source, entry.name, entry.name.lower(), entry.path, mtime)).lastrowid
+                RefreshDirectory(connection, directoryID, entry.path)
+                connection.execute("UPDATE directories SET mtime = ? WHERE id = ?", (mtime, directoryID))
+                connection.commit()
+        stale = [row[0] for row in connection.execute("SELECT path FROM directories WHERE source = ?", (source,)) if row[0] not in set(seen)]
+        connection.executemany("DELETE FROM directories WHERE path = ?", [(path,) for path in stale])
+        connection.commit()
+
+def RefreshDirectory(connection, directoryID, directory):
+    """Function to rescan the mp4 files of a class directory
+    1. Compare each mp4 with its catalog size and modification time
+    2. Probe new or modified videos in parallel
+    3. Remove videos that no longer exist
+
+    Args:
+        connection sqlite3.Connection: catalog connection
+        directoryID int: id of the directory in the catalog
+        directory string: path of the directory
+    """
+    known = {row[0]: (row[1], row[2]) for row in connection.execute("SELECT filename, size, mtime FROM videos WHERE directory_id = ?", (directoryID,))}
+    present = set()
+    changed = []
+    for entry in os.scandir(directory):
+        if not entry.is_file() or not entry.name.lower().endswith(".mp4"):
+            continue
+        present.add(entry.name)
+        stat = entry.stat()
+        if known.get(entry.name) != (stat.st_size, stat.st_mtime):
+            changed.append((entry.name, entry.path, stat.st_size, stat.st_mtime))
+    probes = []
+    if changed:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            probes = list(executor.map(lambda video: ProbeVideo(video[1]), changed))
+    connection.executemany("INSERT OR REPLACE INTO videos (directory_id, filename, size, mtime, duration, frame_count, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(directoryID, name, size, mtime, *probe) for (name, _, size, mtime), probe in zip(changed, probes)])
+    connection.executemany("DELETE FROM videos WHERE directory_id = ? AND filename = ?", [(directoryID, name) for name in known if name not in present])
+
+def ProbeVideo(videoPath):
+    """Function to read the duration, frame count and resolution of a video from its container
+    Args:
+        videoPath string: path of the video
+    Returns:
+        tuple: duration (seconds), frame count, width, height (None if the video cannot be opened)
+    """
+    src = cv2.VideoCapture(videoPath)
+    try:
+        if not src.isOpened():
+            return None, None, None, None
+        frameCount = int(src.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = src.get(cv2.CAP_PROP_FPS)
+        width = int(src.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(src.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        return (frameCount / fps if fps else None), frameCount, width, height
+    finally:
+        src.release()
+
+def FindCatalogDirectories(connection, sources, classes):
+    """Function to collate the class directories of the chosen sources from the catalog
+       A directory belongs to the first class its name begins with (case insensitive), otherwise to "Other"
+    Args:
+        connection sqlite3.Connection: catalog connection
+        sources array: names of the source folders
+        classes array: class names
+    Returns:
+        dict: classPaths
+    """
+    placeholders = ",".join("?" * len(sources))
+    classPaths = {"Other": []}
+    assigned = set()
+    for className in classes:
+        prefix = className.lower()
+        rows = connection.execute(f"SELECT path FROM directories WHERE source IN ({placeholders}) AND name_lower >= ? AND name_lower < ? ORDER BY path",
+                                  (*sources, prefix, prefix + "\uffff"))
+        classPaths[className] = [row[0] for row in rows if row[0] not in assigned]
+        assigned.update(classPaths[className])
+    rows = connection.execute(f"SELECT path FROM directories WHERE source IN ({placeholders}) ORDER BY path", tuple(sources))
+    classPaths["Other"] = [row[0] for row in rows if row[0] not in assigned]
+    return classPaths
+
+def FindCatalogFiles(connection, classPaths):
+    """Function to collate the mp4 files of each class directory from the catalog, keyed by class then directory
+       Classes without any mp4 files are left out
+    Args:
+        connection sqlite3.Connection: catalog connection
+        classPaths dict: dictionary of class keys and values of the folder directory that their videos are stored in
+    Returns:
+        dict: classFiles
+    """
+    classFiles = {}
+    for classType, directories in classPaths.items():
+        for directory in directories:
+            files = [row[0] for row in connection.execute("SELECT v.filename FROM videos v JOIN directories d ON v.directory_id = d.id WHERE d.path = ? ORDER BY v.filename", (directory,))]
+            if files:
+                classFiles.setdefault(classType, {})[directory] = files
+    return classFiles
+
+def CatalogFrameCounts(connection, finalFiles):
+    """Function to get the catalogued frame count of each selected video, so they do not need probing again
+    Args:
+        connection sqlite3.Connection: catalog connection
+        finalFiles dict: dictionary of class keys and values of the reduced number of paths to files
+    Returns:
+        dict: frame count keyed by video path
+    """
+    frameCounts = {}
+    for directories in finalFiles.values():
+        for directory, filenames in directories.items():
+            rows = connection.execute("SELECT v.filename, v.frame_count FROM videos v JOIN directories d ON v.directory_id = d.id WHERE d.path = ?", (directory,))
+            counts = dict(rows.fetchall())
+            for filename in filenames:
+                if counts.get(filename) is not None:
+                    frameCounts[os.path.join(directory, filename)] = counts[filename]
+    return frameCounts
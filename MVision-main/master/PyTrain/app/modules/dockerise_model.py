@@ -1,16 +1,16 @@
 import os
 import getpass
-import requests
 import docker
-from time import sleep
+import json
 import shutil
 import asyncio
 
+from modules.master_client import MASTER_CLIENT
+
 async def GetTaskData(taskID):
     """Function to retrieve model data from the given id:
-    1. Retrieves the response
-    2. Extracts the .json and its sub structure to get the task data
-    3. Returns task data json
+    1. Retrieves the task from the master client
+    2. Returns task data json
 
     Args:
         taskID int: task ID of current task that is executing
@@ -18,9 +18,7 @@ async def GetTaskData(taskID):
     Returns:
         json: task
     """
-    task_result = requests.get(f"http://localhost:3000/tasks/id/{taskID}")
-    task = task_result.json()[0]['get_task'][0]
-    return task
+    return await MASTER_CLIENT.GetTask(taskID)
 
 def CheckForImage(imageTag, client):
     """Function to check if the container image exists already
@@ -58,18 +56,89 @@ def BuildImage(client, imageTag):
     response = client.images.build(path=".", tag=imageTag, rm=True)
     return response
 
+def HostPath():
+    """Function to get the path of the PyTrain folder on the host, from which the training containers volumes are mapped"""
+    return f'/home/{getpass.getuser()}/Desktop/MVision/master/PyTrain'
+
+def TrainingArguments(task, modelName):
+    """Function to format the training arguments of a task, as passed to train_model.py (see ParseArguments)
+    Args:
+        task json: task data (i.e hyper perameters)
+        modelName string: name of the model
+    Returns:
+        array: argv
+    """
+    argv = ["--model_name", modelName,
+            "--epochs", str(task['epochs']),
+            "--num_frames", str(task['num_frames']),
+            "--frame_step", str(task.get('frame_step') or 5),
+            "--shuffle_size", str(task['shuffle_size']),
+            "--batch_size", str(task['batch_size'])]
+    if task.get('input_dtype'):
+        argv += ["--input_dtype", task['input_dtype']]
+    if task.get('precision'):
+        argv += ["--precision", task['precision']]
+    return argv
+
+async def TrainOnWorker(pool, taskID, folderName):
+    """Function to train a task on a warm training worker rather than a new container
+    1. Retrieves the task data (i.e hyper perameters)
+    2. Sends the training arguments to the next idle worker of the pool and waits for its result
+    3. Returns the task status and the modelName, as LaunchContainer
+
+    Args:
+        pool TrainingWorkerPool: started pool of training workers
+        taskID int: task ID of current task that is executing
+        folderName string: folder name of the model_task which contains /train /test /validation data
+
+    Returns:
+        tuple: (TASK STATUS, modelName)
+    """
+    task = await GetTaskData(taskID)
+    modelName = f"{task['model_name']}_{taskID}"
+    result = await pool.Submit(TrainingArguments(task, modelName), folderName)
+    if result['status'] != 'trained':
+        print(f"Training worker failed {modelName}: {result.get('error')}")
+        return [False,modelName]
+    print(f"Trained {modelName}: {result['result']['test']}")
+    return [True,modelName]
+
+def StreamLogs(container, modelName):
+    """Function to print the output of a training container as it runs, returns once the container exits
+    Args:
+        container: docker container object
+        modelName string: name of the model, prefixed to each line
+    """
+    for line in container.logs(stream=True, follow=True):
+        print(f"[{modelName}] {line.decode(errors='replace').rstrip()}")
+
+def ReadCompletionManifest(folderPath):
+    """Function to read the completion manifest written by the training container (see WriteCompletionManifest)
+    Args:
+        folderPath string: path of the model_task folder
+    Returns:
+        dict: completion manifest, None if training did not complete
+    """
+    try:
+        with open(f"{folderPath}/completion.json") as manifestFile:
+            return json.load(manifestFile)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
 async def LaunchContainer(imageTag, taskID, folderName):
     """Function to launch a model training container, taking in the image_tag, taskID and folderName. 
+    Docker calls run in worker threads so the server keeps accepting and progressing other tasks whilst a container trains.
     The function:
     1. Retrieves the task data (i.e hyper perameters).
     2. Formats the entry_cmd based on the task data
-    3. Creates the volume maps for the container to be connected to the model_repo and source folder
+    3. Creates the volume maps for the container to be connected to the model_repo, task folder, shared clip cache and the sources (for videos the manifest does not link)
     4. Attempts to login to NVIDIA container repository
     5. Attempts to build container if necessary
     6. Runs the container 
-    7. Waits for the container to finish by detecting its final output (confusion matrix file)
-    8. Stops and removes the container
-    9. Returns True for task status and the modelName
+    7. Streams its logs and waits for it to exit
+    8. Checks the exit status and the completion manifest written to the task folder
+    9. Removes the container
+    10.Returns the task status and the modelName
 
     Args:
         image_tag string: name of the current docker container being used
@@ -83,56 +152,45 @@ async def LaunchContainer(imageTag, taskID, folderName):
 
     task = await GetTaskData(taskID)
 
-    absPath = f'/home/{getpass.getuser()}/Desktop/MVision/master/PyTrain'
+    absPath = HostPath()
     keyPath = f'/home/{getpass.getuser()}/api.key'
     modelName = f"{task['model_name']}_{taskID}"
 
-    entryCMD = ["python3", "train_model.py",
-             "--model_name", modelName,
-             "--epochs", str(task['epochs']),
-             "--num_frames", str(task['num_frames']),
-             "--shuffle_size", str(task['shuffle_size']),
-             "--batch_size", str(task['batch_size'])]
+    entryCMD = ["python3", "train_model.py"] + TrainingArguments(task, modelName)
     
     volumeMapping = {
                   f"{absPath}/model_tasks/{folderName}": {'bind': '/mnt', 'mode': 'rw'},  
                   f"{absPath}/model_repo": {'bind': '/model_repo', 'mode': 'rw'},
+                  f"{absPath}/cache": {'bind': '/cache', 'mode': 'rw'},
+                  f"{absPath}/app/sources": {'bind': '/sources', 'mode': 'ro'},
     }
     
     debugMode = False
+    container = None
 
     try:
-        response = client.login(registry="https://nvcr.io", username="$oauthtoken", password=(open(keyPath, "r").read()))
+        with open(keyPath, "r") as keyFile:
+            response = await asyncio.to_thread(client.login, registry="https://nvcr.io", username="$oauthtoken", password=keyFile.read())
 
-        if debugMode or not CheckForImage(imageTag,client):
+        if debugMode or not await asyncio.to_thread(CheckForImage, imageTag, client):
             print("Building cudatf image...")
-            buildResult = BuildImage(client, imageTag)
+            buildResult = await asyncio.to_thread(BuildImage, client, imageTag)
         
-        container = client.containers.run(f"{imageTag}:latest", 
+        container = await asyncio.to_thread(client.containers.run, f"{imageTag}:latest", 
                             name=modelName, 
                             detach=True,
                             device_requests=[docker.types.DeviceRequest(count=-1, capabilities=[['gpu']])],
-                            tty=True, 
-                            stdin_open=True, 
                             entrypoint=entryCMD,
                             volumes=volumeMapping)
         
-        file = f'{modelName}_training_confusion.png'
-        fileStatus = False
-
-        while not fileStatus:
-            path = f'../model_repo/{modelName}/1/model.savedmodel/assets/{file}'
-            if os.path.exists(path):
-                if os.path.isfile(path):
-                    fileStatus = True
-                else:
-                    asyncio.sleep(5)
-                    print("files missing")
-            else:
-                sleep(5)
-                print("files missing")
-        container.stop()
-        container.remove()
+        logsTask = asyncio.create_task(asyncio.to_thread(StreamLogs, container, modelName))
+        exitStatus = await asyncio.to_thread(container.wait)
+        await logsTask
+
+        completion = ReadCompletionManifest(f"../model_tasks/{folderName}")
+        if exitStatus.get('StatusCode') != 0 or not completion or completion.get('status') != 'trained':
+            print(f"Training container {modelName} exited with status {exitStatus.get('StatusCode')} without completing")
+            return [False,modelName]
         return [True,modelName]
     
     except docker.errors.ContainerError as e:
@@ -144,3 +202,9 @@ async def LaunchContainer(imageTag, taskID, folderName):
     except docker.errors.APIError as e:
         print(f"Docker API error: {e}")
         return [False,modelName]
+    finally:
+        if container is not None:
+            try:
+                await asyncio.to_thread(container.remove, force=True)
+            except docker.errors.APIError as e:
+                print(f"Container removal error: {e}")
@@ -0,0 +1,165 @@
+import os
+import time
+import asyncio
+import sqlite3
+
+from modules.pull_files import PullFiles
+from modules.dockerise_model import LaunchContainer, TrainOnWorker
+from modules.task_orders import UpdateTaskStatus, CreateModelEntry
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    task_id INTEGER NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    folder_name TEXT,
+    model_name TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_queued ON jobs (status, priority, id);
+"""
+
+STAGES = ["gathering", "training", "registering"]
+
+STAGE_RESOURCES = {
+    "gathering": ("disk", "cpu"),
+    "training": ("gpu",),
+    "registering": (),
+}
+
+def DefaultSlots():
+    """Function to get the number of concurrent stages each resource allows, from PYTRAIN_{RESOURCE}_SLOTS (1 each by default)
+    Returns:
+        dict: slots keyed by resource (gpu, cpu, disk)
+    """
+    return {resource: int(os.environ.get(f"PYTRAIN_{resource.upper()}_SLOTS", 1)) for resource in ("gpu", "cpu", "disk")}
+
+class JobScheduler:
+    """Class to queue model creation tasks and run their stages as the resources they need become free
+       Each job runs gathering (PullFiles, using disk and decode cpu), training (LaunchContainer, or TrainOnWorker given a worker pool, using the gpu) and registering (CreateModelEntry).
+       Stages of different jobs overlap, so one job gathers whilst another trains. Waiting stages start in order of priority (highest first) then submission,
+       a stage waiting on a resource holds it back from lower priority jobs. Jobs are kept in sqlite so queued jobs survive a restart,
+       stages that were running when PyTrain stopped are run again.
+    Args:
+        queuePath string: path of the sqlite job queue
+        slots dict: number of concurrent stages each resource allows (see DefaultSlots)
+        imageTag string: training container image
+        pool TrainingWorkerPool: started pool of warm training workers, a container is launched for each task if None
+    """
+    def __init__(self, queuePath="./jobs.sqlite", slots=None, imageTag="cudatf", pool=None):
+        self.slots = slots or DefaultSlots()
+        self.inUse = {resource: 0 for resource in self.slots}
+        self.imageTag = imageTag
+        self.pool = pool
+        self.connection = sqlite3.connect(queuePath)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.connection.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self.connection.commit()
+        self.wake = asyncio.Event()
+        self.running = set()
+
+    def Submit(self, taskID, priority=0):
+        """Function to queue a task for gathering, training and registering
+        Args:
+            taskID int: task ID of the task to create a model for
+            priority int: higher priority jobs start their stages first
+        Returns:
+            int: jobID
+        """
+        now = time.time()
+        jobID = self.connection.execute("INSERT INTO jobs (task_id, priority, stage, status, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                                        (taskID, priority, STAGES[0], now, now)).lastrowid
+        self.connection.commit()
+        self.wake.set()
+        return jobID
+
+    def GetJob(self, jobID):
+        """Function to get the state of a job
+        Args:
+            jobID int: id returned by Submit
+        Returns:
+            dict: job row, None if there is no such job
+        """
+        row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (jobID,)).fetchone()
+        return dict(row) if row else None
+
+    def UpdateJob(self, jobID, **fields):
+        """Function to update the given columns of a job
+        Args:
+            jobID int: id of the job
+            fields: column values to set
+        """
+        fields['updated'] = time.time()
+        self.connection.execute(f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?", (*fields.values(), jobID))
+        self.connection.commit()
+
+    async def Run(self):
+        """Function to start waiting stages whenever a job is submitted or a stage finishes
+        1. Take the queued jobs in order of priority then submission
+        2. Start each job whose stage resources are free (and not held for a higher priority job), taking its slots
+        3. Hold the resources of jobs that cannot start so lower priority jobs do not overtake them
+        4. Wait until a job is submitted or a stage finishes and repeat
+        """
+        while True:
+            self.wake.clear()
+            held = set()
+            for job in self.connection.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY priority DESC, id").fetchall():
+                resources = STAGE_RESOURCES[job['stage']]
+                if any(resource in held or self.inUse[resource] >= self.slots[resource] for resource in resources):
+                    held.update(resources)
+                    continue
+                for resource in resources:
+                    self.inUse[resource] += 1
+                self.UpdateJob(job['id'], status='running')
+                stageTask = asyncio.create_task(self.RunStage(dict(job), resources))
+                self.running.add(stageTask)
+                stageTask.add_done_callback(self.running.discard)
+            await self.wake.wait()
+
+    async def RunStage(self, job, resources):
+        """Function to run the current stage of a job, then queue its next stage or finish it
+        1. Update the task status and run the stage
+        2. On success queue the next stage, or mark the job done after registering
+        3. On failure set the task to failed
+        4. Release the stage resources and wake the scheduler
+        Args:
+            job dict: job row
+            resources tuple: resources held by the stage
+        """
+        taskID = job['task_id']
+        try:
+            if job['stage'] == "gathering":
+                await UpdateTaskStatus(taskID, "gathering")
+                folderPath = await PullFiles(taskID)
+                self.UpdateJob(job['id'], folder_name="/".join(folderPath.split("/")[2:]), stage="training", status='queued')
+            elif job['stage'] == "training":
+                await UpdateTaskStatus(taskID, "training")
+                if self.pool:
+                    succeeded, modelName = await TrainOnWorker(self.pool, taskID, job['folder_name'])
+                else:
+                    succeeded, modelName = await LaunchContainer(self.imageTag, taskID, job['folder_name'])
+                if not succeeded:
+                    raise RuntimeError(f"Training container for {modelName} failed")
+                await UpdateTaskStatus(taskID, "trained")
+                self.UpdateJob(job['id'], model_name=modelName, stage="registering", status='queued')
+            else:
+                if not await CreateModelEntry(taskID, job['model_name']):
+                    raise RuntimeError(f"Model entry for {job['model_name']} could not be created")
+                self.UpdateJob(job['id'], status='done')
+                print(f"Task {taskID} has succeeded")
+        except Exception as e:
+            print(f"Task {taskID} has failed at {job['stage']}: {e}")
+            self.UpdateJob(job['id'], status='failed', error=str(e))
+            try:
+                await UpdateTaskStatus(taskID, "failed")
+            except Exception as statusError:
+                print(f"Could not set task {taskID} to failed: {statusError}")
+        finally:
+            for resource in resources:
+                self.inUse[resource] -= 1
+            self.wake.set()
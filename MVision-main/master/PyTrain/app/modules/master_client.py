@@ -0,0 +1,109 @@
+import os
+import time
+import asyncio
+
+import aiohttp
+
+class MasterClient:
+    """Class to call the master API from async code over a pooled keep-alive session, without blocking the event loop
+       The class and source maps change rarely, so they are cached for mapTTL seconds (refetched once expired, or after InvalidateMaps)
+    Args:
+        baseUrl string: address of the master API
+        mapTTL float: seconds the class and source maps are cached for
+        limit int: largest number of concurrent connections
+        timeout float: seconds before a request is abandoned
+    """
+    def __init__(self, baseUrl="http://localhost:3000", mapTTL=300, limit=16, timeout=30):
+        self.baseUrl = baseUrl
+        self.mapTTL = mapTTL
+        self.limit = limit
+        self.timeout = timeout
+        self.session = None
+        self.maps = {}
+        self.mapLocks = {}
+
+    async def Session(self):
+        """Function to get the session, creating it on first use (within the running event loop)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 raise_for_status=True)
+        return self.session
+
+    async def Get(self, path):
+        """Function to get a JSON resource of the master API
+        Args:
+            path string: path of the resource (i.e /tasks/id/1)
+        Returns:
+            json: response body
+        """
+        session = await self.Session()
+        async with session.get(f"{self.baseUrl}{path}") as response:
+            return await response.json()
+
+    async def Post(self, path, body):
+        """Function to post a JSON body to the master API
+        Args:
+            path string: path of the endpoint (i.e /tasks/update)
+            body dict: request body
+        Returns:
+            json: response body
+        """
+        session = await self.Session()
+        async with session.post(f"{self.baseUrl}{path}", json=body) as response:
+            return await response.json()
+
+    async def GetTask(self, taskID):
+        """Function to get the task data (i.e hyper perameters)
+        Args:
+            taskID int: task ID
+        Returns:
+            json: task
+        """
+        result = await self.Get(f"/tasks/id/{taskID}")
+        return result[0]['get_task'][0]
+
+    async def GetTaskResources(self, taskID):
+        """Function to get the class IDs, source IDs and data of a task, fetched concurrently
+        Args:
+            taskID int: task ID
+        Returns:
+            array: classes
+            array: sources
+            json: task
+        """
+        classesResult, sourcesResult, task = await asyncio.gather(self.Get(f"/tasks/{taskID}/classes"),
+                                                                  self.Get(f"/tasks/{taskID}/sources"),
+                                                                  self.GetTask(taskID))
+        return classesResult[0]['get_task_classes']["classes"], sourcesResult[0]['get_task_sources']["sources"], task
+
+    async def GetMap(self, mapType):
+        """Function to get a map of IDs to Names, from the cache unless it has expired
+           Concurrent callers share a single fetch of an expired map
+        Args:
+            mapType string: class or source
+        Returns:
+            dict: names keyed by ID
+        """
+        lock = self.mapLocks.setdefault(mapType, asyncio.Lock())
+        async with lock:
+            cached = self.maps.get(mapType)
+            if cached and cached[0] > time.monotonic():
+                return cached[1]
+            result = await self.Get(f"/maps/{mapType}")
+            mapping = result[0][f'get_{mapType}_map']
+            self.maps[mapType] = (time.monotonic() + self.mapTTL, mapping)
+            return mapping
+
+    def InvalidateMaps(self):
+        """Function to drop the cached maps, so they are fetched again on next use (i.e once a class or source is added)"""
+        self.maps.clear()
+
+    async def Close(self):
+        """Function to close the session and its pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+MASTER_CLIENT = MasterClient(os.environ.get("PYTRAIN_MASTER_URL", "http://localhost:3000"),
+                             float(os.environ.get("PYTRAIN_MAP_TTL", 300)))
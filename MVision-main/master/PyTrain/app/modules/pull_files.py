@@ -1,99 +1,18 @@
 import os
-import fnmatch
 import random
 import shutil
+import asyncio
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import requests
 
-def FindClasses(parentPath, classNames):
-    """Function to collate the class directories that begin with the class name
-       Add remaining folder paths to the "Other" class
-    1. For each item in the folder directory
-    2. If its a folder
-    3. Check if it matches any of the class names selected for the task
-       if it matches confirm by setting matched to True
-    4. If no match then the path should be appended to "Other"
-    5. Repeat until all items are cycled through
+import aiohttp
 
-    Args:
-        parentPath string: path of parent folder (source folder)
-        classNames: array of all class names needing to be selected
-    
-    Returns:
-        dict: classDirectories 
-        """
-    classDirectories = {className: [] for className in classNames}
-    classDirectories["Other"] = []  
-    for item in os.listdir(parentPath):
-        itemPath = os.path.join(parentPath, item)
-        if os.path.isdir(itemPath):
-            
-            matched = False
-            for className in classNames:
-                if item.lower().startswith(className.lower()):
-                    classDirectories[className].append(itemPath)
-                    matched = True
-                    break
-            if not matched:
-                classDirectories["Other"].append(itemPath)
-    return classDirectories
-
-def FindDirectories(sources, directoryPath, classes):
-    """Function to collate classes from each chosen source
-    1. For each source
-    2. If source is a directory
-    3. Find the classes for that directory
-    4. Append the found class directories to the class paths dictionary 
-    5. Repeat until all items are cycled through
-
-    Args:
-        sources string: name of source folder (identical to source)
-        directoryPath string: directory path to the source location
-        classes: array of all class names needing to be selected
-    
-    Returns:
-        dict: classPaths 
-        """
-    classPaths = {"Other": []}  
-    for className in classes:  
-        classPaths[className] = []
-    for source in sources:
-        sourcePath = os.path.join(directoryPath, source)
-        print(f"Processing source path: {sourcePath}")
-        if os.path.exists(sourcePath):
-            
-            foundDirectories = FindClasses(sourcePath, classes)
-            
-            for key, paths in foundDirectories.items():
-                classPaths[key].extend(paths)
-
-    return classPaths
-
-def FindFiles(classPaths):
-    """Function to collate all mp4 files from each folder location and add them to classFiles dict
-    1. For each class
-    2. Get directories that feature said class
-    3. Find mp4 files in those directories
-    4. Check if given class is already part of the classFiles dict
-    5. Add files paths to the dict
-    6. Repeat until all items are cycled through
-
-    Args:
-        classPaths dict: dictionary of class keys and values of the folder directory that their videos are stored in
-    
-    Returns:
-        dict: classFiles 
-        """
-    classFiles = {}
-    for classType in classPaths:
-        directories = classPaths[classType]
-        for directory in directories:
-            files = fnmatch.filter(os.listdir(directory), "*.mp4")
-            if files:  
-                if classType not in classFiles:
-                    classFiles[classType] = {}
-                classFiles[classType][directory] = files
-    return classFiles
+from docker_components.load_data import WriteShards
+from docker_components.cache_store import ClipCache
+from modules.catalog import OpenCatalog, RefreshCatalog, FindCatalogDirectories, FindCatalogFiles, CatalogFrameCounts
+from modules.master_client import MASTER_CLIENT
 
 def DisplayTree(classFiles):
         for classType, directories in classFiles.items():
@@ -123,7 +42,7 @@ def AdjustCount(classDirectories, trainingAmount):
     7. Repeat for each directory path & class
 
     Args:
-        classDirectories dict: dictionary of class keys and values of the paths to video files for that class
+        classDirectories dict: dictionary of class keys and values of the directories and mp4 files (from FindCatalogFiles) for that class
         trainingAmount int: total amount of video required 
     Returns:
         dict: reducedFiles 
@@ -133,12 +52,11 @@ def AdjustCount(classDirectories, trainingAmount):
         reducedFiles[className] = {}
         requiredCount = trainingAmount
         initialCount = trainingAmount // len(directories)
-        totalCount = sum(len(os.listdir(path)) for path in directories)
+        totalCount = sum(len(files) for files in directories.values())
         if totalCount < trainingAmount:
             print(f"Warning: Not enough videos for class {className}. Available: {totalCount}, Needed: {trainingAmount}")
             requiredCount = totalCount
-        for path in directories:
-            availableVideos = os.listdir(path)  
+        for path, availableVideos in directories.items():
             neededVideos = min(len(availableVideos), initialCount if requiredCount >= initialCount else requiredCount)
             selectedVideos = random.sample(availableVideos, neededVideos)
             reducedFiles[className][path] = selectedVideos
@@ -148,33 +66,37 @@ def AdjustCount(classDirectories, trainingAmount):
                 initialCount = requiredCount // remainingCount
     return reducedFiles
 
-def CopyFiles(finalFiles, splits, modelName):
-    """Function to create the model_task entry and transfer all the chosen video files to the correct file structure for processing.
+def CopyFiles(finalFiles, splits, modelName, mode=None, sourcesPath="./sources", frameCounts=None):
+    """Function to create the model_task entry and materialise all the chosen video files in the correct file structure for processing.
        Differentiate tasks with the same name by labelling the timestamp at which they are created.
        Should create a file structure with a train, validation and test folder
-       It attempts to taken an even amount of samples from each folder to try and improve generability of the model
+       Rather than copying every video the task folder holds hardlinks to the sources (copied in parallel if the sources are on another filesystem),
+       or in manifest mode no videos at all, with manifest.json recording the class, split, source, size, hash and catalogued frame count of each video.
+       The training loader reads the videos through the manifest, straight from the sources if they were not linked.
     1. Create directory paths based on split names (train, validation, test)
     2. Sort through each class name and generate array of os.path types.
     3. Shuffle the paths to mix their order so that any splits are not dictated by initial loading order
     4. Allocate files to each type of split. Order of train, validation and test.
-    5. Copy the given files to the new folder locations
-    6. Return the name of the new folder in model_tasks
+    5. Link (or copy) the given files to the new folder locations in parallel, hashing each as it goes
+    6. Write the manifest
+    7. Return the name of the new folder in model_tasks
 
     Args:
         finalFiles dict: dictionary of class keys and values of the reduced number of paths to files
         splits dict: dict of train, validation and test amounts
         modelName: name of the model that will be produced
+        mode string: link (default) to hardlink with a copy fallback, copy to always copy, manifest to only write the manifest (PYTRAIN_MATERIALISE if not given)
+        sourcesPath string: path of the sources folder, recorded so the loader can find unlinked videos
+        frameCounts dict: catalogued frame count keyed by video path (see CatalogFrameCounts), recorded so the loader need not probe the videos
     Returns:
         string: baseDirectory 
         """
+    mode = mode or os.environ.get("PYTRAIN_MATERIALISE", "link")
     timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M")
     baseDirectory = f"../model_tasks/{modelName}_{timestamp}"
     os.makedirs(baseDirectory, exist_ok=True)
-    
-    splitDirectories = {split: os.path.join(baseDirectory, split) for split in splits.keys()}
-    for splitDirectories in splitDirectories.values():
-        os.makedirs(splitDirectories, exist_ok=True)
 
+    allocation = []
     for className, directories in finalFiles.items():
         allFiles = []
         for directory, filenames in directories.items():
@@ -184,27 +106,115 @@ def CopyFiles(finalFiles, splits, modelName):
         random.shuffle(allFiles)
 
         for split, count in splits.items():
-            splitDirectories = splitDirectories[split]
-            
-            classDir = os.path.join(splitDirectories, className)
+            classDir = os.path.join(baseDirectory, split, className)
             os.makedirs(classDir, exist_ok=True)
             
             splitFiles = allFiles[:count]
             allFiles = allFiles[count:]  
             
             for filePath in splitFiles:
-                destPath = os.path.join(classDir, os.path.basename(filePath))
-                shutil.copy(filePath, destPath)
-                print(f"Copied {filePath} to {destPath}")
+                allocation.append((className, split, filePath, os.path.join(classDir, os.path.basename(filePath))))
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        files = list(executor.map(lambda entry: MaterialiseFile(*entry, baseDirectory, sourcesPath, mode), allocation))
+    for (_, _, filePath, _), entry in zip(allocation, files):
+        entry["frame_count"] = (frameCounts or {}).get(filePath)
+
+    manifest = {"sources": os.path.abspath(sourcesPath), "mode": mode, "files": files}
+    with open(os.path.join(baseDirectory, "manifest.json"), "w") as manifestFile:
+        json.dump(manifest, manifestFile, indent=1)
+    methods = [entry["method"] for entry in files]
+    print(f"Materialised {len(files)} files: {methods.count('hardlink')} linked, {methods.count('copy')} copied, {methods.count('manifest')} manifest only")
     return baseDirectory
 
-def GetModelParameters(taskID):
-    """Function to get model name, class, source and split distribution
-    1. Get classes
-    2. Get sources
-    3. Get task information
-    4. Retrieve information from result bodies
-    5. Return classes, sources, splits, modelName
+def MaterialiseFile(className, split, filePath, destPath, baseDirectory, sourcesPath, mode):
+    """Function to place a single video in the task folder and describe it for the manifest
+    1. Unless in manifest mode, hardlink the video (link mode) falling back to a copy when it is on another filesystem
+    2. Hash the video and return its manifest entry
+
+    Args:
+        className string: class of the video
+        split string: split of the video
+        filePath string: path of the video in the sources
+        destPath string: path of the video in the task folder
+        baseDirectory string: path of the task folder
+        sourcesPath string: path of the sources folder
+        mode string: link, copy or manifest
+    Returns:
+        dict: manifest entry
+    """
+    method = "manifest"
+    if mode != "manifest":
+        method = "copy"
+        if mode == "link":
+            try:
+                os.link(filePath, destPath)
+                method = "hardlink"
+            except OSError:
+                pass
+        if method == "copy":
+            shutil.copy2(filePath, destPath)
+    return {
+        "class": className,
+        "split": split,
+        "source": os.path.relpath(filePath, sourcesPath),
+        "path": os.path.relpath(destPath, baseDirectory),
+        "size": os.path.getsize(filePath),
+        "hash": FileHash(filePath),
+        "method": method
+    }
+
+def FileHash(filePath, sampleBytes=1024 * 1024):
+    """Function to hash a video from its size and its first and last sampleBytes, so hashing is fast regardless of video size
+    Args:
+        filePath string: path of the video
+        sampleBytes int: bytes read from each end
+    Returns:
+        string: sha1 hex digest
+    """
+    size = os.path.getsize(filePath)
+    digest = hashlib.sha1(str(size).encode())
+    with open(filePath, "rb") as videoFile:
+        digest.update(videoFile.read(sampleBytes))
+        if size > sampleBytes:
+            videoFile.seek(max(size - sampleBytes, sampleBytes))
+            digest.update(videoFile.read(sampleBytes))
+    return digest.hexdigest()
+
+def OpenClipCache():
+    """Function to open the clip cache shared with training (../cache, mounted at /cache within the training containers)
+       Kept within PYTRAIN_CACHE_BUDGET_GB (50 by default), 0 disables it
+    Returns:
+        ClipCache: clip cache, None if disabled
+    """
+    budget = float(os.environ.get("PYTRAIN_CACHE_BUDGET_GB", 50))
+    if budget <= 0:
+        return None
+    return ClipCache(os.path.abspath("../cache"), int(budget * 1024 ** 3))
+
+def IngestFiles(taskDirectory, splits, frameCount, frameStep=5, cache=None):
+    """Function to pack the videos of each split into memory mappable shards, so training reads arrays rather than running the video codec every epoch
+    1. For each split
+    2. Copy several clips of each video into uint8 shards at the training resolution from the clip cache, decoding only videos no earlier task has (see WriteShards)
+    3. Display the number of clips and shards written
+
+    Args:
+        taskDirectory string: path of the model_task folder
+        splits dict: dict of train, validation and test amounts
+        frameCount int: number of frames gathered from each clip
+        frameStep int: number of video frames between each gathered frame
+        cache ClipCache: store of decoded clips shared between tasks, None to decode every video
+    """
+    for split in splits:
+        index = WriteShards(os.path.join(taskDirectory, split), frameCount, frameStep, cache=cache)
+        print(f"Ingested {len(index['entries'])} clips of {split} into {len(index['shards'])} shards")
+
+async def GetModelParameters(taskID):
+    """Function to get model name, class, source, split distribution and frame sampling
+    1. Get classes, sources and task information concurrently
+    2. Retrieve information from result bodies
+    3. Return classes, sources, splits, modelName, frameCount, frameStep
+    4. If the master API fails or returns an unexpected body raise, so the job sets the task to failed
     Args:
         taskID int: task ID of current task that is executing
     Returns:
@@ -212,51 +222,46 @@ def GetModelParameters(taskID):
         array: sources
         splits: dict
         modelName: string
+        frameCount: int
+        frameStep: int (5 unless set for the task)
     """
     try:
-        classesResult = requests.get(f"http://localhost:3000/tasks/{taskID}/classes")
-        sourcesResult = requests.get(f"http://localhost:3000/tasks/{taskID}/sources")
-        taskResult = requests.get(f"http://localhost:3000/tasks/id/{taskID}")
-        classes = classesResult.json()[0]['get_task_classes']["classes"]
-        sources = sourcesResult.json()[0]['get_task_sources']["sources"]
-        task = taskResult.json()[0]['get_task'][0]
+        classes, sources, task = await MASTER_CLIENT.GetTaskResources(taskID)
         splits = {"train": task['train'], "validation":task['verification'], "test":task['test']}
         modelName = task['model_name']
-        return classes, sources, splits, modelName
-    except:
-        print("Change status to failed")
+        frameCount = task['num_frames']
+        frameStep = task.get('frame_step') or 5
+        return classes, sources, splits, modelName, frameCount, frameStep
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, IndexError, TypeError) as e:
+        raise RuntimeError(f"Model parameters for task {taskID} could not be retrieved from the master API: {e!r}") from e
 
-def GetClassMaps(classes):
+async def GetClassMaps(classes):
     """Function to get class map of IDs to Names
-    1. Get class maps
-    2. Reduce JSON to map element
-    3. For each classID get its name in the map and save to an array
-    5. Return classNames
+    1. Get class maps (cached by the master client)
+    2. For each classID get its name in the map and save to an array
+    3. Return classNames
     Args:
         classes array: class IDs for current task
     Returns:
         array: classNames
     """
-    classResult = requests.get(f"http://localhost:3000/maps/class")
-    classMap = classResult.json()[0]['get_class_map']
+    classMap = await MASTER_CLIENT.GetMap("class")
     classNames = []
     for classID in classes:
         classNames.append(classMap[f"{classID}"])
     return classNames
 
-def GetSourceMaps(sources):
+async def GetSourceMaps(sources):
     """Function to get source map of IDs to Names
-    1. Get source maps
-    2. Reduce JSON to map element
-    3. For each sourceID get its name in the map and save to an array
-    5. Return sourceNames
+    1. Get source maps (cached by the master client)
+    2. For each sourceID get its name in the map and save to an array
+    3. Return sourceNames
     Args:
         sources array: source IDs for current task
     Returns:
         array: sourceNames
     """
-    sourceResult = requests.get(f"http://localhost:3000/maps/source")
-    sourceMap = sourceResult.json()[0]['get_source_map']
+    sourceMap = await MASTER_CLIENT.GetMap("source")
     sourceNames = []
     for sourceID in sources:
         sourceNames.append(sourceMap[f"{sourceID}"])
@@ -265,29 +270,37 @@ def GetSourceMaps(sources):
 async def PullFiles(taskID):
     """Function to pull the class videos and organise them into the correct folders of training
        testing and validation with the correct video amounts.
+       API calls are asynchronous and copying and decoding run in worker threads, so other jobs progress meanwhile.
     1. Retrieve model parameters: Array of classes, Source of Videos, Training/Test/Validation Splits and the Model Name
     2. Retrieve Class Maps to get Names from IDs
     3. Retrieve Source Maps to get Names from IDs
-    4. Sets directory for where the sources can be found
-    5. Finds the directories that match the classes and collate directories for the "Other" class
-    6. Find the files from the classes in classPaths
+    4. Sets directory for where the sources can be found and refresh the catalog of those sources (only changed class folders are rescanned)
+    5. Query the catalog for the directories that match the classes and collate directories for the "Other" class
+    6. Query the catalog for the files from the classes in classPaths
     7. Display the totally compiled classFiles
-    8. 
+    8. Reduce and materialise the files into the train, validation and test folders of the model_task, recording their catalogued frame counts
+    9. Decode the copied videos into shards for training
 
     Args:
         request: http object recieved from endpoint
     
     Returns:
         """
-    classes, sources, splits, modelName = GetModelParameters(taskID)
-    classes = GetClassMaps(classes)
-    sources = GetSourceMaps(sources)
+    classes, sources, splits, modelName, frameCount, frameStep = await GetModelParameters(taskID)
+    classes, sources = await asyncio.gather(GetClassMaps(classes), GetSourceMaps(sources))
     directoryPath = "./sources"
-    classPaths = FindDirectories(sources, directoryPath, classes)
-    classFiles = FindFiles(classPaths)
-    DisplayTree(classFiles)
-    finalFiles = AdjustCount(classFiles,sum(splits.values()))
-    DisplayTree(finalFiles)
-    taskDirectory = CopyFiles(finalFiles, splits, modelName)
+    catalog = OpenCatalog()
+    try:
+        await asyncio.to_thread(RefreshCatalog, catalog, directoryPath, sources)
+        classPaths = FindCatalogDirectories(catalog, sources, classes)
+        classFiles = FindCatalogFiles(catalog, classPaths)
+        DisplayTree(classFiles)
+        finalFiles = AdjustCount(classFiles,sum(splits.values()))
+        DisplayTree(finalFiles)
+        frameCounts = CatalogFrameCounts(catalog, finalFiles)
+    finally:
+        catalog.close()
+    taskDirectory = await asyncio.to_thread(CopyFiles, finalFiles, splits, modelName, sourcesPath=directoryPath, frameCounts=frameCounts)
     print(f"Files Moved to {taskDirectory}")
+    await asyncio.to_thread(IngestFiles, taskDirectory, splits, frameCount, frameStep, OpenClipCache())
     return taskDirectory  
\ No newline at end of file
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+import asyncio
+import subprocess
+from multiprocessing.connection import Client
+
+import docker
+
+from modules.dockerise_model import HostPath
+
+COMPONENTS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docker_components")
+
+class TrainingWorkerPool:
+    """Class to keep long lived training workers (docker_components/training_worker.py) with TensorFlow loaded, so each task only pays for training
+       Workers are local processes (mode "local", no Docker required) or containers of the training image (mode "container"),
+       each listening on its own port from basePort and running one job at a time.
+    Args:
+        size int: number of workers
+        mode string: local or container
+        imageTag string: training container image (container mode)
+        basePort int: port of the first worker
+        host string: address the workers listen on
+    """
+    def __init__(self, size=1, mode="container", imageTag="cudatf", basePort=6100, host="127.0.0.1"):
+        self.size = size
+        self.mode = mode
+        self.imageTag = imageTag
+        self.basePort = basePort
+        self.host = host
+        self.authkey = os.urandom(16)
+        self.workers = {}
+        self.idle = asyncio.Queue()
+
+    async def Start(self):
+        """Function to start every worker of the pool, they become idle as soon as they are started (jobs wait for them to finish loading)"""
+        for port in range(self.basePort, self.basePort + self.size):
+            self.workers[port] = await asyncio.to_thread(self.StartWorker, port)
+            self.idle.put_nowait(port)
+
+    def StartWorker(self, port):
+        """Function to start a single worker
+        Args:
+            port int: port the worker listens on
+        Returns:
+            subprocess.Popen or docker container: the worker
+        """
+        command = ["training_worker.py", "--host", self.host, "--port", str(port)]
+        environment = {"PYTRAIN_WORKER_AUTHKEY": self.authkey.hex()}
+        if self.mode == "local":
+            return subprocess.Popen([sys.executable] + command, cwd=COMPONENTS_PATH, env={**os.environ, **environment})
+        absPath = HostPath()
+        client = docker.from_env()
+        return client.containers.run(f"{self.imageTag}:latest",
+                            name=f"pytrain_worker_{port}",
+                            detach=True,
+                            network_mode="host",
+                            device_requests=[docker.types.DeviceRequest(count=-1, capabilities=[['gpu']])],
+                            entrypoint=["python3"] + command,
+                            environment=environment,
+                            volumes={
+                                f"{absPath}/model_tasks": {'bind': '/model_tasks', 'mode': 'rw'},
+                                f"{absPath}/model_repo": {'bind': '/model_repo', 'mode': 'rw'},
+                                f"{absPath}/cache": {'bind': '/cache', 'mode': 'rw'},
+                                f"{absPath}/app/sources": {'bind': '/sources', 'mode': 'ro'},
+                            })
+
+    def StopWorker(self, port):
+        """Function to stop a single worker
+        Args:
+            port int: port the worker listens on
+        """
+        worker = self.workers.pop(port, None)
+        if worker is None:
+            return
+        if self.mode == "local":
+            worker.terminate()
+            worker.wait()
+        else:
+            worker.remove(force=True)
+
+    def JobPaths(self, folderName):
+        """Function to get the task folder, model_repo and clip cache paths as seen by the workers
+        Args:
+            folderName string: folder name of the model_task
+        Returns:
+            tuple: folderPath, repoPath, cachePath
+        """
+        if self.mode == "local":
+            return os.path.abspath(f"../model_tasks/{folderName}"), os.path.abspath("../model_repo"), os.path.abspath("../cache")
+        return f"/model_tasks/{folderName}", "/model_repo", "/cache"
+
+    def Send(self, port, job, timeout=600):
+        """Function to send a job to a worker and wait for its result, retrying the connection whilst the worker is still loading
+        Args:
+            port int: port of the worker
+            job dict: job for the worker, None to stop it
+            timeout float: seconds to wait for the worker to accept the connection
+        Returns:
+            dict: result sent back by the worker
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                connection = Client((self.host, port), authkey=self.authkey)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(1)
+        with connection:
+            connection.send(job)
+            return connection.recv()
+
+    async def Submit(self, argv, folderName):
+        """Function to train a job on the next idle worker
+        1. Wait for an idle worker
+        2. Send it the training arguments and the paths of the task folder, model_repo and clip cache
+        3. Wait for its result in a worker thread
+        4. Restart the worker if it could not be reached or died during the job
+        5. Return the worker to the idle queue
+        Args:
+            argv array: training arguments (see TrainingArguments)
+            folderName string: folder name of the model_task
+        Returns:
+            dict: status (trained or failed) with the result of Train or the error
+        """
+        port = await self.idle.get()
+        folderPath, repoPath, cachePath = self.JobPaths(folderName)
+        job = {'argv': argv + ["--cache_dir", cachePath], 'folder_path': folderPath, 'repo_path': repoPath}
+        try:
+            return await asyncio.to_thread(self.Send, port, job)
+        except (OSError, EOFError) as e:
+            print(f"Training worker {port} failed, restarting it: {e!r}")
+            await asyncio.to_thread(self.StopWorker, port)
+            self.workers[port] = await asyncio.to_thread(self.StartWorker, port)
+            return {'status': 'failed', 'error': f"Training worker {port} failed: {e!r}"}
+        finally:
+            self.idle.put_nowait(port)
+
+    async def Close(self):
+        """Function to stop every worker of the pool, idle workers are asked to stop and busy workers are stopped outright"""
+        while not self.idle.empty():
+            port = self.idle.get_nowait()
+            try:
+                await asyncio.to_thread(self.Send, port, None, 0)
+            except (OSError, EOFError):
+                pass
+        for port in list(self.workers):
+            await asyncio.to_thread(self.StopWorker, port)
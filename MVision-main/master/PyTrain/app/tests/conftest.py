@@ -0,0 +1,5 @@
+import os
+import sys
+
+# PyTrain runs from the app folder, so its modules are imported as the modules package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
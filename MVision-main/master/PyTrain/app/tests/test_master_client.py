@@ -0,0 +1,89 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from modules.master_client import MasterClient
+
+def StandInMaster():
+    """Stand in for the master API serving a task, its classes and sources and the maps
+       Each request is recorded with the client port it arrived from, the resources of task 1 only answer once all three are requested at once
+    """
+    requests = []
+    taskRequests = []
+    allRequested = asyncio.Event()
+
+    async def TaskResource(request, body):
+        taskRequests.append(request.path)
+        if len(taskRequests) == 3:
+            allRequested.set()
+        await asyncio.wait_for(allRequested.wait(), 2)
+        return web.json_response(body)
+
+    @web.middleware
+    async def Record(request, handler):
+        requests.append((request.path, request.transport.get_extra_info('peername')[1]))
+        return await handler(request)
+
+    async def Classes(request):
+        return await TaskResource(request, [{'get_task_classes': {'classes': [1, 2]}}])
+
+    async def Sources(request):
+        return await TaskResource(request, [{'get_task_sources': {'sources': [3]}}])
+
+    async def Task(request):
+        return await TaskResource(request, [{'get_task': [{'model_name': 'model'}]}])
+
+    async def Map(request):
+        mapType = request.match_info['mapType']
+        return web.json_response([{f'get_{mapType}_map': {'1': f'{mapType}_1'}}])
+
+    app = web.Application(middlewares=[Record])
+    app.router.add_get('/tasks/1/classes', Classes)
+    app.router.add_get('/tasks/1/sources', Sources)
+    app.router.add_get('/tasks/id/1', Task)
+    app.router.add_get('/maps/{mapType}', Map)
+    return app, requests
+
+async def Serve(test):
+    app, requests = StandInMaster()
+    server = TestServer(app)
+    await server.start_server()
+    client = MasterClient(f"http://{server.host}:{server.port}", mapTTL=0.2)
+    try:
+        await test(client, requests)
+    finally:
+        await client.Close()
+        await server.close()
+
+def test_task_resources_fetched_concurrently():
+    async def test(client, requests):
+        classes, sources, task = await client.GetTaskResources(1)
+        assert classes == [1, 2]
+        assert sources == [3]
+        assert task == {'model_name': 'model'}
+    asyncio.run(Serve(test))
+
+def test_maps_cached_until_expired():
+    async def test(client, requests):
+        assert await client.GetMap("class") == {'1': 'class_1'}
+        assert await client.GetMap("class") == {'1': 'class_1'}
+        assert await client.GetMap("source") == {'1': 'source_1'}
+        assert [path for path, _ in requests] == ['/maps/class', '/maps/source']
+        await asyncio.sleep(0.3)
+        await client.GetMap("class")
+        assert [path for path, _ in requests] == ['/maps/class', '/maps/source', '/maps/class']
+        client.InvalidateMaps()
+        await client.GetMap("class")
+        assert len(requests) == 4
+    asyncio.run(Serve(test))
+
+def test_session_reused():
+    async def test(client, requests):
+        session = await client.Session()
+        for _ in range(3):
+            client.InvalidateMaps()
+            await client.GetMap("class")
+        assert await client.Session() is session
+        assert len({port for _, port in requests}) == 1
+    asyncio.run(Serve(test))
@@ -1,5 +1,4 @@
 import json
-import configparser
 import sys
 from aiohttp import web
 import asyncio
@@ -13,9 +12,10 @@ Gst.init(None)
 
 from modules.gstreamer import UpdateSystemCameras, ManagePipelines, InitialiseGStreamer, PlayPipelines, AddNewSink, RemoveExistingSink
 from modules.connection import ConfigureConnection, ConnectDevices
-from modules.inference import FinaliseInference
-from modules.deployments import RetrieveActiveDeployments, GetModel, GatherModelInformation, ExtractList
+from modules.inference import FinaliseInference, GetBranchName, StopDeployment, IsDeploymentActive
+from modules.deployments import RetrieveActiveDeployments, GetModel, GatherModelInformation, GatherSplitInformation, ExtractList, GetFrameHop
 from modules.classes import PipelineStorage
+from modules.context import NODE_CONTEXT
 from modules.monitoring import DumpLogs, CompilePerformanceEntry, RecurringMonitoring
 
 
@@ -43,8 +43,8 @@ async def InterceptLaunchInference(request):
     2. Retrieve relevant PipelineObject to the deployment based on device name
     3. Retrieve GSTtee object from the PipelineObject
     4. Retrieve GSTpipeline from the PipelineObject
-    5. Check if GSTappsink for deployment already exists on GSTpipeline
-    6. If GSTappsink exists return "Inference active"
+    5. Check if the deployment is already subscribed to a branch of the GSTpipeline
+    6. If subscribed return "Inference active"
     7. Else Launch inference for deployment
 
     Args:
@@ -60,8 +60,7 @@ async def InterceptLaunchInference(request):
     pipelineEntry = pipelines.get_pipeline(deployment['device_name'])
     tee = pipelineEntry['tee']
     pipeline = pipelineEntry['pipeline']
-    appsink = pipeline.get_by_name(f"sink_deployment_{deployment['deployment_id']}")
-    if appsink:
+    if IsDeploymentActive(deployment['deployment_id']):
         return web.Response(status=500, text=f"Inference already active for deployment ID: {deployment['deployment_id']}", content_type='application/json')
     loggingTask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Launching inference for {deployment['device_name']}"))
     inferenceTask = loop.create_task(LaunchInference(deployment['deployment_id'], deployment['model_id'], pipeline, deployment['device_name'], tee))
@@ -75,10 +74,10 @@ async def InterceptStopInference(request):
     2. Retrieve relevant PipelineObject to the deployment based on device name
     3. Retrieve GSTtee object from the PipelineObject
     4. Retrieve GSTpipeline from the PipelineObject
-    5. Check if GSTappsink for deployment already exists on GSTpipeline
-    6. If GSTappsink doesnt exist return "Inference stopped"
-    7. Else Remove existing sink
-    8. Check that all elements are no longer present
+    5. Unsubscribe the deployment from its shared branch
+    6. If it wasnt subscribed return "Inference stopped"
+    7. If other deployments still use the branch leave it running
+    8. Else Remove the branches sink and check that all elements are no longer present
 
     Args:
         request: http object recieved from endpoint
@@ -93,17 +92,21 @@ async def InterceptStopInference(request):
     pipelineEntry = pipelines.get_pipeline(deployment['device_name'])
     tee = pipelineEntry['tee']
     pipeline = pipelineEntry['pipeline']
-    appsink = pipeline.get_by_name(f"sink_deployment_{deployment['deployment_id']}")
-    if not appsink:
+    if not IsDeploymentActive(deployment['deployment_id']):
         return web.Response(status=500, text=f"Inference already stopped for deployment ID: {deployment['deployment_id']}", content_type='application/json')
     loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Stopping inference for {deployment['device_name']}"))
-    removeSinkTask = loop.create_task(RemoveExistingSink(pipeline,f"deployment_{deployment['deployment_id']}",tee))
+    branchName = StopDeployment(pipeline, deployment['deployment_id'])
+    if not branchName:
+        loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Branch still in use by other deployments"))
+        return web.Response(status=200, text="Inference Stopped", content_type='application/json')
+    removeSinkTask = loop.create_task(RemoveExistingSink(pipeline, branchName, tee))
     while True:
-        appsink = pipeline.get_by_name(f"sink_deployment_{deployment['deployment_id']}")
-        videoscale = pipeline.get_by_name(f"videoscale_deployment_{deployment['deployment_id']}")
-        videoconvert = pipeline.get_by_name(f"videoconvert_deployment_{deployment['deployment_id']}")
-        queue = pipeline.get_by_name(f"queue_deployment_{deployment['deployment_id']}")
-        if appsink or videoscale or videoconvert or queue:
+        appsink = pipeline.get_by_name(f"sink_{branchName}")
+        videoscale = pipeline.get_by_name(f"videoscale_{branchName}")
+        scaleCapsFilter = pipeline.get_by_name(f"scalecaps_{branchName}")
+        videoconvert = pipeline.get_by_name(f"videoconvert_{branchName}")
+        queue = pipeline.get_by_name(f"queue_{branchName}")
+        if appsink or videoscale or scaleCapsFilter or videoconvert or queue:
             print("Items Still Linked")
         else:
             loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Sink successfully removed"))
@@ -114,10 +117,12 @@ async def InterceptStopInference(request):
 async def LaunchInference(deploymentID, modelID, pipeline, name, tee):
     """Function called to launch inference
        Aims to add a sink to the relevant pipeline to allow for the deployment inference to initialise
-    1. Retrieves model information from API
+    1. Retrieves model information from API (node configuration is cached by the node context)
     2. Retrieves model information from model_repo PyTrain config
-    3. Adds new sink
-    4. Waits for new sink to be detected
+    3. Adds new sink for the models branch, negotiating the model width, height and pixel format within GStreamer
+       and dropping frames at the head of the branch to match the frame step the model was trained with
+       Deployments on the same camera with the same geometry share the branch, so the sink is only added once
+    4. Waits for the branches sink to be detected
     5. Will time out if longer than "wait" time
     6. Inference is begun
     7. Deployment count is logged 
@@ -132,25 +137,40 @@ async def LaunchInference(deploymentID, modelID, pipeline, name, tee):
     global deploymentCount
     global jetson
     global csvLog
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
+    nodeConfig = NODE_CONTEXT.Config()
 
     loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, "Retrieving model"))
-    modelInformation = await GetModel(modelID, nodeConfig)
+    modelInformation = await GetModel(modelID)
     loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, "Model data retrieved"))
 
     frameCounts = modelInformation['num_frames']
     tritonLocationName = modelInformation['location_name']
-    deploymentName = f"deployment_{deploymentID}"
 
-    height, width, configClasses, inputName, outputName = await GatherModelInformation(tritonLocationName)   
+    inferenceMode = nodeConfig.get('INFERENCE', 'mode', fallback='signal')
+    frameHop = await GetFrameHop(deploymentID, int(frameCounts), nodeConfig)
+    inflightDepth = nodeConfig.getint('INFERENCE', 'inflight_depth', fallback=1)
+    modelInflightDepth = nodeConfig.getint('INFERENCE', 'model_inflight_depth', fallback=4)
+    sharedMemory = nodeConfig.getboolean('INFERENCE', 'shared_memory', fallback=True)
+    batching = None
+    if nodeConfig.getboolean('INFERENCE', 'batching', fallback=True):
+        batching = {
+            'maxBatchSize': nodeConfig.getint('INFERENCE', 'max_batch_size', fallback=8),
+            'maxDelay': nodeConfig.getint('INFERENCE', 'batch_delay_ms', fallback=20) / 1000,
+            'maxQueue': nodeConfig.getint('INFERENCE', 'batch_queue', fallback=16)
+        }
+
+    height, width, configClasses, inputName, outputName, pixelFormat, frameStep, inputDtype = await GatherModelInformation(tritonLocationName)   
     classList = await ExtractList(configClasses)
-    loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Attempting to add sink"))
-    createSinkTask = loop.create_task(AddNewSink(pipeline, deploymentName, tee))
+    splitInformation = None
+    if nodeConfig.getboolean('INFERENCE', 'split_models', fallback=True) and frameHop < int(frameCounts):
+        splitInformation = await GatherSplitInformation(tritonLocationName)
+    branchName = GetBranchName(int(width), int(height), pixelFormat, frameStep, inputDtype)
+    if not pipeline.get_by_name(f'sink_{branchName}'):
+        loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Attempting to add sink"))
+        createSinkTask = loop.create_task(AddNewSink(pipeline, branchName, tee, int(width), int(height), pixelFormat, frameStep))
     waits = 0
     while True:
-        appsink = pipeline.get_by_name(f'sink_{deploymentName}')
+        appsink = pipeline.get_by_name(f'sink_{branchName}')
         if waits == 60:
             loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f"Failed to add sink"))
             return
@@ -162,7 +182,7 @@ async def LaunchInference(deploymentID, modelID, pipeline, name, tee):
             break
         await asyncio.sleep(1)
     loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, "Finalising inference"))
-    inference_task = loop.create_task(FinaliseInference(pipeline, deploymentID, int(height), int(width), classList, frameCounts, tritonLocationName, deploymentCount, jetson, csvLog, loop, inputName, outputName))
+    inference_task = loop.create_task(FinaliseInference(pipeline, deploymentID, int(height), int(width), classList, frameCounts, tritonLocationName, deploymentCount, jetson, csvLog, loop, inputName, outputName, inferenceMode, branchName, frameHop, inflightDepth, modelInflightDepth, batching, sharedMemory, inputDtype, splitInformation))
     await inference_task
     deploymentCount = inference_task.result()
     loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f'Inference launched for {name}, Total Deployments: {deploymentCount}'))
@@ -190,9 +210,7 @@ async def GetCameras(request):
         JSON: Camera jsonBody
     """
     global cameras
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
+    nodeConfig = NODE_CONTEXT.Config()
     if not request == "manual":
         body =  {
             "get_cameras":{"node_id":nodeConfig['NODE_INFO']['node_id'],
@@ -234,6 +252,10 @@ async def ExecuteDeploymentPipeline(name, pipeline, tee):
         print(f"No active deployments for camera: {name}")
     return
 
+async def CloseContext(app):
+    """Function to close the master session of the node context when the server shuts down"""
+    await NODE_CONTEXT.Close()
+
 async def ServerUp():
     """Function to begin server initialisation
        1. Create initial log
@@ -262,6 +284,7 @@ async def ServerUp():
     app.add_routes([web.post('/node/deployments/stop', InterceptStopInference)])
     app.add_routes([web.get('/node/available', AvailableNode)])
     app.add_routes([web.get('/node/cameras', GetCameras)])
+    app.on_cleanup.append(CloseContext)
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, server, port)
@@ -0,0 +1,179 @@
+import time
+import threading
+from functools import partial
+from collections import deque
+
+import numpy as np
+import tritonclient.http as httpclient
+from tritonclient.utils import InferenceServerException
+
+from .classes import InflightPipeline
+from .transport import CreateTransport, TensorTransport
+
+batchers = {}
+batchersLock = threading.Lock()
+
+class PendingWindow:
+    """Copy of a deployments window waiting to be batched
+    Args:
+        data array: (1, frames, height, width, 3) window
+        deliver function: called with the deployments (1, classes) output row
+    """
+    def __init__(self, data, deliver):
+        self.data = data
+        self.deliver = deliver
+        self.queued = time.monotonic()
+
+class ModelBatcher:
+    """Node wide batcher for one model, windows from every deployment and camera using the model are sent as one request
+       A batch is flushed when it reaches maxBatchSize or when its oldest window has waited maxDelay seconds.
+       When more than maxQueue windows are waiting the oldest is dropped, so a slow model sheds stale windows rather than new ones.
+       Batches are sent and their results collected on the worker threads of its InflightPipeline, each with a Triton client of its own.
+       The batcher is closed once the last deployment subscribed to it stops (see ReleaseBatcher).
+    Args:
+        modelName string: name of model
+        inputName string: name of model input
+        outputName string: name of model output
+        maxBatchSize int: largest batch the model accepts (max_batch_size in its Triton config)
+        maxDelay float: seconds the oldest window can wait for a batch to fill
+        maxQueue int: number of windows that can wait before the oldest is dropped
+        inflightDepth int: number of batches the model can have on the server at once
+        classCount int: number of classes in the models output
+        sharedMemory bool: whether to send batches through shared memory slots rather than HTTP bodies
+        tritonURL string: url of the Triton server
+    """
+    def __init__(self, modelName, inputName, outputName, maxBatchSize=8, maxDelay=0.02, maxQueue=16, inflightDepth=2, classCount=None, sharedMemory=False, tritonURL='localhost:8000'):
+        self.modelName = modelName
+        self.inputName = inputName
+        self.outputName = outputName
+        self.maxBatchSize = maxBatchSize
+        self.maxDelay = maxDelay
+        self.maxQueue = max(maxQueue, maxBatchSize)
+        self.inflightDepth = inflightDepth
+        self.classCount = classCount
+        self.sharedMemory = sharedMemory and classCount is not None
+        self.transport = None
+        self.clientFactory = partial(httpclient.InferenceServerClient, url=tritonURL)
+        self.inflight = InflightPipeline(inflightDepth, threading.BoundedSemaphore(inflightDepth), self.scatter, self.report, self.close_transport, self.clientFactory)
+        self.subscribers = set()
+        self.closed = False
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.batches = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.modelName}, pending={len(self.pending)}, batches={self.batches}, dropped={self.dropped})"
+
+    def submit(self, window, deliver):
+        """Copy window out of the deployments frame ring and queue it, dropping the oldest window if the queue is full"""
+        pendingWindow = PendingWindow(np.array(window, copy=True), deliver)
+        with self.condition:
+            if len(self.pending) >= self.maxQueue:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append(pendingWindow)
+            self.condition.notify()
+
+    def next_batch(self):
+        """Wait until a batch is full or its oldest window reaches the deadline, then take it from the queue, None once the batcher is closed"""
+        with self.condition:
+            while True:
+                if self.closed:
+                    return None
+                if len(self.pending) >= self.maxBatchSize:
+                    break
+                if self.pending:
+                    remaining = self.pending[0].queued + self.maxDelay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                else:
+                    self.condition.wait()
+            count = min(len(self.pending), self.maxBatchSize)
+            return [self.pending.popleft() for _ in range(count)]
+
+    def run(self):
+        while True:
+            windows = self.next_batch()
+            if windows is None:
+                self.inflight.close()
+                return
+            if self.transport is None:
+                windowBytes = windows[0].data.nbytes
+                try:
+                    self.transport = CreateTransport(self.clientFactory, f"batcher_{self.modelName}_{id(self)}", self.modelName, self.outputName,
+                                                     windowBytes * self.maxBatchSize, (self.classCount or 0) * self.maxBatchSize, self.inflightDepth, self.sharedMemory)
+                except Exception as e:
+                    print(f"Transport for batcher of {self.modelName} could not be created, sending tensors over HTTP: {str(e)}")
+                    self.transport = TensorTransport()
+            self.batches += 1
+            self.inflight.submit(partial(self.send, windows=windows), blocking=True)
+
+    def send(self, tritonClient, windows):
+        """Infer on the windows as one batch on an InflightPipeline worker thread, returns the output along with the windows it was built from"""
+        batch = np.concatenate([pendingWindow.data for pendingWindow in windows], axis=0)
+        return self.transport.send(tritonClient, self.modelName, self.inputName, self.outputName, batch), windows
+
+    def scatter(self, result):
+        """Hand each row of a batches output back to the deployment that submitted the window"""
+        outputData, windows = result
+        for index, pendingWindow in enumerate(windows):
+            pendingWindow.deliver(outputData[index:index + 1])
+
+    def close(self):
+        """Stop once the batches already submitted have been delivered, windows still waiting are dropped"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def close_transport(self):
+        """Called once the last batch has been delivered, the worker threads close their own clients"""
+        if self.transport is not None:
+            self.transport.close()
+
+    def report(self, error):
+        if isinstance(error, InferenceServerException):
+            print(f"InferenceServerException: {str(error)}")
+        else:
+            print(f"Batch for {self.modelName} failed: {str(error)}")
+
+def GetBatcher(deploymentID, modelName, inputName, outputName, maxBatchSize=8, maxDelay=0.02, maxQueue=16, inflightDepth=2, classCount=None, sharedMemory=False):
+    """Function to subscribe a deployment to the node wide batcher for a model, created by the models first deployment
+    Args:
+        deploymentID int: deployment ID of the subscribing deployment
+        modelName string: name of model
+        inputName string: name of model input
+        outputName string: name of model output
+        maxBatchSize int: largest batch to send
+        maxDelay float: seconds the oldest window can wait for a batch to fill
+        maxQueue int: number of windows that can wait before the oldest is dropped
+        inflightDepth int: number of batches the model can have on the server at once
+        classCount int: number of classes in the models output
+        sharedMemory bool: whether to send batches through shared memory
+    Returns:
+        ModelBatcher: batcher for the model
+    """
+    with batchersLock:
+        if modelName not in batchers:
+            batchers[modelName] = ModelBatcher(modelName, inputName, outputName, maxBatchSize, maxDelay, maxQueue, inflightDepth, classCount, sharedMemory)
+        batchers[modelName].subscribers.add(deploymentID)
+        return batchers[modelName]
+
+def ReleaseBatcher(modelName, deploymentID):
+    """Function to unsubscribe a deployment from the batcher for a model, closing and removing the batcher (its thread, clients and shared memory) once no deployments remain
+    Args:
+        modelName string: name of model
+        deploymentID int: deployment ID of the stopping deployment
+    """
+    with batchersLock:
+        batcher = batchers.get(modelName)
+        if batcher is None:
+            return
+        batcher.subscribers.discard(deploymentID)
+        if batcher.subscribers:
+            return
+        del batchers[modelName]
+    batcher.close()
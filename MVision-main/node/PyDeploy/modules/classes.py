@@ -1,3 +1,7 @@
+import threading
+import queue
+import numpy as np
+
 class PipelineStorage:
     def __init__(self):
         self.storage = {}
@@ -58,4 +62,274 @@ class PipelineStorage:
         pipeline_info = self.get_pipeline(pipeline_name)
         if pipeline_info:
             return pipeline_info["sinks"]
-        return []
\ No newline at end of file
+        return []
+
+class FrameWindow:
+    """Preallocated ring of preprocessed frames for a deployment, stored as one (1, 2 * capacity, *frameShape) array.
+       Every slot is written twice (slot and slot + capacity) so the latest frames are always one contiguous view,
+       even when the ring wraps, and can be handed to the Triton client as a (1, frames, *frameShape) batch without stacking.
+    Args:
+        frames int: number of frames in an inference window
+        frameShape tuple: shape of a single preprocessed frame (height, width, 3)
+        dtype numpy.dtype: data type of the preprocessed frames
+        capacity int: number of frames held before the oldest is overwritten (at least frames)
+    """
+    def __init__(self, frames, frameShape, dtype=np.float32, capacity=None):
+        self.frames = frames
+        self.capacity = max(capacity or frames, frames)
+        self.storage = np.zeros((1, 2 * self.capacity) + tuple(frameShape), dtype=dtype)
+        self.position = 0
+        self.filled = 0
+
+    def __len__(self):
+        return min(self.filled, self.frames)
+
+    def next_slot(self, offset=0):
+        return self.storage[0, (self.position + offset) % self.capacity]
+
+    def commit(self, count=1):
+        for _ in range(count):
+            self.storage[0, self.position + self.capacity] = self.storage[0, self.position]
+            self.position = (self.position + 1) % self.capacity
+        self.filled = min(self.filled + count, self.capacity)
+
+    def append(self, frame):
+        self.next_slot()[...] = frame
+        self.commit()
+
+    def is_full(self):
+        return self.filled >= self.frames
+
+    def window(self, frames=None):
+        frames = frames or self.frames
+        end = self.position + self.capacity
+        return self.storage[:, end - frames:end]
+
+    def clear(self):
+        self.filled = 0
+
+class DeploymentConsumer:
+    """A deployment reading windows from a shared branch, its window is a view of the branches frame ring
+    Args:
+        deploymentID int: deployment ID
+        frames int: number of frames in the deployments inference window
+        modelName string: name of model
+        classList array: list of classes for model
+        inputName string: name of model input
+        outputName string: name of model output
+        clientFactory function: creates a Triton client, one for each thread that infers for the deployment
+        inferenceData array: array to store inference data
+        hop int: number of new frames between inferences, less than frames for overlapping windows (defaults to frames)
+    """
+    def __init__(self, deploymentID, frames, modelName, classList, inputName, outputName, clientFactory, inferenceData, hop=None):
+        self.deploymentID = deploymentID
+        self.frames = frames
+        self.hop = hop or frames
+        self.modelName = modelName
+        self.classList = classList
+        self.inputName = inputName
+        self.outputName = outputName
+        self.clientFactory = clientFactory
+        self.inferenceData = inferenceData
+        self.framesSinceInference = 0
+        self.inflight = None
+        self.transport = None
+        self.batcher = None
+        self.split = None
+        self.deliver = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(deployment_{self.deploymentID}, frames={self.frames}, hop={self.hop}, model={self.modelName})"
+
+class InflightPipeline:
+    """Bounded inference for a deployment, completions are handed back in the order they were submitted
+       Each request is sent and its result collected on the same worker thread, with a Triton client of that threads own
+       (tritonclient.http clients are gevent based and cannot be used from more than one thread), one worker for each request that can be in flight.
+       A window is only submitted when both a deployment slot and a model slot are free, otherwise it is skipped
+       so the streaming thread never waits on the server
+    Args:
+        depth int: number of requests the deployment can have on the server at once
+        modelSlots threading.BoundedSemaphore: slots shared by every deployment of the same model
+        onResult function: called with the result of each request in submission order
+        onError function: called with the exception of a failed request
+        onClose function: called once the pipeline has stopped, i.e to release its transport
+        clientFactory function: creates the Triton client of each worker thread
+    """
+    def __init__(self, depth, modelSlots, onResult, onError, onClose=None, clientFactory=None):
+        self.depth = depth
+        self.onClose = onClose
+        self.slots = threading.BoundedSemaphore(depth)
+        self.modelSlots = modelSlots
+        self.onResult = onResult
+        self.onError = onError
+        self.clientFactory = clientFactory
+        self.pending = queue.Queue()
+        self.completed = {}
+        self.submitted = 0
+        self.delivered = 0
+        self.running = depth
+        self.lock = threading.Lock()
+        self.closed = False
+        self.skipped = 0
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(depth)]
+        for thread in self.threads:
+            thread.start()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(depth={self.depth}, pending={self.pending.qsize()}, skipped={self.skipped})"
+
+    def submit(self, request, blocking=False):
+        """Queue request (a function taking a Triton client and returning the result) if a slot is free, or once one is if blocking, returns whether it was submitted
+           The request runs on a worker thread, so any data it reads must not be overwritten by the caller afterwards.
+           Requests submitted once the pipeline is closed are refused, as no worker is left to run them and release their slots
+        """
+        if not self.slots.acquire(blocking=blocking):
+            self.skipped += 1
+            return False
+        if not self.modelSlots.acquire(blocking=blocking):
+            self.slots.release()
+            self.skipped += 1
+            return False
+        with self.lock:
+            if not self.closed:
+                self.pending.put((self.submitted, request))
+                self.submitted += 1
+                return True
+        self.release()
+        return False
+
+    def release(self):
+        self.modelSlots.release()
+        self.slots.release()
+
+    def work(self):
+        tritonClient = self.clientFactory() if self.clientFactory else None
+        try:
+            while True:
+                item = self.pending.get()
+                if item is None:
+                    return
+                sequence, request = item
+                try:
+                    self.complete(sequence, request(tritonClient), None)
+                except Exception as e:
+                    self.complete(sequence, None, e)
+        finally:
+            if tritonClient is not None:
+                tritonClient.close()
+            with self.lock:
+                self.running -= 1
+                stopped = self.running == 0
+            if stopped and self.onClose:
+                self.onClose()
+
+    def complete(self, sequence, result, error):
+        """Hold the outcome of a request until every earlier request has been delivered, then deliver them in order"""
+        with self.lock:
+            self.completed[sequence] = (result, error)
+            while self.delivered in self.completed:
+                result, error = self.completed.pop(self.delivered)
+                self.delivered += 1
+                try:
+                    if error is None:
+                        self.onResult(result)
+                    else:
+                        self.onError(error)
+                except Exception as e:
+                    self.onError(e)
+                finally:
+                    self.release()
+
+    def close(self):
+        """Stop once the requests already submitted have been delivered, later submissions are refused"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for _ in self.threads:
+                self.pending.put(None)
+
+class SharedBranch:
+    """One GStreamer branch and one preprocessed frame ring shared by every deployment on a camera with the same input geometry
+    Args:
+        pipelineName string: name of the pipeline (camera) the branch belongs to
+        name string: name the branch elements are labelled with
+        frameShape tuple: shape of a single preprocessed frame (height, width, 3)
+        dtype numpy.dtype: data type of the preprocessed frames, float32 or float16 normalised to 0-1 or uint8 for models that normalise within their graph
+    """
+    def __init__(self, pipelineName, name, frameShape, dtype=np.float32):
+        self.pipelineName = pipelineName
+        self.name = name
+        self.frameShape = tuple(frameShape)
+        self.dtype = dtype
+        self.consumers = {}
+        self.window = None
+        self.active = True
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.pipelineName}/{self.name}, consumers={list(self.consumers)})"
+
+    def subscribe(self, consumer):
+        with self.lock:
+            self.consumers[consumer.deploymentID] = consumer
+            frames = max(c.frames for c in self.consumers.values())
+            if self.window is None or self.window.frames < frames:
+                self.window = FrameWindow(frames, self.frameShape, self.dtype)
+
+    def unsubscribe(self, deploymentID):
+        with self.lock:
+            self.consumers.pop(deploymentID, None)
+            if not self.consumers:
+                self.active = False
+            return len(self.consumers)
+
+    def advance(self, window, count=1):
+        """Commit count written slots of window and return the consumers whose window is now ready
+           A consumer is ready once the ring holds its window and hop new frames have arrived since its last inference,
+           consumers running a split model are ready whenever there are new frames as they encode each frame as it arrives
+        """
+        ready = []
+        with self.lock:
+            if window is not self.window:
+                return ready
+            window.commit(count)
+            for consumer in self.consumers.values():
+                if consumer.split:
+                    if count:
+                        ready.append(consumer)
+                    continue
+                consumer.framesSinceInference += count
+                if window.filled >= consumer.frames and consumer.framesSinceInference >= consumer.hop:
+                    consumer.framesSinceInference = 0
+                    ready.append(consumer)
+        return ready
+
+class BranchStorage:
+    def __init__(self):
+        self.storage = {}
+
+    def __str__(self):
+        return str(self.storage)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.storage})"
+
+    def __iter__(self):
+        for branch in list(self.storage.values()):
+            yield branch
+
+    def add_branch(self, branch):
+        self.storage[(branch.pipelineName, branch.name)] = branch
+
+    def get_branch(self, pipelineName, name):
+        return self.storage.get((pipelineName, name))
+
+    def remove_branch(self, branch):
+        self.storage.pop((branch.pipelineName, branch.name), None)
+
+    def find_deployment(self, deploymentID):
+        for branch in self:
+            if deploymentID in branch.consumers:
+                return branch
+        return None
@@ -1,12 +1,14 @@
 import os
-import getpass
+import asyncio
 import uuid
-import requests
 import json
-import configparser
 import platform 
 from datetime import datetime
 
+import aiohttp
+
+from .context import NODE_CONTEXT
+
 def CheckUUID(key):
     """Function to check if key is a valid UUID
        1. Check if key is a valid UUID
@@ -17,69 +19,63 @@ def CheckUUID(key):
         bool: True if key is a valid UUID, False if not
     """
     try:
-        uuid = uuid.UUID(key, version=4)
+        uuid.UUID(key, version=4)
         return True
     except ValueError:
         return False
 
-def Reconnect(nodeConfig):
+async def Reconnect(nodeConfig):
     """Function to reconnect to master server
          1. Create body for request
          2. Send request to master server
     Args:
         nodeConfig ConfigParser: config data for the ndoe
     Returns:
-        response: response from master server if successful
+        json: response body from master server if successful
     """
     body = {
         "node_key_value":nodeConfig['CONNECTION']['key'],
         "node_id":nodeConfig['NODE_INFO']['node_id']
     }
-    jsonBody = json.dumps(body)
-    headers = {'Content-Type':'application/json'}
     try:
-        return requests.post(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/connect",data=jsonBody,headers=headers)
-    except:
+        return await NODE_CONTEXT.Post("/nodes/connect", body)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
         return
     
-def Connect(nodeConfig):
+async def Connect(nodeConfig):
     """Function to connect to master server
          1. Create body for request
          2. Send request to master server
     Args:
         nodeConfig ConfigParser: config data for the ndoe
     Returns:
-        response: response from master server if successful
+        json: response body from master server if successful
     """
     body = {
         "node_key_value":nodeConfig['CONNECTION']['key'],
         "node_name":platform.node(),
         "creation_date":datetime.now().isoformat()
     }
-    jsonBody = json.dumps(body)
-    headers = {'Content-Type':'application/json'}
     try:
-        return requests.post(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/connect",data=jsonBody,headers=headers)
-    except:
+        return await NODE_CONTEXT.Post("/nodes/connect", body)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
         return
 
 async def ConnectDevices(jsonBody):
     """Function to connect all devices to master server
-         1. Get node config
-         2. Send request to master server with camera jsonBody
+         1. Send request to master server with camera jsonBody
     Args:
         jsonBody JSON: camera data
     Returns:
         response: response from master server if successful
         string: error message if not successful
     """
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
-    headers = {'Content-Type':'application/json'}
-    response = requests.post(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/connect/devices",data=jsonBody,headers=headers)
-    if response and response.json()['status']:
-        return response.json()['status']
+    try:
+        response = await NODE_CONTEXT.Post("/nodes/connect/devices", json.loads(jsonBody))
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return "Error"
+    if response and response['status']:
+        return response['status']
     else:
         return "Error"
     
@@ -92,23 +88,20 @@ async def ConfigureConnection():
     Returns:
         string: remote if connected, isolated if not connected
     """
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
-    if os.path.isfile(absolutePath) and CheckUUID(nodeConfig['CONNECTION']['key']):
+    nodeConfig = NODE_CONTEXT.Config()
+    if os.path.isfile(NODE_CONTEXT.configPath) and CheckUUID(nodeConfig['CONNECTION']['key']):
         if nodeConfig['NODE_INFO']['node_id']:
-            connectionResponse = Reconnect(nodeConfig)
-            if connectionResponse and connectionResponse.json()['status'] == "Connected":
+            connectionResponse = await Reconnect(nodeConfig)
+            if connectionResponse and connectionResponse['status'] == "Connected":
                 return "remote"
             else:
                 return "isolated"
         else:
-            connectionResponse = Connect(nodeConfig)
-            if connectionResponse and connectionResponse.json()['status'] == "Connected":
-                nodeConfig['NODE_INFO']['node_id'] = connectionResponse.json()['node_id']
+            connectionResponse = await Connect(nodeConfig)
+            if connectionResponse and connectionResponse['status'] == "Connected":
+                nodeConfig['NODE_INFO']['node_id'] = connectionResponse['node_id']
                 nodeConfig['NODE_INFO']['node_name'] = platform.node()
-                with open(absolutePath, 'w') as oldConfig:
-                    nodeConfig.write(oldConfig)
+                NODE_CONTEXT.SaveConfig(nodeConfig)
                 return "remote"
             else:
                 return "isolated"
@@ -117,14 +110,11 @@ async def ConfigureConnection():
 
 async def SendResults(body):
     """Function to send inference result to master server
-         1. Get node config
-         2. Send request to master server with inference jsonBody
+         1. Send request to master server with inference jsonBody
     Args:
         jsonBody JSON: inference data
     """
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
-    jsonBody = json.dumps(body)
-    headers = {'Content-Type':'application/json'}
-    response = requests.post(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/results",data=jsonBody,headers=headers)
\ No newline at end of file
+    try:
+        await NODE_CONTEXT.Post("/nodes/results", body)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Failed to send results: {e}")
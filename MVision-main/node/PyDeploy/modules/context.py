@@ -0,0 +1,116 @@
+import os
+import getpass
+import asyncio
+import configparser
+
+import aiohttp
+
+class NodeContext:
+    """Class holding the node configuration and the connection to the master server, shared by every coroutine of the node
+       node.conf is read once and only read again once its modification time or size changes.
+       Master calls share one keep-alive aiohttp session with a timeout, and are retried with exponential backoff
+       when the master cannot be reached. GETs are also retried when the connection drops or times out, POSTs are not
+       as the master may already have acted on them (responses with an error status are never retried).
+    Args:
+        configPath string: path of node.conf
+        timeout float: seconds before a master call is abandoned
+        retries int: number of further attempts after a failed master call
+        backoff float: seconds before the first retry, doubled for each further retry
+        limit int: largest number of concurrent connections to the master
+    """
+    def __init__(self, configPath=None, timeout=10, retries=3, backoff=0.5, limit=16):
+        self.configPath = configPath or f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.limit = limit
+        self.config = None
+        self.configStamp = None
+        self.session = None
+
+    def ConfigStamp(self):
+        """Function to get the modification time and size of node.conf, None if it does not exist"""
+        try:
+            stat = os.stat(self.configPath)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def Config(self):
+        """Function to get the node configuration, reading node.conf again only if it has changed
+        Returns:
+            ConfigParser: config data for the node
+        """
+        stamp = self.ConfigStamp()
+        if self.config is None or stamp != self.configStamp:
+            config = configparser.ConfigParser()
+            config.read(self.configPath)
+            self.config = config
+            self.configStamp = stamp
+        return self.config
+
+    def SaveConfig(self, config):
+        """Function to write the node configuration to node.conf and keep it as the cached configuration
+        Args:
+            config ConfigParser: config data for the node
+        """
+        with open(self.configPath, 'w') as configFile:
+            config.write(configFile)
+        self.config = config
+        self.configStamp = self.ConfigStamp()
+
+    def MasterUrl(self):
+        """Function to get the address of the master server from the configuration"""
+        config = self.Config()
+        return f"http://{config['CONNECTION']['master_ip']}:{config['CONNECTION']['master_port']}"
+
+    async def Session(self):
+        """Function to get the session, creating it on first use (within the running event loop)"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.limit, keepalive_timeout=60),
+                                                 timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                 raise_for_status=True)
+        return self.session
+
+    async def Request(self, method, path, params=None, body=None):
+        """Function to call the master server
+        1. Send the request over the shared session
+        2. If the master cannot be reached (or a GET drops or times out) wait and retry, up to retries times
+        3. Return the JSON response body
+        Args:
+            method string: GET or POST
+            path string: path of the endpoint (i.e /nodes/connect)
+            params dict: query parameters
+            body dict: JSON body
+        Returns:
+            json: response body
+        """
+        session = await self.Session()
+        if method == "GET":
+            retryable = (aiohttp.ClientConnectionError, asyncio.TimeoutError)
+        else:
+            retryable = aiohttp.ClientConnectorError
+        for attempt in range(self.retries + 1):
+            try:
+                async with session.request(method, f"{self.MasterUrl()}{path}", params=params, json=body) as response:
+                    return await response.json(content_type=None)
+            except retryable:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def Get(self, path, params=None):
+        """Function to get a JSON resource of the master server (see Request)"""
+        return await self.Request("GET", path, params=params)
+
+    async def Post(self, path, body):
+        """Function to post a JSON body to the master server (see Request)"""
+        return await self.Request("POST", path, body=body)
+
+    async def Close(self):
+        """Function to close the session and its pooled connections"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+NODE_CONTEXT = NodeContext()
@@ -1,9 +1,11 @@
-import requests
-import json
+import asyncio
 import configparser
-import getpass
 import ast
 
+import aiohttp
+
+from .context import NODE_CONTEXT
+
 async def ExtractList(configString):
     """Function to extract list from a configParser string
     Args:
@@ -16,19 +18,17 @@ async def ExtractList(configString):
     except ValueError:
         return []
 
-async def GetDeviceID(camera, nodeConfig):
+async def GetDeviceID(camera):
     """Function to get device ID from master server given camera name
     Args:
         camera string: camera name
-        nodeConfig ConfigParser: config data for the ndoe
     Returns:
-        response: response from master server if successful
+        json: response body from master server if successful
     """
     params = {"deviceName":camera}
-    headers = {'Content-Type':'application/json'}
     try:
-        return requests.get(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/device/name",params=params,headers=headers)
-    except:
+        return await NODE_CONTEXT.Get("/nodes/device/name", params)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
         return
     
 async def GetDeploymentModels(cameraID, nodeConfig):
@@ -37,26 +37,22 @@ async def GetDeploymentModels(cameraID, nodeConfig):
         cameraID string: camera ID
         nodeConfig ConfigParser: config data for the ndoe
     Returns:
-        response: response from master server if successful
+        json: response body from master server if successful
     """
     params = {"node_id":nodeConfig['NODE_INFO']['node_id'], "device_id":cameraID}
-    headers = {'Content-Type':'application/json'}
     try:
-        return requests.get(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/nodes/deployments/active",params=params,headers=headers)
-    except:
+        return await NODE_CONTEXT.Get("/nodes/deployments/active", params)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
         return
 
-async def GetModel(modelID, nodeConfig):
+async def GetModel(modelID):
     """Function to get model data from master server given modelID
     Args:
         modelID string: model ID
-        nodeConfig ConfigParser: config data for the ndoe
     Returns:
-        response: response from master server if successful
+        json: model data
     """
-    headers = {'Content-Type':'application/json'}
-    response = requests.get(f"http://{nodeConfig['CONNECTION']['master_ip']}:{nodeConfig['CONNECTION']['master_port']}/models/id/{modelID}",headers=headers)
-    body = response.json()
+    body = await NODE_CONTEXT.Get(f"/models/id/{modelID}")
     print(body)
     return body[0]['get_model'][0]
 
@@ -65,16 +61,15 @@ async def RetrieveActiveDeployments(camera):
     Args:
         camera string: camera name
     Returns:
-        response: response from master server if successful
+        array: deployments for the camera, None if the master could not be reached
     """
-    absolutePath = f'/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/node.conf'
-    nodeConfig = configparser.ConfigParser()
-    nodeConfig.read(absolutePath)
-    response = await GetDeviceID(camera, nodeConfig)
-    body = response.json()
+    body = await GetDeviceID(camera)
+    if not body:
+        return
     cameraID = body[0]['get_device_from_name']['device_id']
-    response = await GetDeploymentModels(cameraID, nodeConfig)
-    body = response.json()
+    body = await GetDeploymentModels(cameraID, NODE_CONTEXT.Config())
+    if not body:
+        return
     return body[0]['get_nodes_deployment_models']['deployments']
 
 async def GatherModelInformation(locationName):
@@ -87,6 +82,9 @@ async def GatherModelInformation(locationName):
         classList array: list of classes for model
         inputName string: name of model input
         outputName string: name of model output
+        pixelFormat string: pixel format of model input (RGB unless set in the config)
+        frameStep int: number of camera frames between each frame the model expects (5 unless set, as PyTrain has always trained with a step of 5)
+        inputDtype string: float32 or float16 for models taking frames normalised to 0-1 (float32 for older models), uint8 for models taking raw frames
     """
     absolutePath = f'/mnt/model_repo/{locationName}/1/model.savedmodel/assets/{locationName}.config'
     modelConfig = configparser.ConfigParser()
@@ -96,4 +94,39 @@ async def GatherModelInformation(locationName):
     classList = modelConfig['PREDICTION']['class_list']
     inputName = modelConfig['PREDICTION']['input_name']
     outputName = modelConfig['PREDICTION']['output_name']
-    return height, width, classList, inputName, outputName
+    pixelFormat = modelConfig['PREDICTION'].get('pixel_format', 'RGB')
+    frameStep = modelConfig['PREDICTION'].getint('frame_step', 5)
+    inputDtype = modelConfig['PREDICTION'].get('input_dtype', 'float32')
+    return height, width, classList, inputName, outputName, pixelFormat, frameStep, inputDtype
+
+async def GetFrameHop(deploymentID, frameCounts, nodeConfig):
+    """Function to get the number of new frames between inferences for a deployment
+       Windows overlap when the hop is less than the window, reusing frames already in the ring
+       1. Use frame_hop from the deployments own section [DEPLOYMENT_<id>] if present
+       2. Else use frame_hop from the [INFERENCE] section
+       3. Else use the window length (no overlap)
+    Args:
+        deploymentID int: deployment ID
+        frameCounts int: number of frames in the deployments window
+        nodeConfig ConfigParser: config data for the node
+    Returns:
+        int: hop between 1 and frameCounts
+    """
+    hop = nodeConfig.getint(f'DEPLOYMENT_{deploymentID}', 'frame_hop', fallback=nodeConfig.getint('INFERENCE', 'frame_hop', fallback=frameCounts))
+    return min(max(hop, 1), frameCounts)
+
+async def GatherSplitInformation(locationName):
+    """Function to get the split encoder and temporal head exported alongside a model, if PyTrain exported them
+    Args:
+        locationName string: name of model
+    Returns:
+        dict: encoder_model, encoder_input_name, encoder_output_name, head_model, head_input_name, head_output_name and embedding_size, None if the model was not split
+    """
+    absolutePath = f'/mnt/model_repo/{locationName}/1/model.savedmodel/assets/{locationName}.config'
+    modelConfig = configparser.ConfigParser()
+    modelConfig.read(absolutePath)
+    if not modelConfig.has_section('SPLIT'):
+        return None
+    splitInformation = dict(modelConfig['SPLIT'])
+    splitInformation['embedding_size'] = modelConfig['SPLIT'].getint('embedding_size')
+    return splitInformation
@@ -0,0 +1,79 @@
+import numpy as np
+
+from .classes import FrameWindow, InflightPipeline
+from .transport import CreateTransport
+
+class SplitModelPipeline:
+    """Runs a deployment on the frame encoder and temporal head PyTrain exported alongside its model
+       Each new frame is encoded once and its embedding kept in a ring, the deployments windows are then windows of embeddings
+       sent to the head. With overlapping windows (frame_hop less than the frame count) a frame is no longer encoded once per window it falls in.
+       If frames cannot be encoded (no free slot) the ring is restarted, so a window never spans missing frames.
+       Encoder and head requests are each sent and collected on a worker thread of their InflightPipeline.
+    Args:
+        consumer DeploymentConsumer: deployment the pipeline runs for
+        splitInformation dict: encoder and head model, input and output names and embedding_size from GatherSplitInformation
+        clientFactory function: creates a client for the server, one for each worker thread
+        frameBytes int: size of one preprocessed frame
+        encoderSlots threading.BoundedSemaphore: in flight slots shared by every deployment of the encoder
+        headSlots threading.BoundedSemaphore: in flight slots shared by every deployment of the head
+        inflightDepth int: number of encoder (and head) requests the deployment can have on the server at once
+        sharedMemory bool: whether to send tensors through shared memory
+        onError function: called with the exception of a failed request
+    """
+    def __init__(self, consumer, splitInformation, clientFactory, frameBytes, encoderSlots, headSlots, inflightDepth=1, sharedMemory=False, onError=print):
+        self.consumer = consumer
+        self.encoderModel = splitInformation['encoder_model']
+        self.encoderInput = splitInformation['encoder_input_name']
+        self.encoderOutput = splitInformation['encoder_output_name']
+        self.headModel = splitInformation['head_model']
+        self.headInput = splitInformation['head_input_name']
+        self.headOutput = splitInformation['head_output_name']
+        embeddingSize = int(splitInformation['embedding_size'])
+        self.embeddings = FrameWindow(consumer.frames, (embeddingSize,), np.float32)
+        self.framesSinceInference = 0
+        self.gap = False
+        self.encoded = 0
+        name = f"deployment_{consumer.deploymentID}"
+        self.encoderTransport = CreateTransport(clientFactory, f"{name}_encoder", self.encoderModel, self.encoderOutput, frameBytes * consumer.frames,
+                                                embeddingSize * consumer.frames, inflightDepth, sharedMemory)
+        self.headTransport = CreateTransport(clientFactory, f"{name}_head", self.headModel, self.headOutput, self.embeddings.storage.dtype.itemsize * embeddingSize * consumer.frames,
+                                             len(consumer.classList), inflightDepth, sharedMemory)
+        self.head = InflightPipeline(inflightDepth, headSlots, consumer.deliver, onError, self.headTransport.close, clientFactory)
+        self.encoder = InflightPipeline(inflightDepth, encoderSlots, self.append, onError, self.finish, clientFactory)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.encoderModel}, {self.headModel}, encoded={self.encoded}, skipped={self.encoder.skipped})"
+
+    def encode(self, frames):
+        """Submit a copy of the (count, height, width, 3) newest frames of the branch to the encoder without waiting, returns whether they were submitted
+           The result is the embeddings along with whether frames were skipped before them
+        """
+        gap = self.gap
+        batch = np.array(frames, copy=True)
+        request = lambda tritonClient: (self.encoderTransport.send(tritonClient, self.encoderModel, self.encoderInput, self.encoderOutput, batch), gap)
+        self.gap = not self.encoder.submit(request)
+        return not self.gap
+
+    def append(self, result):
+        """Add encoded frames to the embedding ring, in submission order on an encoder worker thread, and send a copy of the window to the head once hop frames have arrived"""
+        embeddings, gap = result
+        if gap:
+            self.embeddings.clear()
+            self.framesSinceInference = 0
+        for embedding in embeddings:
+            self.embeddings.append(embedding)
+        self.encoded += len(embeddings)
+        self.framesSinceInference += len(embeddings)
+        if self.embeddings.filled >= self.consumer.frames and self.framesSinceInference >= self.consumer.hop:
+            self.framesSinceInference = 0
+            window = np.array(self.embeddings.window(), copy=True)
+            self.head.submit(lambda tritonClient: self.headTransport.send(tritonClient, self.headModel, self.headInput, self.headOutput, window))
+
+    def finish(self):
+        """Called once the encoder has delivered its last result, so the head is only closed after its final window"""
+        self.encoderTransport.close()
+        self.head.close()
+
+    def close(self):
+        """Stop once the requests already on the server have been delivered"""
+        self.encoder.close()
@@ -61,26 +61,35 @@ def GetPipelineState(pipeline):
     stateChange, currentState, pendingState = pipeline.get_state(Gst.CLOCK_TIME_NONE)
     return currentState
 
-def AddSink(pipeline, deploymentName, tee, gloopState):
+def AddSink(pipeline, deploymentName, tee, gloopState, width=None, height=None, pixelFormat=None, frameStep=1):
     """Function to get add appsink to a current pipeline. 
        If gloopState is True then it returns False as to not repeat the loop.
        If gloopState is False then pipeline is initialising so the pipeline itself is returned
-       1. Create queue and set its properties
-       2. Create videoconvert
-       3. Create videoscale 
-       4. Create appsink and set its properties
-       5. Add all elements to the pipeline
-       6. Link all elements in chain
-       7. Get a new tee src pad
-       8. Get the queues sink pad
-       9. Link the tees src pad to the queues sink pad
-       10.Set all elements to autosync with the pipelines current STATE
-       11.Return False or pipeline dependant on gloopState
+       When a width and height are supplied the branch negotiates them (and the pixelFormat) with the appsink, 
+       scaling happens before conversion so only model sized frames are converted and mapped into Python
+       When a frameStep is supplied only every frameStep'th frame enters the branch, skipped frames are dropped 
+       at the queue before they are scaled, converted or mapped into Python
+       1. Create queue and set its properties, adding a buffer drop probe to its sink pad if frameStep > 1
+       2. Create videoscale
+       3. Create scale capsfilter with the model width and height
+       4. Create videoconvert
+       5. Create appsink and set its properties and caps (model width, height and pixelFormat)
+       6. Add all elements to the pipeline
+       7. Link all elements in chain
+       8. Get a new tee src pad
+       9. Get the queues sink pad
+       10.Link the tees src pad to the queues sink pad
+       11.Set all elements to autosync with the pipelines current STATE
+       12.Return False or pipeline dependant on gloopState
        Args:
         pipeline GSTpipeline: pipeline to add sink to
         deploymentName string: name to label the elements as
         tee GSTtee: tee object existing on the given pipeline
         gloopState bool: indicates whether this action is performing in the GLOOP or not
+        width int: width of model input (None leaves the frame size unchanged)
+        height int: height of model input (None leaves the frame size unchanged)
+        pixelFormat string: pixel format the appsink should receive i.e RGB (None leaves the format unchanged)
+        frameStep int: number of camera frames between each frame passed down the branch
        Returns:
         bool: whether GLOOP should repeat or not (false so it shouldnt)
         pipeline: pipeline object for initialisation
@@ -89,32 +98,40 @@ def AddSink(pipeline, deploymentName, tee, gloopState):
     queue.set_property("leaky", 2)
     queue.set_property("max-size-buffers", 5)
     queue.set_property("max-size-time", 16000000)
+    if frameStep and frameStep > 1:
+        queue.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, DecimateBuffers, {"step": frameStep, "count": 0})
 
-    videoconvert = Gst.ElementFactory.make("videoconvert", f"videoconvert_{deploymentName}")
     videoscale = Gst.ElementFactory.make("videoscale", f"videoscale_{deploymentName}")
+    scaleCapsFilter = Gst.ElementFactory.make("capsfilter", f"scalecaps_{deploymentName}")
+    scaleCapsFilter.set_property("caps", Gst.Caps.from_string(GenerateSinkCaps(width, height, None)))
+    videoconvert = Gst.ElementFactory.make("videoconvert", f"videoconvert_{deploymentName}")
     
     sink = Gst.ElementFactory.make("appsink", f"sink_{deploymentName}")
     sink.set_property("emit-signals", True)  
     sink.set_property("sync", False)
     sink.set_property("max-buffers", 5)  
     sink.set_property("drop", True) 
+    sink.set_property("caps", Gst.Caps.from_string(GenerateSinkCaps(width, height, pixelFormat)))
 
 
-    if not all([queue, videoconvert, videoscale, sink]):
+    if not all([queue, videoscale, scaleCapsFilter, videoconvert, sink]):
         print("Failed to create elements for new sink")
         return
 
     pipeline.add(queue)
-    pipeline.add(videoconvert)
     pipeline.add(videoscale)
+    pipeline.add(scaleCapsFilter)
+    pipeline.add(videoconvert)
     pipeline.add(sink)
 
-    if not queue.link(videoconvert):
-        print("Failed to link queue to videoconvert")
-    if not videoconvert.link(videoscale):
-        print("Failed to link videoconvert to videoscale")
-    if not videoscale.link(sink):
-        print("Failed to link videoscale to sink")
+    if not queue.link(videoscale):
+        print("Failed to link queue to videoscale")
+    if not videoscale.link(scaleCapsFilter):
+        print("Failed to link videoscale to scalecaps")
+    if not scaleCapsFilter.link(videoconvert):
+        print("Failed to link scalecaps to videoconvert")
+    if not videoconvert.link(sink):
+        print("Failed to link videoconvert to sink")
 
     padTemplate = tee.get_pad_template("src_%u")
     srcPad = tee.request_pad(padTemplate, None, None)
@@ -124,10 +141,12 @@ def AddSink(pipeline, deploymentName, tee, gloopState):
     
     ret = queue.sync_state_with_parent()
     print(f"Syncing queue state with parent returned: {ret}")
-    ret = videoconvert.sync_state_with_parent()
-    print(f"Syncing videoconvert state with parent returned: {ret}")
     ret = videoscale.sync_state_with_parent()
     print(f"Syncing videoscale state with parent returned: {ret}")
+    ret = scaleCapsFilter.sync_state_with_parent()
+    print(f"Syncing scalecaps state with parent returned: {ret}")
+    ret = videoconvert.sync_state_with_parent()
+    print(f"Syncing videoconvert state with parent returned: {ret}")
     ret = sink.sync_state_with_parent()
     print(f"Syncing sink state with parent returned: {ret}")
     if gloopState:
@@ -135,6 +154,37 @@ def AddSink(pipeline, deploymentName, tee, gloopState):
     else:
         return pipeline
 
+def DecimateBuffers(pad, info, decimation):
+    """Pad probe to only let every step'th buffer through, matching the frame step a model was trained with
+    Args:
+        pad Gst.Pad: pad the probe is attached to
+        info Gst.PadProbeInfo: probe info for the buffer
+        decimation dict: step between buffers passed and count of buffers seen
+    Returns:
+        Gst.PadProbeReturn: OK to pass the buffer on, DROP to discard it
+    """
+    count = decimation["count"]
+    decimation["count"] = (count + 1) % decimation["step"]
+    if count == 0:
+        return Gst.PadProbeReturn.OK
+    return Gst.PadProbeReturn.DROP
+
+def GenerateSinkCaps(width, height, pixelFormat):
+    """Function to generate the caps string for a deployment branch
+    Args:
+        width int: width of model input or None
+        height int: height of model input or None
+        pixelFormat string: pixel format or None
+    Returns:
+        string: caps string i.e video/x-raw, format=(string)RGB, width=(int)224, height=(int)224
+    """
+    caps = "video/x-raw"
+    if pixelFormat:
+        caps += f", format=(string){pixelFormat}"
+    if width and height:
+        caps += f", width=(int){width}, height=(int){height}"
+    return caps
+
 def GetCameraPath(camera):
     """Function to retrieve the system path of a camera based on its display name
     1. Create a device monitor
@@ -178,19 +228,18 @@ def RemoveSink(pipeline, deploymentName, tee):
         bool: False to indicate to stop loop (external)
 """
     queue = pipeline.get_by_name(f"queue_{deploymentName}")
-    videoconvert = pipeline.get_by_name(f"videoconvert_{deploymentName}")
     videoscale = pipeline.get_by_name(f"videoscale_{deploymentName}")
+    scaleCapsFilter = pipeline.get_by_name(f"scalecaps_{deploymentName}")
+    videoconvert = pipeline.get_by_name(f"videoconvert_{deploymentName}")
     sink = pipeline.get_by_name(f"sink_{deploymentName}")
-    for element in (sink, videoscale, videoconvert, queue):
+    chain = (sink, videoconvert, scaleCapsFilter, videoscale, queue)
+    for element in chain:
         if element:
             print(element)
             element.set_state(Gst.State.NULL)
-    if sink and videoscale:
-        videoscale.unlink(sink)
-    if videoconvert and videoscale:
-        videoconvert.unlink(videoscale)
-    if queue and videoconvert:
-        queue.unlink(videoconvert)
+    for downstream, upstream in zip(chain, chain[1:]):
+        if downstream and upstream:
+            upstream.unlink(downstream)
     if tee and queue:
         sinkPad = queue.get_static_pad("sink")
         teeSrcPad = sinkPad.get_peer()
@@ -198,19 +247,23 @@ def RemoveSink(pipeline, deploymentName, tee):
             tee.release_request_pad(teeSrcPad)
             teeSrcPad.unlink(sinkPad)
 
-    for element in (sink, videoscale, videoconvert, queue):
+    for element in chain:
         if element:
             pipeline.remove(element)
     return False
 
-async def AddNewSink(pipeline, deploymentName, tee):
+async def AddNewSink(pipeline, deploymentName, tee, width=None, height=None, pixelFormat=None, frameStep=1):
     """Function to invoke AddSink within the GLoop
     Args:
        pipeline GSTpipeline: pipeline to add sink to
        deploymentName string: name to label the elements as
        tee GSTtee: tee object existing on the given pipeline
+       width int: width of model input to negotiate
+       height int: height of model input to negotiate
+       pixelFormat string: pixel format to negotiate i.e RGB
+       frameStep int: number of camera frames between each frame passed down the branch
     """
-    GLib.timeout_add_seconds(1, AddSink, pipeline, deploymentName, tee, True)
+    GLib.timeout_add_seconds(1, AddSink, pipeline, deploymentName, tee, True, width, height, pixelFormat, frameStep)
 
 async def RemoveExistingSink(pipeline, deploymentName, tee):
     """Function to invoke RemoveSink within the GLoop
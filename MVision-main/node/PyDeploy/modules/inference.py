@@ -1,11 +1,11 @@
-import cv2
 import numpy as np
 import tritonclient.http as httpclient
 from tritonclient.utils import InferenceServerException
-from collections import deque
 from PIL import Image
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
 import getpass
 import asyncio
 
@@ -15,41 +15,48 @@ from gi.repository import Gst, GLib
 Gst.init(None)
 
 from .gstreamer import GetPipelineState
+from .classes import BranchStorage, DeploymentConsumer, InflightPipeline, SharedBranch
+from .batching import GetBatcher, ReleaseBatcher
+from .embeddings import SplitModelPipeline
+from .transport import CreateTransport
+from .preprocessing import GetPreprocessPlan, PreprocessInto
 from .monitoring import CompilePerformanceEntry, CompileInferenceResult, DumpInference
 
-def PreProcessFrameRGBA(frame, WIDTH, HEIGHT):
+branches = BranchStorage()
+modelSlots = {}
+
+def PreProcessFrameRGBA(frame, WIDTH, HEIGHT, out=None):
     """Function to preprocess RGBA frame to correct size, format and type
-    1. Resize frame to correct size
-    2. Convert frame to RGB
-    3. Normalise frame
+    1. Retrieve the cached preprocessing plan for the frame geometry
+    2. Resize, drop alpha and normalise in a single pass into out
     Args:
         frame: frame to preprocess
         WIDTH int: width of model input
         HEIGHT int: height of model input
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
-    frameResized = cv2.resize(frame, (WIDTH, HEIGHT))
-    frameRGB = cv2.cvtColor(frameResized, cv2.COLOR_RGBA2RGB)
-    return frameRGB.astype('float32') / 255.0  
+    plan = GetPreprocessPlan(frame.shape[0], frame.shape[1], "RGBA", HEIGHT, WIDTH)
+    return PreprocessInto(plan, frame, out)
 
-def PreProcessFrameRGB(frame, WIDTH, HEIGHT):
+def PreProcessFrameRGB(frame, WIDTH, HEIGHT, out=None):
     """Function to preprocess RGB frame to correct size, format and type
-    1. Resize frame to correct size
-    2. Normalise frame
+    1. Retrieve the cached preprocessing plan for the frame geometry
+    2. Resize and normalise in a single pass into out
     Args:
         frame: frame to preprocess
         WIDTH int: width of model input
         HEIGHT int: height of model input
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
-    frameResized = cv2.resize(frame, (WIDTH, HEIGHT))
-    frameRGB = cv2.cvtColor(frameResized, cv2.COLOR_BGR2RGB)
-    return frameRGB.astype('float32') / 255.0  
+    plan = GetPreprocessPlan(frame.shape[0], frame.shape[1], "RGB", HEIGHT, WIDTH)
+    return PreprocessInto(plan, frame, out)
 
-def LoadDataRGB(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT):
-    """Function to load RGB frame from RGBA mapped data and optionally save to file
+def LoadDataRGB(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT, out=None):
+    """Function to load RGB frame from RGB mapped data and optionally save to file
     1. Load frame from mapped data
     2. Optionally save frame to file
     3. Return preprocessed frame
@@ -61,17 +68,18 @@ def LoadDataRGB(mappedData, inputHeight, inputWidth, width, height, deploymentID
         height int: height of model input
         deploymentID int: deployment ID
         OUTPUT bool: flag to save frame to file
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
     bufferedData = np.frombuffer(mappedData, dtype=np.uint8)
     if OUTPUT:
         img = Image.frombytes("RGB", (inputWidth, inputHeight), bufferedData)
         img.save(f"deployment_{deploymentID}.png")
-    frame = bufferedData.reshape((inputHeight, inputWidth, 3))
-    return PreProcessFrameRGB(frame, width, height)  
+    frame = MapFrame(bufferedData, inputHeight, inputWidth, 3)
+    return PreProcessFrameRGB(frame, width, height, out)
 
-def LoadDataRGBA(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT):
+def LoadDataRGBA(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT, out=None):
     """Function to load RGB frame from RGBA mapped data and optionally save to file
     1. Load frame from mapped data
     2. Optionally save frame to file
@@ -84,25 +92,52 @@ def LoadDataRGBA(mappedData, inputHeight, inputWidth, width, height, deploymentI
         height int: height of model input
         deploymentID int: deployment ID
         OUTPUT bool: flag to save frame to file
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
     bufferedData = np.frombuffer(mappedData, dtype=np.uint8)
     if OUTPUT:
         img = Image.frombytes("RGBA", (inputWidth, inputHeight), bufferedData)
         imgRGB = img.convert("RGB")
         imgRGB.save(f"deployment_{deploymentID}.jpg")
-    frame = bufferedData.reshape((inputHeight, inputWidth, 4))
-    return PreProcessFrameRGBA(frame, width, height)  
+    frame = MapFrame(bufferedData, inputHeight, inputWidth, 4)
+    return PreProcessFrameRGBA(frame, width, height, out)
+
+def GetBranchName(width, height, pixelFormat, frameStep=1, inputDtype="float32"):
+    """Function to get the name of the shared branch for a given model input geometry, frame step and input data type
+       Deployments on the same camera with the same geometry, frame step and data type share one branch, one frame ring and one preprocessing pass
+    Args:
+        width int: width of model input
+        height int: height of model input
+        pixelFormat string: pixel format of model input
+        frameStep int: number of camera frames between each frame passed to the branch
+        inputDtype string: data type of the model input, float32, float16 or uint8
+    Returns:
+        string: branch name i.e branch_224x224_RGB or branch_224x224_RGB_step5_uint8
+    """
+    branchName = f"branch_{width}x{height}_{pixelFormat}"
+    if frameStep > 1:
+        branchName += f"_step{frameStep}"
+    if inputDtype != "float32":
+        branchName += f"_{inputDtype}"
+    return branchName
 
-async def FinaliseInference(pipeline, deploymentID, height, width, classList, frameCounts, modelName, deploymentCount, jetson, csvLog, loop, inputName, outputName):
+async def FinaliseInference(pipeline, deploymentID, height, width, classList, frameCounts, modelName, deploymentCount, jetson, csvLog, loop, inputName, outputName, inferenceMode="signal", branchName=None, frameHop=None, inflightDepth=1, modelInflightDepth=4, batching=None, sharedMemory=False, inputDtype="float32", splitInformation=None):
     """Function to finalise inference tasks for deployment
-    1. Initialise Triton client
-    2. Retrieve appsink from pipeline
-    3. Create frames queue
+    1. Create the Triton client factory, each thread sending requests for the deployment makes a client of its own
+    2. Retrieve the shared branches appsink from pipeline
+    3. Subscribe the deployment to the branches shared frame ring (created on first use), 
+       if split models are given each new frame is encoded once and windows of embeddings are sent to the temporal head,
+       else its windows are batched with those of every other deployment of the model when batching is set,
+       otherwise they are submitted through a bounded InflightPipeline of its own, whose worker threads send and collect each request
     4. Check pipeline state
     5. Start monitoring task
-    6. Start inference task (parallel or linear can be chosen parallel allows realtime fast processing, linear allows for sequential processing which is equivalent to 1 second per frame)
+    6. If the branch is new start consuming it, chosen by inferenceMode:
+       signal: frames are consumed as they arrive via the appsink "new-sample" signal on the branches own streaming thread,
+               throughput is then limited by the camera and the model rather than a timer (default)
+       parallel: a window of frames is gathered and processed in parallel once per second within the GLOOP
+       linear: a single frame is processed once per second within the GLOOP
     Args:
         pipeline Gst.Pipeline: pipeline for deployment
         deploymentID int: deployment ID
@@ -117,135 +152,300 @@ async def FinaliseInference(pipeline, deploymentID, height, width, classList, fr
         loop asyncio: event loop
         inputName string: name of model input
         outputName string: name of model output
+        inferenceMode string: signal, parallel or linear
+        branchName string: name of the branch feeding the deployment (defaults to a branch of its own)
+        frameHop int: new frames between inferences, windows slide over the ring rather than being cleared (defaults to frameCounts)
+        inflightDepth int: number of windows the deployment can have on the server at once
+        modelInflightDepth int: number of windows (or batches) all deployments of the model can have on the server at once
+        batching dict: maxBatchSize, maxDelay and maxQueue for the models node wide batcher, None to send windows individually
+        sharedMemory bool: whether to send windows through shared memory registered with the local Triton server rather than HTTP bodies
+        inputDtype string: float32 or float16 to send normalised frames, uint8 to send raw frames to models that normalise within their graph
+        splitInformation dict: encoder and head exported alongside the model from GatherSplitInformation, None to infer on the full model
     Returns:
         int: deployment count
     """
+    branchName = branchName or f"deployment_{deploymentID}"
     tritonURL = 'localhost:8000'
-    tritonClient = httpclient.InferenceServerClient(url=tritonURL)
+    clientFactory = partial(httpclient.InferenceServerClient, url=tritonURL)
     if not isinstance(pipeline, Gst.Pipeline):
         print("The provided argument is not a Gst.Pipeline instance.")
         return
 
-    appsink = pipeline.get_by_name(f"sink_deployment_{deploymentID}")
+    appsink = pipeline.get_by_name(f"sink_{branchName}")
     if not appsink:
         print("Appsink not found.")
         return
 
-    framesQueue = deque(maxlen=frameCounts)
     if GetPipelineState(pipeline) != Gst.State.PLAYING:
         print("Pipeline in incorrect state restart the node")
         return
     inferenceData = []
+    consumer = DeploymentConsumer(deploymentID, frameCounts, modelName, classList, inputName, outputName, clientFactory, inferenceData, frameHop)
+    consumer.deliver = partial(DeliverResult, consumer=consumer, jetson=jetson, csvLog=csvLog, loop=loop)
+    if splitInformation:
+        frameBytes = np.dtype(inputDtype).itemsize * int(height) * int(width) * 3
+        consumer.split = SplitModelPipeline(consumer, splitInformation, clientFactory, frameBytes, GetModelSlots(splitInformation['encoder_model'], modelInflightDepth), 
+                                            GetModelSlots(splitInformation['head_model'], modelInflightDepth), inflightDepth, sharedMemory, HandleError)
+    elif batching:
+        consumer.batcher = GetBatcher(deploymentID, modelName, inputName, outputName, inflightDepth=modelInflightDepth, classCount=len(classList), sharedMemory=sharedMemory, **batching)
+    else:
+        windowBytes = np.dtype(inputDtype).itemsize * int(frameCounts) * int(height) * int(width) * 3
+        consumer.transport = CreateTransport(clientFactory, f"deployment_{deploymentID}", modelName, outputName, windowBytes, len(classList), inflightDepth, sharedMemory)
+        consumer.inflight = InflightPipeline(inflightDepth, GetModelSlots(modelName, modelInflightDepth), consumer.deliver, HandleError, consumer.transport.close, clientFactory)
+    branch = branches.get_branch(pipeline.get_name(), branchName)
+    newBranch = branch is None
+    if newBranch:
+        branch = SharedBranch(pipeline.get_name(), branchName, (int(height), int(width), 3), np.dtype(inputDtype))
+        branches.add_branch(branch)
+    branch.subscribe(consumer)
     print("Pipeline and sink were correctly retrieved")
-    print(f"Inference for deployment_{deploymentID} with model {modelName} is occuring")
+    print(f"Inference for deployment_{deploymentID} with model {modelName} is occuring on {branchName} every {consumer.hop} frames")
+    if consumer.split:
+        print(f"Frames are encoded once by {consumer.split.encoderModel} and windows inferred by {consumer.split.headModel}")
     filePath = f"/home/{getpass.getuser()}/Desktop/MVision/node/PyDeploy/results/Results_deployment_{deploymentID}_{datetime.now().strftime('%Y_%m_%d')}.csv"
     monitoringTask = loop.create_task(DumpInference(inferenceData, filePath, deploymentID, loop, frameCounts))
-    ###Uncomment for parallel processing
-    GLib.timeout_add_seconds(1, PullFrameParallel, pipeline, appsink, deploymentID, framesQueue, int(width), int(height), frameCounts, tritonClient, modelName, classList, jetson, csvLog, loop, inferenceData, inputName, outputName)
-    ###Uncomment for linear processing
-    #GLib.timeout_add_seconds(1, PullFrameLinear, pipeline, appsink, deploymentID, framesQueue, int(width), int(height), frameCounts, tritonClient, modelName, classList, jetson, csvLog, loop, inferenceData, inputName, outputName)
+    if newBranch:
+        if inferenceMode == "signal":
+            appsink.connect("new-sample", OnNewSample, branch, jetson, csvLog, loop)
+        elif inferenceMode == "parallel":
+            GLib.timeout_add_seconds(1, PullFrameParallel, pipeline, appsink, branch, jetson, csvLog, loop)
+        else:
+            GLib.timeout_add_seconds(1, PullFrameLinear, pipeline, appsink, branch, jetson, csvLog, loop)
     deploymentCount = deploymentCount+1
     return deploymentCount
 
-def PullFrameLinear(pipeline, appsink, deploymentID, framesQueue, width, height, frameCounts, tritonClient, modelName, classList, jetson, csvLog, loop, inferenceData, inputName, outputName):
+def GetModelSlots(modelName, depth):
+    """Function to get the in flight slots shared by every deployment of a model, created by its first deployment
+    Args:
+        modelName string: name of model
+        depth int: number of requests the model can have on the server at once
+    Returns:
+        threading.BoundedSemaphore: slots for the model
+    """
+    if modelName not in modelSlots:
+        modelSlots[modelName] = threading.BoundedSemaphore(depth)
+    return modelSlots[modelName]
+
+def StopDeployment(pipeline, deploymentID):
+    """Function to unsubscribe a deployment from its shared branch
+    1. Find the branch the deployment is subscribed to
+    2. Unsubscribe the deployment from the branch first, so no new windows are dispatched to it
+    3. Close its pipeline (or split model pipeline), its in flight requests are still delivered before it stops and any window dispatched meanwhile is refused,
+       a batched deployment is unsubscribed from its models batcher, which is closed once no deployments use it
+    4. If no deployments remain the branch is deactivated and its name returned so its elements can be removed
+    Args:
+        pipeline Gst.Pipeline: pipeline for deployment
+        deploymentID int: deployment ID
+    Returns:
+        string: name of the branch to remove, None if other deployments still use it
+    """
+    branch = branches.find_deployment(deploymentID)
+    if not branch:
+        return None
+    consumer = branch.consumers.get(deploymentID)
+    remaining = branch.unsubscribe(deploymentID)
+    if consumer and consumer.inflight:
+        consumer.inflight.close()
+    if consumer and consumer.split:
+        consumer.split.close()
+    if consumer and consumer.batcher:
+        ReleaseBatcher(consumer.modelName, deploymentID)
+    if remaining == 0:
+        branches.remove_branch(branch)
+        return branch.name
+    return None
+
+def IsDeploymentActive(deploymentID):
+    """Function to check if a deployment is subscribed to a branch
+    Args:
+        deploymentID int: deployment ID
+    Returns:
+        bool: True if active
+    """
+    return branches.find_deployment(deploymentID) is not None
+
+def ScheduleTask(loop, coroutine):
+    """Function to schedule a coroutine on the asyncio loop from the GLOOP or a GStreamer streaming thread
+       loop.create_task is not thread safe, so the coroutine is handed over to the loop thread instead
+    Args:
+        loop asyncio: event loop
+        coroutine coroutine: coroutine to schedule
+    Returns:
+        Future: concurrent future for the scheduled coroutine
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+def InferWindow(inputBatch, consumer, jetson, csvLog, loop):
+    """Function to submit a window of frames for a deployment without waiting on the server
+    1. If the model is batched hand a copy of the window to the models node wide batcher and return
+    2. Else copy the (1, frames, height, width, 3) view of the shared frame ring, so the ring slots are free to be overwritten straight away
+    3. If the deployment and model have a free in flight slot queue the copy for a worker thread of the deployments InflightPipeline,
+       which sends it through the deployments transport (a shared memory slot or the HTTP body) and waits on the result
+    4. The result is logged by DeliverResult once it is delivered, in submission order
+    Args:
+        inputBatch array: window view of preprocessed frames
+        consumer DeploymentConsumer: deployment the window is for
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+    Returns:
+        bool: True if the window was submitted, False if it was skipped
+    """
+    if consumer.batcher:
+        consumer.batcher.submit(inputBatch, consumer.deliver)
+        return True
+    batch = np.array(inputBatch, copy=True)
+    request = lambda tritonClient: consumer.transport.send(tritonClient, consumer.modelName, consumer.inputName, consumer.outputName, batch)
+    submitted = consumer.inflight.submit(request)
+    if not submitted:
+        ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'Window skipped, inference in flight for deployment: deployment_{consumer.deploymentID}'))
+    return submitted
+
+def DeliverResult(outputData, consumer, jetson, csvLog, loop):
+    """Function to log the result of a deployments inference, called in submission order whether it was sent on its own or within a batch
+    Args:
+        outputData array: (1, classes) model output for the deployments window
+        consumer DeploymentConsumer: deployment the result is for
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+    """
+    confidencePercentage = FormatConfidence(outputData)
+    predictedClass = consumer.classList[np.argmax(outputData)]
+    ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'Inference for deployment: deployment_{consumer.deploymentID}'))
+    ScheduleTask(loop, CompileInferenceResult(consumer.inferenceData, predictedClass, confidencePercentage))
+    print(f"{str(datetime.now().strftime('%H:%M:%S'))} - Deployment: deployment_{consumer.deploymentID} Predicted class: {predictedClass}")
+
+def HandleError(error):
+    """Function to report a failed inference request
+    Args:
+        error Exception: exception raised by the request
+    """
+    if isinstance(error, InferenceServerException):
+        print(f"InferenceServerException: {str(error)}")
+    else:
+        print(f"Inference request failed: {str(error)}")
+
+def DispatchWindows(branch, window, ready, jetson, csvLog, loop, count=1):
+    """Function to infer on the window of every deployment of a branch that is ready
+       Each window is a view of the latest frames in the shared frame ring,
+       deployments running a split model instead encode the count frames just added
+    Args:
+        branch SharedBranch: branch the frames were written to
+        window FrameWindow: shared frame ring of the branch
+        ready array: DeploymentConsumers with a full window
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+        count int: number of frames just added to the ring
+    """
+    for consumer in ready:
+        if consumer.split:
+            if not consumer.split.encode(window.window(count)[0]):
+                ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'Frames skipped, encoder in flight for deployment: deployment_{consumer.deploymentID}'))
+            continue
+        ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'Batch of {consumer.frames} Gathered for deployment: deployment_{consumer.deploymentID}'))
+        InferWindow(window.window(consumer.frames), consumer, jetson, csvLog, loop)
+
+def ConsumeSample(branch, sample, jetson, csvLog, loop):
+    """Function to preprocess a sample once into the branches shared frame ring and dispatch any ready windows
+    1. Load and preprocess frame straight into the next slot of the shared frame ring
+    2. Commit the slot and retrieve the deployments whose window is now full
+    3. Infer on each of those windows
+    Args:
+        branch SharedBranch: branch the sample was pulled from
+        sample Gst.Sample: sample to consume
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+    """
+    window = branch.window
+    height, width, _ = branch.frameShape
+    _, processedFrame = ProcessFrame(sample, 0, width, height, branch.name, window.next_slot())
+    if processedFrame is None:
+        return
+    ready = branch.advance(window)
+    DispatchWindows(branch, window, ready, jetson, csvLog, loop)
+
+def OnNewSample(appsink, branch, jetson, csvLog, loop):
+    """Function connected to the appsink "new-sample" signal, frames flow continuously into the branches shared frame ring
+       Runs on the streaming thread of the branch (after its queue), so a slow model only holds up its own branch
+       whilst the leaky queue drops the frames it cannot keep up with. The GLOOP and other cameras are not blocked.
+    1. Pull the sample that triggered the signal
+    2. Consume it into the shared frame ring, inferring on any deployment window that is full
+    3. Return FlowReturn so the appsink keeps streaming
+    Args:
+        appsink Gst.AppSink: appsink for the branch
+        branch SharedBranch: branch the appsink belongs to
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+    Returns:
+        Gst.FlowReturn: OK to continue, EOS if the sink has no more samples
+    """
+    sample = appsink.emit("pull-sample")
+    if sample is None:
+        print(f"No more frames or sink unavailable for {branch.name}")
+        ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'No Frames Stopping Branch: {branch.name} Stopping'))
+        return Gst.FlowReturn.EOS
+    if branch.active:
+        ConsumeSample(branch, sample, jetson, csvLog, loop)
+    return Gst.FlowReturn.OK
+
+def PullFrameLinear(pipeline, appsink, branch, jetson, csvLog, loop):
     """Function to extract and process frames in a sequential order
     1. Extract frame from appsink
-    2. Load frame data
-    3. Append frame to frames queue
-    4. Check if frames queue is full
-    5. If full, stack frames and create input tensor
-    6. Infer on model
-    7. Log inference data
-    8. Clear frames queue
-    9. Return True if successful (keeps it looping in GLOOP)
+    2. Load frame data into the next slot of the shared frame ring
+    3. Check which deployment windows are full
+    4. Infer on each full window and log inference data
+    5. Return True if successful (keeps it looping in GLOOP), False once the branch has been stopped
     Args:
         pipeline Gst.Pipeline: pipeline for deployment
-        appsink Gst.AppSink: appsink for deployment
-        deploymentID int: deployment ID
-        framesQueue deque: queue to store frames
-        width int: width of model input
-        height int: height of model input
-        frameCounts int: number of frames to process
-        tritonClient httpclient: triton client for inference
-        modelName string: name of model
-        classList array: list of classes for model
+        appsink Gst.AppSink: appsink for the branch
+        branch SharedBranch: branch the appsink belongs to
         jetson JTOP: allows for jetson utilisation stats to be accessed
         csvLog string: path to log file
         loop asyncio: event loop
-        inferenceData array: array to store inference data
-        inputName string: name of model input
-        outputName string: name of model output
     Returns:
         bool: True if successful
     """
+    if not branch.active:
+        return False
     sample = appsink.emit("pull-sample")
     if sample is None:
-        print(f"No more frames or sink unavailable for deployment_{deploymentID}")
-        loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f'No Frames Stopping Deployment: deployment_{deploymentID} Stopping'))
+        print(f"No more frames or sink unavailable for {branch.name}")
+        ScheduleTask(loop, CompilePerformanceEntry(jetson, csvLog, f'No Frames Stopping Branch: {branch.name} Stopping'))
         return False
-    try:
-        buffer = sample.get_buffer()
-        inputWidth = 1920
-        inputHeight = 1080
-        success, mapInfo = buffer.map(Gst.MapFlags.READ)
-        if not success:
-            print("Failed to map buffer")
-            return True
-
-        ##Uncomment for optimal collection settings for i3d-kinetics type model (beta tested)
-        #processedFrame = LoadDataI3(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False)
-
-        ###Uncomment if pipeline is initialised with GPU
-        processedFrame = LoadDataRGBA(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False)      
-
-        ##Uncomment if pipeline is initialised with CPU
-        #processedFrame = LoadDataRGB(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False)
-        framesQueue.append(processedFrame)
-    finally:
-        if 'mapInfo' in locals() and mapInfo:
-            buffer.unmap(mapInfo)
-
-    if len(framesQueue) == frameCounts:
-        inputBatch = np.stack(list(framesQueue), axis=0)
-        inputBatch = np.expand_dims(inputBatch, axis=0)
-        loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f'Batch of {frameCounts} Gathered for deployment: deployment_{deploymentID}'))
-        try:
-            inputTensor = httpclient.InferInput(inputName, inputBatch.shape, "FP32")
-            inputTensor.set_data_from_numpy(inputBatch)
-            response = tritonClient.infer(modelName, inputs=[inputTensor])                
-            outputData = response.as_numpy(outputName)
-            confidencePercentage = FormatConfidence(outputData)
-            predictedClass = classList[np.argmax(outputData)]
-            loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f'Inference for deployment: deployment_{deploymentID}'))
-            inferencetask = loop.create_task(CompileInferenceResult(inferenceData, predictedClass, confidencePercentage))
-            print(f"{str(datetime.now().strftime('%H:%M:%S'))} - Deployment: deployment_{deploymentID} Predicted class: {predictedClass}")
-        except InferenceServerException as e:
-            print(f"InferenceServerException: {str(e)}")
-        framesQueue.clear() 
+    ConsumeSample(branch, sample, jetson, csvLog, loop)
     return True  
 
-def PullFrameParallel(pipeline, appsink, deploymentID, framesQueue, width, height, frameCounts, tritonClient, modelName, classList, jetson, csvLog, loop, inferenceData, inputName, outputName):
-    frames = GatherFrames(appsink, frameCounts)
-    ProcessAppendFrames(framesQueue, frames, width, height, deploymentID)
-    if len(framesQueue) == frameCounts:
-        inputBatch = np.stack(list(framesQueue), axis=0)
-        inputBatch = np.expand_dims(inputBatch, axis=0)
-        try:
-            inputTensor = httpclient.InferInput(inputName, inputBatch.shape, "FP32")
-            inputTensor.set_data_from_numpy(inputBatch)
-            response = tritonClient.infer(modelName, inputs=[inputTensor])                
-            outputData = response.as_numpy(outputName)
-            confidencePercentage = FormatConfidence(outputData)
-            predictedClass = classList[np.argmax(outputData)]
-            loggingtask = loop.create_task(CompilePerformanceEntry(jetson, csvLog, f'Inference for deployment: deployment_{deploymentID}'))
-            inferencetask = loop.create_task(CompileInferenceResult(inferenceData, predictedClass, confidencePercentage))
-            print(f"{str(datetime.now().strftime('%H:%M:%S'))} - Deployment: deployment_{deploymentID} Predicted class: {predictedClass}")
-        except InferenceServerException as e:
-            print(f"InferenceServerException: {str(e)}")
-        framesQueue.clear() 
+def PullFrameParallel(pipeline, appsink, branch, jetson, csvLog, loop):
+    """Function to gather a window of frames and process them in parallel
+    1. Gather enough frames for the largest deployment window
+    2. Process them in parallel into the shared frame ring
+    3. Infer on each full deployment window
+    4. Return True (keeps it looping in GLOOP), False once the branch has been stopped
+    Args:
+        pipeline Gst.Pipeline: pipeline for deployment
+        appsink Gst.AppSink: appsink for the branch
+        branch SharedBranch: branch the appsink belongs to
+        jetson JTOP: allows for jetson utilisation stats to be accessed
+        csvLog string: path to log file
+        loop asyncio: event loop
+    Returns:
+        bool: True if successful
+    """
+    if not branch.active:
+        return False
+    window = branch.window
+    height, width, _ = branch.frameShape
+    frames = GatherFrames(appsink, window.frames)
+    processedCount = ProcessAppendFrames(window, frames, width, height, branch.name)
+    ready = branch.advance(window, processedCount)
+    DispatchWindows(branch, window, ready, jetson, csvLog, loop, processedCount)
     return True
 
-def ProcessFrame(sample, index, width, height, deploymentID):
+def ProcessFrame(sample, index, width, height, deploymentID, out=None):
     """Function to process frame data for use in parallel processing
         1. Get buffer from sample
         2. Get caps format from sample
@@ -259,26 +459,61 @@ def ProcessFrame(sample, index, width, height, deploymentID):
         width int: width of model input
         height int: height of model input
         deploymentID int: deployment ID
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
         tuple: index and processed frame
     """
+    buffer = sample.get_buffer()
+    inputWidth, inputHeight, pixelFormat = GetSampleGeometry(sample)
+    success, mapInfo = buffer.map(Gst.MapFlags.READ)
+    if not success:
+        print("Failed to map buffer")
+        return (index, None)
     try:
-        buffer = sample.get_buffer()
-        capsFormat = sample.get_caps().get_structure(0)
-        inputWidth = 1920
-        inputHeight = 1080
-        success, mapInfo = buffer.map(Gst.MapFlags.READ)
-        if success:
-            pass
-        else:
-            print("Failed to map buffer")
+        ##Uncomment for optimal collection settings for i3d-kinetics type model
+        #return (index, LoadDataI3(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False, out))
+
+        loadData = SelectLoader(pixelFormat)
+        return (index, loadData(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False, out))
     finally:
-        if 'mapInfo' in locals() and mapInfo:
-            buffer.unmap(mapInfo)
-    ##Uncomment for optimal collection settings for i3d-kinetics type model
-    #return (index, LoadDataI3(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False))
-    
-    return (index, LoadDataRGBA(mapInfo.data, inputHeight, inputWidth, width, height, deploymentID, False))
+        buffer.unmap(mapInfo)
+
+def GetSampleGeometry(sample):
+    """Function to read the negotiated frame geometry from the caps of a sample
+    Args:
+        sample Gst.Sample: sample pulled from the appsink
+    Returns:
+        int: width of input frame
+        int: height of input frame
+        string: pixel format of input frame i.e RGB or RGBA
+    """
+    capsFormat = sample.get_caps().get_structure(0)
+    return capsFormat.get_value("width"), capsFormat.get_value("height"), capsFormat.get_value("format")
+
+def SelectLoader(pixelFormat):
+    """Function to choose the frame loader matching the pixel format negotiated by the deployment branch
+    Args:
+        pixelFormat string: pixel format of input frame
+    Returns:
+        function: LoadDataRGB for 3 channel formats, LoadDataRGBA otherwise
+    """
+    if pixelFormat == "RGB":
+        return LoadDataRGB
+    return LoadDataRGBA
+
+def MapFrame(bufferedData, inputHeight, inputWidth, channels):
+    """Function to view mapped data as a frame, allowing for rows padded by GStreamer (i.e RGB rows are 4 byte aligned)
+    Args:
+        bufferedData array: uint8 mapped data from buffer
+        inputHeight int: height of input frame
+        inputWidth int: width of input frame
+        channels int: number of channels in the frame
+    Returns:
+        array: (inputHeight, inputWidth, channels) view of the mapped data
+    """
+    rowStride = bufferedData.size // inputHeight
+    rows = bufferedData[:rowStride * inputHeight].reshape((inputHeight, rowStride))
+    return rows[:, :inputWidth * channels].reshape((inputHeight, inputWidth, channels))
 
 def GatherFrames(appsink, frameCount):
     """Function to gather frame data for use in parallel processing
@@ -302,28 +537,31 @@ def GatherFrames(appsink, frameCount):
         asyncio.sleep(0.05)
     return frames
 
-def ProcessAppendFrames(framesQueue, frames, width, height, deploymentID):
-    """Function to process frame data in parallel whilst keeping their order in the queue correct
+def ProcessAppendFrames(framesWindow, frames, width, height, deploymentID):
+    """Function to process frame data in parallel whilst keeping their order in the window correct
         1. Create executor
-        2. Submit frames to executor
-        3. Sort results in order
-        4. Append processed frames to frames queue
-        5. Return frames queue
+        2. Submit frames to executor, each writing straight into its own upcoming slot of the frames window
+        3. Wait for results in order
+        4. Count the processed slots up to the first frame that failed
+        5. Return the count so the caller can commit them
     Args:
-        framesQueue deque: queue to store frames
+        framesWindow FrameWindow: preallocated window to store frames
         frames array: array of frames to process
         width int: width of model input
         height int: height of model input
-        deploymentID int: deployment ID
+        deploymentID int: deployment ID (or branch name) used to label saved frames
     Returns:
-        deque: frames queue
+        int: number of frames processed in order
     """
     with ThreadPoolExecutor() as executor:
-        futureToFrame = {executor.submit(ProcessFrame, sample, i, width, height, deploymentID): i for i, sample in enumerate(frames)}
+        futureToFrame = {executor.submit(ProcessFrame, sample, i, width, height, deploymentID, framesWindow.next_slot(i)): i for i, sample in enumerate(frames)}
         resultsInOrder = sorted([future.result() for future in futureToFrame], key=lambda x: x[0])
+        processedCount = 0
         for _, processedFrame in resultsInOrder:
-            framesQueue.append(processedFrame)
-        return framesQueue
+            if processedFrame is None:
+                break
+            processedCount += 1
+        return processedCount
             
 def FormatConfidence(outputData):
     """Function to format confidence to percentage based on whether the is model set to output a percentage or not
@@ -335,40 +573,32 @@ def FormatConfidence(outputData):
     Returns:
         string: confidence percentage
     """
-    maxValue = np.max(outputData)
+    maxValue = np.max(outputData).astype(np.float32)
     if maxValue < 1:
         confidencePercentage = np.round(maxValue * 100, decimals=4)
     else:
         confidencePercentage = np.round(maxValue, decimals=4)
     return confidencePercentage
 
-def PreProcessFrame(inputHeight, inputWidth, width, height, frame):
+def PreProcessFrame(inputHeight, inputWidth, width, height, frame, out=None):
     """Function to preprocess frame to correct size, format and type Specifically for I3D-Kinetics model
-        1. Resize frame to correct size
-        2. Convert frame to RGB
-        3. Crop frame to focus on centre portion
+        1. Retrieve the cached i3d preprocessing plan, which resizes the frame to a height of 256 and crops the centre portion
+           as a single resize of the matching source region
+        2. Convert frame to RGB and normalise in a single pass into out
     Args:
         inputHeight int: height of input frame
         inputWidth int: width of input frame
         width int: width of model input
         height int: height of model input
         frame array: frame to preprocess
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
-    targetHeight = 256
-    aspectRatio = inputWidth / inputHeight
-    newWidth = int(targetHeight * aspectRatio)
-
-    resizedFrame = cv2.resize(frame, (newWidth, targetHeight), interpolation=cv2.INTER_LINEAR)
-    resizedFrame = cv2.cvtColor(resizedFrame, cv2.COLOR_RGBA2RGB)
-    x = (aspectRatio - width) // 2
-    y = (targetHeight - height) // 2
-
-    croppedFrame = resizedFrame[y:y + width, x:x + height]
-    return croppedFrame.astype('float32') / 255.0  
+    plan = GetPreprocessPlan(inputHeight, inputWidth, "RGBA", height, width, "i3d")
+    return PreprocessInto(plan, frame, out)
 
-def LoadDataI3(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT):
+def LoadDataI3(mappedData, inputHeight, inputWidth, width, height, deploymentID, OUTPUT, out=None):
     """Function to load frame data specifically for I3D-Kinetics model
         1. Load frame from mapped data
         2. Optionally save frame to file
@@ -381,13 +611,14 @@ def LoadDataI3(mappedData, inputHeight, inputWidth, width, height, deploymentID,
         height int: height of model input
         deploymentID int: deployment ID
         OUTPUT bool: flag to save frame to file
+        out array: optional frame window slot to write the preprocessed frame into
     Returns:
-        float32: preprocessed frame
+        array: preprocessed frame, float normalised to 0-1 in the dtype of out (float32 if not given) or uint8 if written into a uint8 slot
     """
     bufferedData = np.frombuffer(mappedData, dtype=np.uint8)
     if OUTPUT:
         img = Image.frombytes("RGBA", (inputWidth, inputHeight), bufferedData)
         imgRGB = img.convert("RGB")
         imgRGB.save(f"deployment_{deploymentID}.jpg")
-    frame = bufferedData.reshape((inputHeight, inputWidth, 4))
-    return PreProcessFrame(inputHeight, inputWidth, width, height, frame)
\ No newline at end of file
+    frame = MapFrame(bufferedData, inputHeight, inputWidth, 4)
+    return PreProcessFrame(inputHeight, inputWidth, width, height, frame, out)
\ No newline at end of file
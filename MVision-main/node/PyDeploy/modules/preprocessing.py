@@ -0,0 +1,152 @@
+import cv2
+import numpy as np
+import threading
+from functools import lru_cache
+
+"""Channel selections that drop alpha/padding and reorder to the RGB order the models are trained on.
+   Indexing with a slice keeps it a view of the frame, so no intermediate is created.
+"""
+CHANNEL_ORDERS = {
+    "RGB": (3, slice(0, 3)),
+    "RGBA": (4, slice(0, 3)),
+    "RGBx": (4, slice(0, 3)),
+    "BGR": (3, slice(2, None, -1)),
+    "BGRA": (4, slice(2, None, -1)),
+    "BGRx": (4, slice(2, None, -1)),
+}
+
+class PreprocessPlan:
+    """Precomputed preprocessing for one (input geometry, model geometry, crop policy)
+       Holds the source region that maps onto the model input, whether a resize is needed at all,
+       the channel selection for the input format and per thread uint8 scratch buffers for the resize.
+    Args:
+        inputHeight int: height of input frame
+        inputWidth int: width of input frame
+        inputFormat string: pixel format of input frame (RGB, RGBA, BGR ...)
+        height int: height of model input
+        width int: width of model input
+        cropPolicy string: none to resize the whole frame, i3d to resize the short side to 256 and centre crop
+    """
+    def __init__(self, inputHeight, inputWidth, inputFormat, height, width, cropPolicy="none"):
+        self.inputHeight = inputHeight
+        self.inputWidth = inputWidth
+        self.inputFormat = inputFormat
+        self.height = height
+        self.width = width
+        self.cropPolicy = cropPolicy
+        self.inputChannels, self.channels = CHANNEL_ORDERS[inputFormat]
+        self.region = CalculateRegion(inputHeight, inputWidth, height, width, cropPolicy)
+        top, bottom, left, right = self.region
+        self.resize = (bottom - top, right - left) != (height, width)
+        self.scratch = threading.local()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.inputWidth}x{self.inputHeight} {self.inputFormat} -> {self.width}x{self.height}, crop={self.cropPolicy})"
+
+    def get_scratch(self, frames=0):
+        shape = (self.height, self.width, self.inputChannels)
+        if frames:
+            shape = (frames,) + shape
+        key = f"buffer_{frames}"
+        buffer = getattr(self.scratch, key, None)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=np.uint8)
+            setattr(self.scratch, key, buffer)
+        return buffer
+
+def CalculateRegion(inputHeight, inputWidth, height, width, cropPolicy):
+    """Function to calculate the region of the input frame that maps onto the model input
+       none: the whole frame is resized to the model input
+       i3d: equivalent to resizing the frame so its height is 256 and cropping the centre height x width, done as a single resize of the matching source region
+    Args:
+        inputHeight int: height of input frame
+        inputWidth int: width of input frame
+        height int: height of model input
+        width int: width of model input
+        cropPolicy string: none or i3d
+    Returns:
+        tuple: top, bottom, left, right of the source region
+    """
+    if cropPolicy == "i3d":
+        targetHeight = 256
+        scale = inputHeight / targetHeight
+        regionHeight = min(inputHeight, int(round(height * scale)))
+        regionWidth = min(inputWidth, int(round(width * scale)))
+        top = (inputHeight - regionHeight) // 2
+        left = (inputWidth - regionWidth) // 2
+        return top, top + regionHeight, left, left + regionWidth
+    return 0, inputHeight, 0, inputWidth
+
+@lru_cache(maxsize=64)
+def GetPreprocessPlan(inputHeight, inputWidth, inputFormat, height, width, cropPolicy="none"):
+    """Function to get the cached plan for a given geometry, plans are only computed once per geometry
+    Args:
+        inputHeight int: height of input frame
+        inputWidth int: width of input frame
+        inputFormat string: pixel format of input frame
+        height int: height of model input
+        width int: width of model input
+        cropPolicy string: none or i3d
+    Returns:
+        PreprocessPlan: plan for the geometry
+    """
+    return PreprocessPlan(inputHeight, inputWidth, inputFormat, height, width, cropPolicy)
+
+def WriteNormalised(source, out):
+    """Function to drop channels, convert and normalise in a single pass into out
+       float outputs (float32 or float16) are scaled to 0-1, uint8 outputs are copied as they are
+    Args:
+        source array: uint8 view of the frame(s) with the channel selection applied
+        out array: caller provided output buffer
+    Returns:
+        array: out
+    """
+    if out.dtype == np.uint8:
+        np.copyto(out, source)
+    else:
+        np.multiply(source, 1 / 255.0, out=out, casting='unsafe')
+    return out
+
+def PreprocessInto(plan, frame, out=None):
+    """Function to preprocess a frame into a caller provided buffer (such as a frame window slot)
+    1. Take the planned source region of the frame (view)
+    2. Resize into the plans scratch buffer if the geometry differs
+    3. Drop alpha, reorder channels and normalise straight into out
+    Args:
+        plan PreprocessPlan: plan for the frame geometry
+        frame array: uint8 frame of shape (inputHeight, inputWidth, channels)
+        out array: output buffer of shape (height, width, 3), allocated as float32 if not provided
+    Returns:
+        array: out
+    """
+    if out is None:
+        out = np.empty((plan.height, plan.width, 3), dtype=np.float32)
+    top, bottom, left, right = plan.region
+    source = frame[top:bottom, left:right]
+    if plan.resize:
+        source = cv2.resize(source, (plan.width, plan.height), dst=plan.get_scratch())
+    return WriteNormalised(source[..., plan.channels], out)
+
+def PreprocessBatchInto(plan, frames, out=None):
+    """Function to preprocess several frames of the same geometry into a caller provided batch buffer
+    1. Resize each frames planned region into the plans batch scratch buffer
+    2. Drop alpha, reorder channels and normalise the whole batch in one pass into out
+    Args:
+        plan PreprocessPlan: plan for the frame geometry
+        frames array: sequence of uint8 frames
+        out array: output buffer of shape (frames, height, width, 3), allocated as float32 if not provided
+    Returns:
+        array: out
+    """
+    count = len(frames)
+    if out is None:
+        out = np.empty((count, plan.height, plan.width, 3), dtype=np.float32)
+    top, bottom, left, right = plan.region
+    if not plan.resize:
+        for index, frame in enumerate(frames):
+            WriteNormalised(frame[top:bottom, left:right][..., plan.channels], out[index])
+        return out
+    scratch = plan.get_scratch(count)
+    for index, frame in enumerate(frames):
+        cv2.resize(frame[top:bottom, left:right], (plan.width, plan.height), dst=scratch[index])
+    return WriteNormalised(scratch[..., plan.channels], out)
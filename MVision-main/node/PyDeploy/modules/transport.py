@@ -0,0 +1,169 @@
+import queue
+
+import numpy as np
+import tritonclient.http as httpclient
+from tritonclient.utils import np_to_triton_dtype, triton_to_np_dtype
+
+try:
+    import tritonclient.utils.shared_memory as systemSharedMemory
+except ImportError:
+    systemSharedMemory = None
+
+class TensorTransport:
+    """Sends tensors to the Triton server serialised in the HTTP request and response bodies
+       send is called on the InflightPipeline worker thread with that threads own client, which both sends the request and waits on its result
+    """
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+    def send(self, tritonClient, modelName, inputName, outputName, batch):
+        """Infer on batch with tritonClient and return the models output as numpy"""
+        inputTensor = httpclient.InferInput(inputName, batch.shape, np_to_triton_dtype(batch.dtype))
+        inputTensor.set_data_from_numpy(batch)
+        outputTensor = httpclient.InferRequestedOutput(outputName)
+        return tritonClient.infer(modelName, inputs=[inputTensor], outputs=[outputTensor]).as_numpy(outputName)
+
+    def close(self):
+        pass
+
+class SharedMemoryTransport(TensorTransport):
+    """Sends tensors through POSIX shared memory regions registered with a Triton server on the same device
+       Each slot has an input and an output region, registered once, so a request only carries the region names
+       rather than the tensors. There should be a slot for each request that can be in flight.
+       Regions are registered and unregistered with a client of the calling thread, made by clientFactory and closed straight after.
+    Args:
+        clientFactory function: creates a client for the server (or a stand in with the same shared memory methods)
+        name string: unique prefix for the region names and keys
+        inputBytes int: size of the largest input tensor
+        outputBytes int: size of the largest output tensor
+        slots int: number of requests that can use the transport at once
+        sharedMemory module: shared memory utilities, tritonclient.utils.shared_memory unless a stand in is given
+    """
+    def __init__(self, clientFactory, name, inputBytes, outputBytes, slots=1, sharedMemory=None):
+        self.clientFactory = clientFactory
+        self.sharedMemory = sharedMemory or systemSharedMemory
+        if self.sharedMemory is None:
+            raise RuntimeError("tritonclient shared memory utilities are not available")
+        self.name = name
+        self.inputBytes = inputBytes
+        self.outputBytes = outputBytes
+        self.regions = []
+        self.registered = []
+        self.free = queue.Queue()
+        tritonClient = clientFactory()
+        try:
+            for slot in range(slots):
+                inputRegion = self.register(tritonClient, f"{name}_input_{slot}", inputBytes)
+                outputRegion = self.register(tritonClient, f"{name}_output_{slot}", outputBytes)
+                self.regions.append((inputRegion, outputRegion))
+                self.free.put(slot)
+        except Exception:
+            self.unregister(tritonClient)
+            raise
+        finally:
+            tritonClient.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, slots={len(self.regions)}, free={self.free.qsize()})"
+
+    def register(self, tritonClient, regionName, byteSize):
+        handle = self.sharedMemory.create_shared_memory_region(regionName, f"/{regionName}", byteSize)
+        try:
+            tritonClient.register_system_shared_memory(regionName, f"/{regionName}", byteSize)
+        except Exception:
+            self.sharedMemory.destroy_shared_memory_region(handle)
+            raise
+        self.registered.append((regionName, handle))
+        return regionName, handle
+
+    def send(self, tritonClient, modelName, inputName, outputName, batch):
+        """Infer on batch through a free slot with tritonClient and return a copy of the models output, batches larger than the input regions are sent in the HTTP body"""
+        if batch.nbytes > self.inputBytes:
+            return super().send(tritonClient, modelName, inputName, outputName, batch)
+        slot = self.free.get()
+        try:
+            (inputRegion, inputHandle), (outputRegion, _) = self.regions[slot]
+            self.sharedMemory.set_shared_memory_region(inputHandle, [np.ascontiguousarray(batch)])
+            inputTensor = httpclient.InferInput(inputName, batch.shape, np_to_triton_dtype(batch.dtype))
+            inputTensor.set_shared_memory(inputRegion, batch.nbytes)
+            outputTensor = httpclient.InferRequestedOutput(outputName)
+            outputTensor.set_shared_memory(outputRegion, self.outputBytes)
+            response = tritonClient.infer(modelName, inputs=[inputTensor], outputs=[outputTensor])
+            return self.read_output(slot, response.get_output(outputName))
+        finally:
+            self.release(slot)
+
+    def read_output(self, slot, output):
+        """Copy the output described by the response out of the slots output region"""
+        _, outputHandle = self.regions[slot][1]
+        contents = self.sharedMemory.get_contents_as_numpy(outputHandle, triton_to_np_dtype(output["datatype"]), output["shape"])
+        return np.array(contents, copy=True)
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def unregister(self, tritonClient):
+        for regionName, handle in self.registered:
+            try:
+                tritonClient.unregister_system_shared_memory(regionName)
+            except Exception as e:
+                print(f"Failed to unregister {regionName}: {str(e)}")
+            self.sharedMemory.destroy_shared_memory_region(handle)
+        self.registered = []
+        self.regions = []
+
+    def close(self):
+        """Unregister and destroy every region, the transport should not be used afterwards"""
+        tritonClient = self.clientFactory()
+        try:
+            self.unregister(tritonClient)
+        finally:
+            tritonClient.close()
+
+def CreateTransport(clientFactory, name, modelName, outputName, inputBytes, outputElements, slots=1, useSharedMemory=True, sharedMemory=None):
+    """Function to create the transport for a deployment or batcher
+    1. If shared memory is enabled size the output regions from the data type the server lists for the output (see OutputBytes)
+    2. Attempt to create and register a region pair for each slot
+    3. If shared memory is unavailable (no utilities, server on another device, metadata or registration refused) fall back to HTTP bodies
+    Args:
+        clientFactory function: creates a client for the server
+        name string: unique prefix for the region names
+        modelName string: name of model
+        outputName string: name of model output
+        inputBytes int: size of the largest input tensor
+        outputElements int: number of elements in the largest output tensor
+        slots int: number of requests that can be in flight
+        useSharedMemory bool: whether to attempt shared memory
+        sharedMemory module: shared memory utilities stand in, tritonclient.utils.shared_memory if None
+    Returns:
+        TensorTransport: shared memory transport, or the HTTP body transport
+    """
+    if useSharedMemory:
+        try:
+            outputBytes = OutputBytes(clientFactory, modelName, outputName, outputElements)
+            return SharedMemoryTransport(clientFactory, name, inputBytes, outputBytes, slots, sharedMemory)
+        except Exception as e:
+            print(f"Shared memory unavailable for {name}, sending tensors over HTTP: {str(e)}")
+    return TensorTransport()
+
+
+def OutputBytes(clientFactory, modelName, outputName, elements):
+    """Function to get the size of a models output from the data type the server lists for it, i.e 2 bytes an element for a float16 model
+    Args:
+        clientFactory function: creates a client for the server
+        modelName string: name of model
+        outputName string: name of model output
+        elements int: number of elements in the largest output tensor
+    Returns:
+        int: size of the largest output tensor, assuming float32 if the output is not listed
+    """
+    tritonClient = clientFactory()
+    try:
+        outputs = tritonClient.get_model_metadata(modelName).get('outputs', [])
+    finally:
+        tritonClient.close()
+    for output in outputs:
+        if output['name'] == outputName:
+            return np.dtype(triton_to_np_dtype(output['datatype'])).itemsize * elements
+    return np.dtype(np.float32).itemsize * elements
+
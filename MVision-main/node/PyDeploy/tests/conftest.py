@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The node runs from PyDeploy, so its modules are imported as the modules package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
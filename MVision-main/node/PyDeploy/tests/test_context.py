@@ -0,0 +1,108 @@
+import os
+import socket
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from modules.context import NodeContext
+
+def WriteConfig(configPath, port):
+    with open(configPath, 'w') as configFile:
+        configFile.write(f"[CONNECTION]\nmaster_ip = 127.0.0.1\nmaster_port = {port}\n")
+
+def FreePort():
+    """Function to get a port nothing is listening on, so connecting to it is refused"""
+    with socket.socket() as freeSocket:
+        freeSocket.bind(("127.0.0.1", 0))
+        return freeSocket.getsockname()[1]
+
+def StandInMaster(failure):
+    """Stand in for the master server, which fails the first call to each endpoint (dropping the connection or stalling past the timeout) then answers
+    Returns:
+        web.Application: the app
+        dict: number of calls to each endpoint
+    """
+    calls = {}
+
+    async def Endpoint(request):
+        calls[request.path] = calls.get(request.path, 0) + 1
+        if calls[request.path] == 1:
+            if failure == "drop":
+                request.transport.close()
+            else:
+                await asyncio.sleep(1)
+        return web.json_response({'calls': calls[request.path]})
+
+    app = web.Application()
+    app.router.add_get('/resource', Endpoint)
+    app.router.add_post('/resource', Endpoint)
+    return app, calls
+
+async def Serve(tmp_path, failure, test):
+    app, calls = StandInMaster(failure)
+    server = TestServer(app)
+    await server.start_server()
+    configPath = tmp_path / "node.conf"
+    WriteConfig(configPath, server.port)
+    context = NodeContext(str(configPath), timeout=0.3, retries=2, backoff=0)
+    try:
+        await test(context, calls)
+    finally:
+        await context.Close()
+        await server.close()
+
+@pytest.mark.parametrize("failure", ["drop", "stall"])
+def test_get_retried(tmp_path, failure):
+    async def test(context, calls):
+        assert await context.Get('/resource') == {'calls': 2}
+        assert calls == {'/resource': 2}
+    asyncio.run(Serve(tmp_path, failure, test))
+
+@pytest.mark.parametrize("failure", ["drop", "stall"])
+def test_post_not_retried_once_sent(tmp_path, failure):
+    async def test(context, calls):
+        with pytest.raises((aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+            await context.Post('/resource', {})
+        assert calls == {'/resource': 1}
+    asyncio.run(Serve(tmp_path, failure, test))
+
+def test_post_retried_when_master_unreachable(tmp_path):
+    async def test():
+        attempts = []
+        trace = aiohttp.TraceConfig()
+        async def RequestStart(session, context, params):
+            attempts.append(params.url)
+        trace.on_request_start.append(RequestStart)
+        configPath = tmp_path / "node.conf"
+        WriteConfig(configPath, FreePort())
+        context = NodeContext(str(configPath), timeout=0.3, retries=2, backoff=0)
+        context.session = aiohttp.ClientSession(trace_configs=[trace])
+        try:
+            with pytest.raises(aiohttp.ClientConnectorError):
+                await context.Post('/resource', {})
+        finally:
+            await context.Close()
+        assert len(attempts) == 3
+    asyncio.run(test())
+
+def test_config_read_again_only_when_changed(tmp_path):
+    configPath = tmp_path / "node.conf"
+    WriteConfig(configPath, 3000)
+    os.utime(configPath, (1000, 1000))
+    context = NodeContext(str(configPath))
+    config = context.Config()
+    assert context.Config() is config
+    WriteConfig(configPath, 3001)
+    os.utime(configPath, (1000, 1000))
+    assert context.Config() is config
+    os.utime(configPath, (2000, 2000))
+    assert context.Config() is not config
+    assert context.MasterUrl() == "http://127.0.0.1:3001"
+    config = context.Config()
+    WriteConfig(configPath, 30000)
+    os.utime(configPath, (2000, 2000))
+    assert context.Config() is not config
+    assert context.MasterUrl() == "http://127.0.0.1:30000"
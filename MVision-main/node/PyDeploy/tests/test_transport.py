@@ -0,0 +1,79 @@
+import pytest
+
+pytest.importorskip("tritonclient.http")
+
+from modules.transport import CreateTransport, SharedMemoryTransport, TensorTransport
+
+class StandInServer:
+    """Records the shared memory regions registered with it, as a Triton server on the same device would"""
+    def __init__(self, refuse=False, metadata=None):
+        self.refuse = refuse
+        self.metadata = metadata if metadata is not None else {'outputs': [{'name': 'dense', 'datatype': 'FP16'}]}
+        self.registered = {}
+        self.clients = 0
+        self.closed = 0
+
+    def client(self):
+        self.clients += 1
+        return StandInClient(self)
+
+class StandInClient:
+    def __init__(self, server):
+        self.server = server
+
+    def get_model_metadata(self, modelName):
+        if isinstance(self.server.metadata, Exception):
+            raise self.server.metadata
+        return self.server.metadata
+
+    def register_system_shared_memory(self, regionName, key, byteSize):
+        if self.server.refuse:
+            raise RuntimeError("shared memory registration refused")
+        self.server.registered[regionName] = byteSize
+
+    def unregister_system_shared_memory(self, regionName):
+        self.server.registered.pop(regionName)
+
+    def close(self):
+        self.server.closed += 1
+
+class StandInSharedMemory:
+    """Stands in for tritonclient.utils.shared_memory, keeping the regions in a dict rather than /dev/shm"""
+    def __init__(self):
+        self.regions = {}
+
+    def create_shared_memory_region(self, regionName, key, byteSize):
+        self.regions[regionName] = byteSize
+        return regionName
+
+    def destroy_shared_memory_region(self, handle):
+        self.regions.pop(handle)
+
+def test_regions_registered_and_unregistered():
+    server = StandInServer()
+    sharedMemory = StandInSharedMemory()
+    transport = CreateTransport(server.client, "deployment_1", "model", "dense", 1024, 10, slots=2, sharedMemory=sharedMemory)
+    assert isinstance(transport, SharedMemoryTransport)
+    assert server.registered == {"deployment_1_input_0": 1024, "deployment_1_output_0": 20,
+                                 "deployment_1_input_1": 1024, "deployment_1_output_1": 20}
+    assert sharedMemory.regions == server.registered
+    transport.close()
+    assert server.registered == {}
+    assert sharedMemory.regions == {}
+    assert server.closed == server.clients
+
+def test_refused_registration_falls_back_to_http():
+    server = StandInServer(refuse=True)
+    sharedMemory = StandInSharedMemory()
+    transport = CreateTransport(server.client, "deployment_1", "model", "dense", 1024, 10, slots=2, sharedMemory=sharedMemory)
+    assert type(transport) is TensorTransport
+    assert sharedMemory.regions == {}
+    assert server.closed == server.clients
+
+def test_metadata_failure_falls_back_to_http():
+    server = StandInServer(metadata=RuntimeError("model metadata unavailable"))
+    sharedMemory = StandInSharedMemory()
+    transport = CreateTransport(server.client, "deployment_1", "model", "dense", 1024, 10, sharedMemory=sharedMemory)
+    assert type(transport) is TensorTransport
+    assert server.registered == {}
+    assert server.closed == server.clients
@@ -1,7 +1,6 @@
-import cv2
 import numpy as np
 import tritonclient.http as httpclient
-from tritonclient.utils import InferenceServerException
+from tritonclient.utils import InferenceServerException, np_to_triton_dtype
 from collections import deque
 from PIL import Image
 from datetime import datetime
@@ -12,20 +11,48 @@ import logging
 from typing import List, Tuple, Optional
 import threading
 import queue
+import sys
+from pathlib import Path
+
+try:
+    # Deployed as node/PyDeploy/modules/inference.py
+    from .preprocessing import GetPreprocessPlan, PreprocessInto, PreprocessBatchInto
+except ImportError:
+    sys.path.insert(0, str(Path(__file__).resolve().parent / "MVision-main" / "node" / "PyDeploy"))
+    from modules.preprocessing import GetPreprocessPlan, PreprocessInto, PreprocessBatchInto
 
 # Configuration log
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class OptimizedInferenceEngine:
-    """Optimised inference engine"""
+    """Optimised inference engine
+    
+    Batches are handed to sender threads so the worker keeps batching while
+    earlier batches are on the server. Each sender has a Triton client of its
+    own and both sends a batch and waits on its result (tritonclient.http is
+    gevent based and cannot be shared between threads). Each model has at most
+    max_inflight_per_model batches in flight and each deployment at most
+    max_inflight_per_deployment windows; results are delivered in submission
+    order.
+    """
     
-    def __init__(self, triton_url: str = 'localhost:8000', max_batch_size: int = 8):
+    def __init__(self, triton_url: str = 'localhost:8000', max_batch_size: int = 8,
+                 max_inflight_per_model: int = 2, max_inflight_per_deployment: int = 2):
         self.triton_url = triton_url
         self.max_batch_size = max_batch_size
-        self.triton_client = httpclient.InferenceServerClient(url=triton_url)
+        self.max_inflight_per_model = max_inflight_per_model
+        self.max_inflight_per_deployment = max_inflight_per_deployment
         self.frame_buffer = {}  # Frame buffer per deployment
         self.inference_queue = queue.Queue(maxsize=100)
+        self.send_queue = queue.Queue()
+        self.completed = {}
+        self.sent_batches = 0
+        self.delivered_batches = 0
+        self.completion_lock = threading.Lock()
+        self.model_slots = {}
+        self.deployment_inflight = {}
+        self.inflight_lock = threading.Lock()
         self.result_cache = {}  # Results Cache
         self.performance_stats = {
             'total_inferences': 0,
@@ -37,31 +64,55 @@ class OptimizedInferenceEngine:
         # Start the reasoning worker thread
         self.inference_thread = threading.Thread(target=self._inference_worker, daemon=True)
         self.inference_thread.start()
+        
+        # Start a sender thread for each batch that can be on the server at once
+        self.sender_threads = [threading.Thread(target=self._sender_worker, daemon=True)
+                               for _ in range(max_inflight_per_model)]
+        for sender_thread in self.sender_threads:
+            sender_thread.start()
+    
+    def _get_model_slots(self, model_name: str) -> threading.BoundedSemaphore:
+        """In flight slots for a model, created on first use"""
+        with self.inflight_lock:
+            if model_name not in self.model_slots:
+                self.model_slots[model_name] = threading.BoundedSemaphore(self.max_inflight_per_model)
+            return self.model_slots[model_name]
+    
+    def _release_deployments(self, requests: List[dict]):
+        """Free the in flight slots held by the requests of a batch"""
+        with self.inflight_lock:
+            for req in requests:
+                self.deployment_inflight[req['deployment_id']] -= 1
     
     def _inference_worker(self):
-        """Reasoning Work Thread"""
+        """Reasoning Work Thread
+        
+        A batch is flushed when it is full or when its first request has
+        waited batch_timeout, so an idle engine does not flush a lone request
+        immediately and a busy one does not hold requests past the deadline.
+        """
         batch_requests = []
-        last_batch_time = time.time()
+        batch_timeout = 0.05
         
         while True:
             try:
-                # batch file
-                timeout = 0.01  # 10ms timeout
+                # Wait no longer than the oldest request's remaining time
+                if batch_requests:
+                    timeout = max(batch_requests[0]['timestamp'] + batch_timeout - time.time(), 0)
+                else:
+                    timeout = None
                 try:
                     request = self.inference_queue.get(timeout=timeout)
                     batch_requests.append(request)
                 except queue.Empty:
                     pass
                 
-                current_time = time.time()
-                
-                # If the batch is full or times out, perform reasoning
+                # If the batch is full or its oldest request is due, perform reasoning
                 if (len(batch_requests) >= self.max_batch_size or 
-                    (batch_requests and current_time - last_batch_time > 0.05)):
+                    (batch_requests and time.time() - batch_requests[0]['timestamp'] >= batch_timeout)):
                     
                     self._process_batch(batch_requests)
                     batch_requests = []
-                    last_batch_time = current_time
                     
             except Exception as e:
                 logger.error(f"Reasoning about work thread errors: {e}")
@@ -83,50 +134,83 @@ class OptimizedInferenceEngine:
                     model_groups[model_name] = []
                 model_groups[model_name].append(req)
             
-            # Perform batch inference for each model
+            # Start batch inference for each model, results are delivered by the completion worker
             for model_name, model_requests in model_groups.items():
-                self._batch_inference(model_name, model_requests)
-            
-            # Updating performance statistics
-            inference_time = time.time() - start_time
-            self.performance_stats['total_inferences'] += len(requests)
-            self.performance_stats['total_time'] += inference_time
-            self.performance_stats['avg_latency'] = (
-                self.performance_stats['total_time'] / 
-                self.performance_stats['total_inferences']
-            )
-            self.performance_stats['throughput'] = (
-                self.performance_stats['total_inferences'] / 
-                self.performance_stats['total_time']
-            )
+                self._batch_inference(model_name, model_requests, start_time)
             
         except Exception as e:
             logger.error(f"Batch reasoning to handle errors: {e}")
     
-    def _batch_inference(self, model_name: str, requests: List[dict]):
-        """执行批量推理"""
+    def _record_batch(self, batch_size: int, start_time: float):
+        """Updating performance statistics for a completed batch"""
+        inference_time = time.time() - start_time
+        self.performance_stats['total_inferences'] += batch_size
+        self.performance_stats['total_time'] += inference_time
+        self.performance_stats['avg_latency'] = (
+            self.performance_stats['total_time'] / 
+            self.performance_stats['total_inferences']
+        )
+        self.performance_stats['throughput'] = (
+            self.performance_stats['total_inferences'] / 
+            self.performance_stats['total_time']
+        )
+    
+    def _batch_inference(self, model_name: str, requests: List[dict], start_time: float):
+        """Queue a batch for the sender threads, waiting only for a free model slot"""
+        if not requests:
+            return
+        
+        model_slots = self._get_model_slots(model_name)
+        model_slots.acquire()
+        # Sequence numbers let the senders deliver results in the order batches were queued
+        with self.completion_lock:
+            sequence = self.sent_batches
+            self.sent_batches += 1
+        self.send_queue.put((sequence, model_name, requests, model_slots, start_time))
+    
+    def _sender_worker(self):
+        """Send queued batches and wait on their results with this thread's own client"""
+        triton_client = httpclient.InferenceServerClient(url=self.triton_url)
+        while True:
+            sequence, model_name, requests, model_slots, start_time = self.send_queue.get()
+            output_data, error = None, None
+            try:
+                # Joining the (1, frames, H, W, C) windows into one batch input
+                batch_input = np.concatenate([req['input_data'] for req in requests], axis=0)
+                
+                # Creating an input tensor
+                input_name = requests[0]['input_name']
+                output_name = requests[0]['output_name']
+                
+                input_tensor = httpclient.InferInput(input_name, batch_input.shape, 
+                                                     np_to_triton_dtype(batch_input.dtype))
+                input_tensor.set_data_from_numpy(batch_input)
+                output_tensor = httpclient.InferRequestedOutput(output_name)
+                
+                response = triton_client.infer(
+                    model_name, inputs=[input_tensor], outputs=[output_tensor]
+                )
+                output_data = response.as_numpy(output_name)
+            except Exception as e:
+                error = e
+            self._complete_batch(sequence, (output_data, error, requests, model_slots, start_time))
+    
+    def _complete_batch(self, sequence: int, outcome: tuple):
+        """Hold a finished batch until every earlier batch has been delivered"""
+        with self.completion_lock:
+            self.completed[sequence] = outcome
+            while self.delivered_batches in self.completed:
+                outcome = self.completed.pop(self.delivered_batches)
+                self.delivered_batches += 1
+                self._deliver_batch(*outcome)
+    
+    def _deliver_batch(self, output_data: Optional[np.ndarray], error: Optional[Exception], 
+                       requests: List[dict], model_slots: threading.BoundedSemaphore, start_time: float):
+        """Deliver the results of a batch to the callbacks of its requests"""
         try:
-            # Preparing for batch entry
-            batch_data = []
-            for req in requests:
-                batch_data.append(req['input_data'])
-            
-            if not batch_data:
-                return
-            
-            # Stacking for batch input
-            batch_input = np.stack(batch_data, axis=0)
-            
-            # Creating an input tensor
-            input_name = requests[0]['input_name']
-            output_name = requests[0]['output_name']
-            
-            input_tensor = httpclient.InferInput(input_name, batch_input.shape, "FP32")
-            input_tensor.set_data_from_numpy(batch_input)
-            
-            # executive reasoning
-            response = self.triton_client.infer(model_name, inputs=[input_tensor])
-            output_data = response.as_numpy(output_name)
+            if error is not None:
+                raise error
+            self._record_batch(len(requests), start_time)
             
             # Distribution of results
             for i, req in enumerate(requests):
@@ -139,13 +223,16 @@ class OptimizedInferenceEngine:
                 }
                 
                 # Calling Callback Functions
-                if 'callback' in req:
+                if req.get('callback'):
                     req['callback'](result)
                 
         except InferenceServerException as e:
             logger.error(f"Triton Reasoning Error: {e}")
         except Exception as e:
             logger.error(f"Batch reasoning error: {e}")
+        finally:
+            model_slots.release()
+            self._release_deployments(requests)
     
     def _calculate_confidence(self, output_data: np.ndarray) -> float:
         """Calculate the confidence level"""
@@ -159,11 +246,19 @@ class OptimizedInferenceEngine:
                         model_name: str, class_list: List[str], 
                         input_name: str, output_name: str, 
                         callback=None) -> bool:
-        """Submission of reasoning requests"""
+        """Submission of reasoning requests, rejected while the deployment has
+        max_inflight_per_deployment windows queued or on the server"""
+        with self.inflight_lock:
+            inflight = self.deployment_inflight.get(deployment_id, 0)
+            if inflight >= self.max_inflight_per_deployment:
+                return False
+            self.deployment_inflight[deployment_id] = inflight + 1
+        
         try:
             request = {
                 'deployment_id': deployment_id,
-                'input_data': input_data,
+                # Copied out of the frame ring, it may wait in the queue while the ring moves on
+                'input_data': np.array(input_data, copy=True),
                 'model_name': model_name,
                 'class_list': class_list,
                 'input_name': input_name,
@@ -172,13 +267,21 @@ class OptimizedInferenceEngine:
                 'timestamp': time.time()
             }
             
-            self.inference_queue.put(request, block=False)
-            return True
+            # Backpressure: drop the oldest queued request rather than the new one
+            while True:
+                try:
+                    self.inference_queue.put(request, block=False)
+                    return True
+                except queue.Full:
+                    try:
+                        dropped = self.inference_queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self._release_deployments([dropped])
+                    logger.warning(f"Reasoning queue is full, dropped the oldest request of deployment {dropped['deployment_id']}")
             
-        except queue.Full:
-            logger.warning(f"Reasoning queue is full, discarding deployment {deployment_id} such requests")
-            return False
         except Exception as e:
+            self._release_deployments([{'deployment_id': deployment_id}])
             logger.error(f"Submit reasoning request error: {e}")
             return False
     
@@ -187,61 +290,82 @@ class OptimizedInferenceEngine:
         return self.performance_stats.copy()
 
 class AdvancedFrameProcessor:
-    """Advanced Frame Processor"""
+    """Advanced Frame Processor
+    
+    Frames are preprocessed with the node's cached plans
+    (modules/preprocessing.py), one per input geometry.
+    """
     
-    def __init__(self, width: int, height: int):
+    def __init__(self, width: int, height: int, crop_policy: str = 'none'):
         self.width = width
         self.height = height
-        self.frame_cache = {}
+        self.crop_policy = crop_policy
+    
+    def get_plan(self, input_shape: tuple, pixel_format: Optional[str] = None):
+        """Getting the cached plan for an input geometry"""
+        if pixel_format is None:
+            pixel_format = 'RGBA' if len(input_shape) > 2 and input_shape[2] == 4 else 'RGB'
+        return GetPreprocessPlan(input_shape[0], input_shape[1], pixel_format, 
+                                 self.height, self.width, self.crop_policy)
         
     def preprocess_frame_optimized(self, frame: np.ndarray, 
-                                 deployment_id: int) -> np.ndarray:
+                                 deployment_id: int,
+                                 out: Optional[np.ndarray] = None,
+                                 pixel_format: Optional[str] = None) -> np.ndarray:
         """Optimised frame pre-processing"""
         try:
-            # cache key
-            cache_key = f"{deployment_id}_{frame.shape}"
-            
-            # Check if pre-processing parameters need to be recalculated
-            if cache_key not in self.frame_cache:
-                self.frame_cache[cache_key] = self._calculate_preprocess_params(frame.shape)
-            
-            params = self.frame_cache[cache_key]
-            
-            # Application preprocessing
-            if len(frame.shape) == 4:  # RGBA
-                frame_resized = cv2.resize(frame, (self.width, self.height))
-                frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_RGBA2RGB)
-            else:  # RGB
-                frame_resized = cv2.resize(frame, (self.width, self.height))
-                frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-            
-            # normalisation
-            normalized_frame = frame_rgb.astype('float32') / 255.0
-            
-            # Optional data augmentation (not normally used in reasoning)
-            # normalized_frame = self._apply_inference_augmentation(normalized_frame)
-            
-            return normalized_frame
+            return PreprocessInto(self.get_plan(frame.shape, pixel_format), frame, out)
             
         except Exception as e:
             logger.error(f"frame prep error: {e}")
             return None
     
-    def _calculate_preprocess_params(self, input_shape: tuple) -> dict:
-        """Calculation of pre-processing parameters"""
-        return {
-            'input_height': input_shape[0] if len(input_shape) > 0 else 1080,
-            'input_width': input_shape[1] if len(input_shape) > 1 else 1920,
-            'channels': input_shape[2] if len(input_shape) > 2 else 3
-        }
+    def preprocess_batch_optimized(self, frames: List[np.ndarray],
+                                   out: Optional[np.ndarray] = None,
+                                   pixel_format: Optional[str] = None) -> np.ndarray:
+        """Optimised pre-processing of several frames with the same geometry"""
+        try:
+            return PreprocessBatchInto(self.get_plan(frames[0].shape, pixel_format), frames, out)
+            
+        except Exception as e:
+            logger.error(f"batch frame prep error: {e}")
+            return None
+
+class FrameRingBuffer:
+    """Preallocated frame ring for one deployment
+    
+    Frames live in a single (1, 2 * capacity, H, W, C) array and every slot is
+    written twice (slot and slot + capacity), so the latest n frames are always
+    one contiguous (1, n, H, W, C) view, even after the ring wraps.
+    """
+    
+    def __init__(self, frame_shape: tuple, capacity: int, dtype=np.float32):
+        self.capacity = capacity
+        self.storage = np.zeros((1, 2 * capacity) + tuple(frame_shape), dtype=dtype)
+        self.position = 0
+        self.filled = 0
+    
+    def next_slot(self) -> np.ndarray:
+        """Slot the next frame should be written into"""
+        return self.storage[0, self.position]
+    
+    def commit(self):
+        """Publish the frame written into the current slot"""
+        self.storage[0, self.position + self.capacity] = self.storage[0, self.position]
+        self.position = (self.position + 1) % self.capacity
+        self.filled = min(self.filled + 1, self.capacity)
     
-    def _apply_inference_augmentation(self, frame: np.ndarray) -> np.ndarray:
-        """Lightweight enhancements for reasoning (optional)"""
-        # Usually inference is done without data augmentation, but some normalisation can be added
-        return frame
+    def latest(self, num_frames: int) -> np.ndarray:
+        """Contiguous view of the latest frames, oldest first"""
+        end = self.position + self.capacity
+        return self.storage[:, end - num_frames:end]
 
 class SmartFrameBuffer:
-    """Intelligent Frame Buffer Manager"""
+    """Intelligent Frame Buffer Manager
+    
+    Each deployment gets a FrameRingBuffer holding two windows, so a window
+    handed to the inference engine is not overwritten while the next one fills.
+    """
     
     def __init__(self, max_deployments: int = 50):
         self.max_deployments = max_deployments
@@ -249,47 +373,83 @@ class SmartFrameBuffer:
         self.buffer_stats = {}
         self.lock = threading.Lock()
     
+    def _get_ring(self, deployment_id: int, frame_shape: tuple, 
+                  max_frames: int, dtype=np.float32) -> FrameRingBuffer:
+        """Getting (or allocating) the ring for a deployment"""
+        ring = self.buffers.get(deployment_id)
+        if (ring is None or ring.capacity != 2 * max_frames or 
+                ring.storage.shape[2:] != tuple(frame_shape) or 
+                ring.storage.dtype != np.dtype(dtype)):
+            ring = FrameRingBuffer(frame_shape, 2 * max_frames, dtype)
+            self.buffers[deployment_id] = ring
+            self.buffer_stats[deployment_id] = {
+                'total_frames': 0,
+                'dropped_frames': 0,
+                'window_frames': 0,
+                'last_update': time.time()
+            }
+        return ring
+    
+    def next_slot(self, deployment_id: int, frame_shape: tuple, 
+                  max_frames: int = 20, dtype=np.float32) -> Optional[np.ndarray]:
+        """Slot to preprocess the next frame into, None if the window is already full"""
+        with self.lock:
+            self._get_ring(deployment_id, frame_shape, max_frames, dtype)
+            if self.buffer_stats[deployment_id]['window_frames'] >= max_frames:
+                self.buffer_stats[deployment_id]['dropped_frames'] += 1
+                return None
+            return self.buffers[deployment_id].next_slot()
+    
+    def commit_frame(self, deployment_id: int):
+        """Publish the frame written into the slot from next_slot"""
+        with self.lock:
+            self.buffers[deployment_id].commit()
+            stats = self.buffer_stats[deployment_id]
+            stats['window_frames'] += 1
+            stats['total_frames'] += 1
+            stats['last_update'] = time.time()
+    
     def add_frame(self, deployment_id: int, frame: np.ndarray, 
                   max_frames: int = 20) -> bool:
         """Adding frames to the buffer"""
-        with self.lock:
-            if deployment_id not in self.buffers:
-                self.buffers[deployment_id] = deque(maxlen=max_frames)
-                self.buffer_stats[deployment_id] = {
-                    'total_frames': 0,
-                    'dropped_frames': 0,
-                    'last_update': time.time()
-                }
-            
-            # Check if the buffer is full
-            if len(self.buffers[deployment_id]) >= max_frames:
-                self.buffer_stats[deployment_id]['dropped_frames'] += 1
-                return False
-            
-            self.buffers[deployment_id].append(frame)
-            self.buffer_stats[deployment_id]['total_frames'] += 1
-            self.buffer_stats[deployment_id]['last_update'] = time.time()
-            return True
+        slot = self.next_slot(deployment_id, frame.shape, max_frames, frame.dtype)
+        if slot is None:
+            return False
+        slot[...] = frame
+        self.commit_frame(deployment_id)
+        return True
     
-    def get_frames(self, deployment_id: int, num_frames: int) -> Optional[np.ndarray]:
-        """Get the specified number of frames"""
+    def get_window(self, deployment_id: int, num_frames: int, 
+                   hop: Optional[int] = None) -> Optional[np.ndarray]:
+        """Get the latest frames as a (1, num_frames, H, W, C) view without copying
+        
+        A window is only returned once hop new frames (num_frames by default)
+        have arrived since the last one was consumed, so with a smaller hop
+        consecutive windows overlap and reuse frames already in the ring.
+        """
         with self.lock:
             if deployment_id not in self.buffers:
                 return None
             
-            buffer = self.buffers[deployment_id]
-            if len(buffer) < num_frames:
+            ring = self.buffers[deployment_id]
+            if ring.filled < num_frames:
+                return None
+            
+            if self.buffer_stats[deployment_id]['window_frames'] < (hop or num_frames):
                 return None
             
-            # Get the latest frame
-            frames = list(buffer)[-num_frames:]
-            return np.stack(frames, axis=0)
+            return ring.latest(num_frames)
+    
+    def get_frames(self, deployment_id: int, num_frames: int) -> Optional[np.ndarray]:
+        """Get the specified number of frames"""
+        window = self.get_window(deployment_id, num_frames)
+        return None if window is None else window[0]
     
     def clear_buffer(self, deployment_id: int):
-        """Empty the buffer for a given deployment"""
+        """Mark the current window as consumed, frames stay in the ring for overlapping windows"""
         with self.lock:
-            if deployment_id in self.buffers:
-                self.buffers[deployment_id].clear()
+            if deployment_id in self.buffer_stats:
+                self.buffer_stats[deployment_id]['window_frames'] = 0
     
     def get_buffer_stats(self, deployment_id: int) -> Optional[dict]:
         """Getting Buffer Statistics"""
@@ -394,8 +554,24 @@ async def OptimizedInference(pipeline, deployment_id: int, height: int, width: i
                            inference_engine: OptimizedInferenceEngine,
                            frame_processor: AdvancedFrameProcessor,
                            frame_buffer: SmartFrameBuffer,
-                           performance_monitor: PerformanceMonitor):
-    """Optimised reasoning process"""
+                           performance_monitor: PerformanceMonitor,
+                           frame_hop: Optional[int] = None,
+                           frame_step: int = 1,
+                           input_dtype: str = 'float32'):
+    """Optimised reasoning process
+    
+    A new window is submitted every frame_hop frames (frame_count by default),
+    sliding over the ring instead of refilling it after each inference.
+    Only every frame_step'th sample is mapped and preprocessed, matching the
+    frame step the model was trained with.
+    With input_dtype uint8 frames are kept as raw uint8 in the ring for models
+    exported with SaveServingModel(..., 'uint8').
+    """
+    frame_hop = min(max(frame_hop or frame_count, 1), frame_count)
+    frame_step = max(frame_step, 1)
+    # uint8 models cast and normalise within their graph, so frames stay uint8
+    input_dtype = np.dtype(input_dtype)
+    samples_seen = 0
     
     def inference_callback(result):
         """Inference result callback"""
@@ -425,6 +601,11 @@ async def OptimizedInference(pipeline, deployment_id: int, height: int, width: i
                     await asyncio.sleep(0.1)
                     continue
                 
+                # Skip samples between training frame steps before mapping them
+                samples_seen += 1
+                if (samples_seen - 1) % frame_step:
+                    continue
+                
                 # processing frame
                 start_time = time.time()
                 
@@ -436,28 +617,38 @@ async def OptimizedInference(pipeline, deployment_id: int, height: int, width: i
                     continue
                 
                 try:
-                    # Load and preprocess frames
-                    input_height, input_width = 1080, 1920
+                    # Load frames using the geometry negotiated by the branch caps
+                    caps = sample.get_caps().get_structure(0)
+                    input_height = caps.get_value('height')
+                    input_width = caps.get_value('width')
+                    pixel_format = caps.get_value('format')
+                    channels = 3 if pixel_format in ('RGB', 'BGR') else 4
                     buffered_data = np.frombuffer(map_info.data, dtype=np.uint8)
-                    frame = buffered_data.reshape((input_height, input_width, 4))
+                    row_stride = buffered_data.size // input_height
+                    frame = buffered_data[:row_stride * input_height].reshape(
+                        (input_height, row_stride)
+                    )[:, :input_width * channels].reshape((input_height, input_width, channels))
+                    
+                    # Preprocess straight into the next slot of the frame buffer
+                    slot = frame_buffer.next_slot(
+                        deployment_id, (height, width, 3), frame_count, input_dtype
+                    )
+                    if slot is None:
+                        continue
                     
                     processed_frame = frame_processor.preprocess_frame_optimized(
-                        frame, deployment_id
+                        frame, deployment_id, out=slot, pixel_format=pixel_format
                     )
                     
                     if processed_frame is None:
                         continue
                     
-                    # Add to frame buffer
-                    if not frame_buffer.add_frame(deployment_id, processed_frame, frame_count):
-                        continue
+                    frame_buffer.commit_frame(deployment_id)
                     
                     # Check if there are enough frames for inference
-                    frames_batch = frame_buffer.get_frames(deployment_id, frame_count)
-                    if frames_batch is not None:
+                    input_batch = frame_buffer.get_window(deployment_id, frame_count, frame_hop)
+                    if input_batch is not None:
                         # Submission of reasoning requests
-                        input_batch = np.expand_dims(frames_batch, axis=0)
-                        
                         success = inference_engine.submit_inference(
                             deployment_id=deployment_id,
                             input_data=input_batch,
@@ -469,7 +660,7 @@ async def OptimizedInference(pipeline, deployment_id: int, height: int, width: i
                         )
                         
                         if success:
-                            # Empty the buffer
+                            # Slide the window on by frame_hop frames
                             frame_buffer.clear_buffer(deployment_id)
                             
                             # Recording performance
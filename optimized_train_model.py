@@ -7,8 +7,11 @@ import os
 import numpy as np
 
 from load_data import FrameGenerator
+from train_model import ExtractData, NormaliseDataSet, PrefetchDataSet, InitialiseBatch, GetClassMaps
+from feature_cache import ExtractFeatures
+from cache_store import ClipCache
 from visualise_results import PlotHistory, GetConfusionResults, PlotConfusionMatrix
-from triton_packaging import CreateTritonPackage
+from triton_packaging import CreateTritonPackage, SaveServingModel, ExportSplitModels, WriteCompletionManifest
 
 class MultiHeadAttention(layers.Layer):
     """Customised Multi Attention Layers"""
@@ -93,23 +96,62 @@ class ResidualBlock(layers.Layer):
                                        return_sequences=True, padding='same')(inputs)
             return layers.Add()([shortcut, x])
 
+def CreateFrameEncoder(height, width, embedding_size=512):
+    """Per-frame encoder: frozen EfficientNetB0 + pooling + projection to an embedding"""
+    frame = layers.Input(shape=(height, width, 3), name='frame_input')
+    base_model = EfficientNetB0(weights='imagenet', include_top=False, 
+                               input_shape=(height, width, 3))
+    base_model.trainable = False  # Freeze pre-training weights
+    x = base_model(frame, training=False)
+    x = layers.GlobalAveragePooling2D(name='frame_features')(x)
+    embedding = layers.Dense(embedding_size, activation='relu', name='embedding')(x)
+    return Model(inputs=frame, outputs=embedding, name='frame_encoder')
+
+def CreateTemporalHead(frameCount, classCount, embedding_size=512):
+    """Temporal head: attention + LSTM + classifier over a sequence of frame embeddings"""
+    embeddings = layers.Input(shape=(frameCount, embedding_size), name='embedding_input')
+    x = TemporalClassifier(embeddings, classCount)
+    return Model(inputs=embeddings, outputs=x, name='temporal_head')
+
+def TemporalClassifier(x, classCount):
+    """Attention, chronological modelling and classification layers shared by both architectures"""
+    # Adding Attention Mechanisms
+    attention_layer = MultiHeadAttention(d_model=512, num_heads=8)
+    attention_output, _ = attention_layer(x, x, x)
+    
+    # chronological modelling
+    x = layers.LSTM(256, return_sequences=True, dropout=0.3)(attention_output)
+    x = layers.LSTM(128, dropout=0.3)(x)
+    
+    # taxon
+    x = layers.Dense(256, activation='relu')(x)
+    x = layers.Dropout(0.5)(x)
+    x = layers.Dense(128, activation='relu')(x)
+    x = layers.Dropout(0.3)(x)
+    
+    return layers.Dense(classCount, activation="softmax", name='head_output')(x)
+
 def CreateOptimizedModel(frameCount, height, width, path, use_pretrained=True):
-    """Creating an optimised model architecture"""
+    """Creating an optimised model architecture
+    
+    With use_pretrained the model is a per-frame encoder applied with
+    TimeDistributed followed by a temporal head, both nested models
+    ('frame_encoder' and 'temporal_head') so they can also be exported
+    and served separately (see ExportSplitModels).
+    """
     inputShape = (frameCount, height, width, 3)
     
+    # Number of access categories
+    classCount = sum(1 for _ in pathlib.Path(path+"/train").iterdir() if _.is_dir())
+    
     # input layer
     inputs = layers.Input(shape=inputShape, name='time_distributed_input')
     
     if use_pretrained:
-        # Using pre-trained EfficientNet as a feature extractor
-        base_model = EfficientNetB0(weights='imagenet', include_top=False, 
-                                   input_shape=(height, width, 3))
-        base_model.trainable = False  # Freeze pre-training weights
-        
-        # Apply pre-trained model to each frame
-        x = layers.TimeDistributed(base_model)(inputs)
-        x = layers.TimeDistributed(layers.GlobalAveragePooling2D())(x)
-        x = layers.TimeDistributed(layers.Dense(512, activation='relu'))(x)
+        # Using pre-trained EfficientNet as a per-frame feature extractor
+        encoder = CreateFrameEncoder(height, width)
+        x = layers.TimeDistributed(encoder)(inputs)
+        x = CreateTemporalHead(frameCount, classCount)(x)
     else:
         # Original ConvLSTM Architecture + Residual Connection
         x = layers.ConvLSTM2D(filters=64, kernel_size=(3, 3), activation='tanh',
@@ -130,27 +172,33 @@ def CreateOptimizedModel(frameCount, height, width, path, use_pretrained=True):
         x = ResidualBlock(512)(x)
         x = layers.GlobalAveragePooling3D()(x)
         x = layers.Reshape((frameCount, -1))(x)
+        x = TemporalClassifier(x, classCount)
     
-    # Adding Attention Mechanisms
-    attention_layer = MultiHeadAttention(d_model=512, num_heads=8)
-    attention_output, _ = attention_layer(x, x, x)
+    # Keep the served output named 'dense'
+    outputs = layers.Activation('linear', dtype='float32', name='dense')(x)
     
-    # chronological modelling
-    x = layers.LSTM(256, return_sequences=True, dropout=0.3)(attention_output)
-    x = layers.LSTM(128, dropout=0.3)(x)
+    model = Model(inputs=inputs, outputs=outputs)
+    return model
+
+def CreateFeatureModel(model, frameCount):
+    """Model trained on cached backbone features instead of frames
     
-    # taxon
-    x = layers.Dense(256, activation='relu')(x)
-    x = layers.Dropout(0.5)(x)
-    x = layers.Dense(128, activation='relu')(x)
-    x = layers.Dropout(0.3)(x)
+    Splits the frame encoder of a pretrained model at its frozen backbone.
+    The extractor (backbone + pooling) is run once over every clip by
+    ExtractFeatures, the training model applies the encoders projection
+    and the temporal head to the cached features. Both layers are shared
+    with the full model, so training one trains the other.
+    """
+    encoder = next(layer.layer for layer in model.layers 
+                   if isinstance(layer, layers.TimeDistributed) and layer.layer.name == 'frame_encoder')
+    extractor = Model(inputs=encoder.input, outputs=encoder.get_layer('frame_features').output, name='feature_extractor')
     
-    # Number of access categories
-    classCount = sum(1 for _ in pathlib.Path(path+"/train").iterdir() if _.is_dir())
-    outputs = layers.Dense(classCount, activation="softmax", name='dense')(x)
+    features = layers.Input(shape=(frameCount, extractor.output_shape[-1]), name='feature_input')
+    x = encoder.get_layer('embedding')(features)
+    x = model.get_layer('temporal_head')(x)
+    outputs = layers.Activation('linear', dtype='float32', name='dense')(x)
     
-    model = Model(inputs=inputs, outputs=outputs)
-    return model
+    return extractor, Model(inputs=features, outputs=outputs, name='feature_model')
 
 def CreateLearningRateScheduler():
     """Creating a learning rate scheduler"""
@@ -257,6 +305,15 @@ def main():
         parser.add_argument('--shuffle_size', type=int, default=300)
         parser.add_argument('--batch_size', type=int, default=4)
         parser.add_argument('--use_pretrained', type=bool, default=True)
+        parser.add_argument('--input_dtype', type=str, default="float32", choices=["float32", "uint8"])
+        parser.add_argument('--precision', type=str, default="float32", choices=["float32", "float16"])
+        parser.add_argument('--feature_cache', action='store_true')
+        parser.add_argument('--cache_offsets', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--cache_dir', type=str, default="/cache")
+        parser.add_argument('--cache_budget_gb', type=float, default=50)
+        parser.add_argument('--clip_offsets', type=int, default=4)
         args = parser.parse_args()
         
         modelName = args.model_name
@@ -265,6 +322,14 @@ def main():
         shuffleSize = args.shuffle_size
         batchSize = args.batch_size
         use_pretrained = args.use_pretrained
+        input_dtype = args.input_dtype
+        precision = args.precision
+        feature_cache = args.feature_cache and use_pretrained
+        cache_offsets = args.cache_offsets
+        workers = args.workers
+        seed = args.seed
+        clip_cache = ClipCache(args.cache_dir, int(args.cache_budget_gb * 1024 ** 3)) if args.cache_budget_gb > 0 else None
+        clip_offsets = args.clip_offsets
         
         height = 224
         width = 224
@@ -276,11 +341,12 @@ def main():
         os.makedirs('./logs', exist_ok=True)
         
         # Data loading and pre-processing
-        trainDS, valDS, testDS = ExtractData(folderPath, frameCount)
+        trainDS, valDS, testDS = ExtractData(folderPath, frameCount, workers=workers, seed=seed,
+                                             cache=clip_cache, offsetCount=clip_offsets)
         AUTOTUNE = tf.data.AUTOTUNE
         
-        trainDS, valDS, testDS = InitialiseCache(trainDS, valDS, testDS)
-        trainDS, valDS, testDS = PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize)
+        trainDS, valDS, testDS = NormaliseDataSet(trainDS, valDS, testDS)
+        trainDS, valDS, testDS = PrefetchDataSet(trainDS, valDS, testDS, AUTOTUNE, shuffleSize, seed)
         trainDS, valDS, testDS = InitialiseBatch(trainDS, valDS, testDS, batchSize)
         
         # Creating optimised models
@@ -288,35 +354,57 @@ def main():
         
         print(f"Number of model parameters: {model.count_params():,}")
         
+        # The backbone is frozen, so with a feature cache it is run once over
+        # every clip and only the projection and temporal head are trained
+        trainModel, fitTrainDS, fitValDS, fitTestDS = model, trainDS, valDS, testDS
+        if feature_cache:
+            extractor, trainModel = CreateFeatureModel(model, frameCount)
+            fitTrainDS, fitValDS, fitTestDS = ExtractFeatures(folderPath, args.cache_dir, extractor,
+                                                              frameCount, (height, width), offsetCount=cache_offsets)
+            fitTrainDS, fitValDS, fitTestDS = PrefetchDataSet(fitTrainDS, fitValDS, fitTestDS, AUTOTUNE, shuffleSize, seed)
+            fitTrainDS, fitValDS, fitTestDS = InitialiseBatch(fitTrainDS, fitValDS, fitTestDS, batchSize)
+        
         # Optimising the training process
-        history = OptimizedTraining(model, trainDS, valDS, testDS, epochs, modelName, folderPath)
+        history = OptimizedTraining(trainModel, fitTrainDS, fitValDS, fitTestDS, epochs, modelName, folderPath)
         
         # Visualisation results
         PlotHistory(history, modelName, folderPath)
         
         # assessment model
-        test_results = model.evaluate(testDS, return_dict=True)
+        test_results = trainModel.evaluate(fitTestDS, return_dict=True)
         print(f"Testing accuracy: {test_results['accuracy']:.4f}")
         print(f"Top-K Accuracy: {test_results['top_k_categorical_accuracy']:.4f}")
         
         # Generate Confusion Matrix
         labels = GetClassMaps(folderPath, frameCount)
         
-        actual, predicted = GetConfusionResults(model, trainDS)
+        actual, predicted = GetConfusionResults(trainModel, fitTrainDS)
         PlotConfusionMatrix(actual, predicted, labels, 'training', modelName, folderPath)
         
-        actual, predicted = GetConfusionResults(model, testDS)
+        actual, predicted = GetConfusionResults(trainModel, fitTestDS)
         PlotConfusionMatrix(actual, predicted, labels, 'test', modelName, folderPath)
         
-        # Save the model
-        model.save(os.path.join(folderPath, modelName), save_format='tf')
+        # Save the model, uint8 models cast and normalise frames within the serving graph
+        # float16 models are rebuilt with half weights and checked against the test clips
+        input_dtype = SaveServingModel(
+            model, modelName, folderPath, input_dtype, precision,
+            lambda: CreateOptimizedModel(frameCount, height, width, folderPath, use_pretrained),
+            testDS
+        )
+        
+        # Export the frame encoder and temporal head as their own Triton models,
+        # so nodes can encode each frame once rather than once per window
+        split_models = ExportSplitModels(model, modelName, folderPath, repoPath, input_dtype)
         
         # Creating a Triton Package
         CreateTritonPackage(labels, modelName, folderPath, repoPath, epochs, 
-                          frameCount, shuffleSize, batchSize, height, width)
+                          frameCount, shuffleSize, batchSize, height, width,
+                          inputDtype=input_dtype, splitModels=split_models)
+        
+        # Record completion, PyTrain releases the container once it exits
+        WriteCompletionManifest(modelName, folderPath, repoPath, split_models)
         
         print("Model training complete！")
-        input("Press Enter to continue...")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file